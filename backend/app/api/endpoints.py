@@ -1,14 +1,29 @@
-from typing import Dict, Any
-from fastapi import APIRouter, Depends, UploadFile, File, Header, status, HTTPException, Request, BackgroundTasks
-from fastapi.responses import Response, JSONResponse
+from typing import Dict, Any, List, Optional, Tuple, BinaryIO, Iterator
+from fastapi import APIRouter, Depends, UploadFile, File, Header, Query, status, HTTPException, Request
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from ..services.auth import auth_service
-from ..services.pdf import pdf_service
-from ..services.stripe import stripe_service
-from ..core.storage import storage
+from ..services import pdf_service, stripe_service, storage
+from ..services.jobs import ConversionJob, job_service, HTTP_499_CLIENT_CLOSED_REQUEST
+from ..services.coalesce import conversion_coalescer
+from ..services.batch import batch_service
+from ..services.uploads import upload_service
+from ..services.entitlements import entitlement_service
+from ..services.webhooks import webhook_service
 from ..core.config import settings
+from ..core.readiness import LazyService, readiness
+from ..core.worker import worker_stats
+import asyncio
+import hashlib
 import logging
+import os
+import re
+import shutil
+import tempfile
+import time
 import traceback
+from urllib.parse import quote, urljoin
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -16,11 +31,52 @@ logger = logging.getLogger(__name__)
 # Create router
 router = APIRouter()
 
+# Client supplied job ids, so progress can be watched before the upload finishes
+JOB_ID_PATTERN = r"^[A-Za-z0-9_-]{8,64}$"
+
+# How /convert returns the result: the PDF itself, or a signed URL to download it from
+DELIVERY_PATTERN = r"^(inline|url)$"
+
+# Size of the reads a download is streamed from disk in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# A single byte range, "first-last", "first-" or "-suffix"
+BYTE_RANGE_PATTERN = re.compile(r"(\d*)-(\d*)", re.ASCII)
+
 async def get_token_data(authorization: str = Header(None)) -> Dict[str, Any]:
     """Dependency for verifying the authorization token."""
     token = authorization.replace('Bearer ', '') if authorization else None
     return auth_service.verify_token(token)
 
+async def get_stream_token_data(
+    authorization: str = Header(None),
+    access_token: Optional[str] = Query(None)
+) -> Dict[str, Any]:
+    """Like ``get_token_data``, but also accepts the token as ``?access_token=``.
+
+    The browser's ``EventSource`` cannot set headers, so Server-Sent Event
+    streams take the Supabase access token from the query string instead.
+    """
+    if authorization:
+        return await get_token_data(authorization)
+    return auth_service.verify_token(access_token)
+
+def require(*services: LazyService):
+    """Dependency creating ``services``, off the event loop, before the endpoint runs.
+
+    Responds 503 if one of them can't be created, e.g. while its backend is down.
+    """
+    async def load_services():
+        for service in services:
+            try:
+                await service.load_async()
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail=f"Service {service.name} is unavailable: {str(e)}"
+                )
+    return Depends(load_services)
+
 @router.get("/health")
 async def health_check(token_data: Dict[str, Any] = Depends(get_token_data)) -> Dict[str, str]:
     """Check if the server is running and PDF processing is available."""
@@ -29,22 +85,118 @@ async def health_check(token_data: Dict[str, Any] = Depends(get_token_data)) ->
         "message": "Server is running and PDF processing is available"
     }
 
-async def cleanup_files(input_path: str, output_path: str):
+@router.get("/livez")
+async def liveness_check() -> Dict[str, str]:
+    """Report that the process is up and serving requests."""
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readiness_check() -> JSONResponse:
+    """Report which subsystems are warm and how many conversions are waiting.
+
+    Returns 503 until every subsystem is ready, so load balancers only route
+    traffic here once it can be served. ``queue_depth`` is the number of
+    conversions waiting for a slot and is meant as a scaling signal. Both
+    describe the worker answering, one of ``WORKERS``.
+    """
+    body = readiness.snapshot()
+    body["queue_depth"] = job_service.queued
+    body["in_flight"] = worker_stats.in_flight
+    return JSONResponse(
+        content=body,
+        status_code=status.HTTP_200_OK if readiness.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+async def cleanup_files(*paths: str):
     """Background task to clean up files after they've been processed."""
     try:
-        await storage.delete_file(input_path)
-        await storage.delete_file(output_path)
-        logger.info(f"Cleaned up files: {input_path}, {output_path}")
+        for path in paths:
+            await storage.delete_file(path)
+        logger.info(f"Cleaned up files: {', '.join(paths)}")
     except Exception as e:
         logger.error(f"Error cleaning up files: {str(e)}")
 
-@router.post("/convert")
+async def convert_and_store(
+    content: bytes,
+    content_hash: str,
+    filename: str,
+    job: ConversionJob,
+    keep_result: bool
+) -> Tuple[bytes, Optional[str]]:
+    """Store the original, convert it and, if ``keep_result``, store the result.
+
+    Returns the converted PDF and the storage path of the result, which is
+    ``None`` unless it was kept for download URLs. This is the work
+    coalesced requests share, so it also cleans up after itself whichever of
+    them are still connected: the original is deleted once converted, and a
+    kept result once download URLs handed out for it expire. Deletions still
+    pending when the worker exits are left to ``sweep_expired_files``.
+    """
+    input_path = None
+    try:
+        # Upload original file to Supabase
+        input_path = await storage.upload_file(content, filename)
+        logger.debug(f"Uploaded original file to Supabase: {input_path}")
+        
+        # Start PDF conversion
+        logger.debug("Starting PDF conversion")
+        async with job_service.conversion_slot():
+            processed_content = await pdf_service.convert_to_bionic(content, filename, job, content_hash)
+        
+        # Inline results go straight into the response
+        if not keep_result:
+            return processed_content, None
+        
+        # Don't store a result nobody is waiting for
+        job.check_cancelled()
+        
+        # Upload converted file to Supabase
+        output_filename = f"converted_{filename}"
+        output_path = await storage.upload_file(processed_content, output_filename)
+        logger.debug(f"Uploaded converted file to Supabase: {output_path}")
+        schedule_cleanup(settings.SUPABASE_FILE_EXPIRY, output_path)
+        return processed_content, output_path
+    finally:
+        if input_path:
+            # Off the response's critical path, as the original is no longer needed
+            schedule_cleanup(0, input_path)
+
+def schedule_cleanup(delay: float, *paths: str):
+    """Delete stored files after ``delay`` seconds, without holding up the request."""
+    def start():
+        task = asyncio.create_task(cleanup_files(*paths))
+        _cleanup_tasks.add(task)
+        task.add_done_callback(_cleanup_tasks.discard)
+    asyncio.get_running_loop().call_later(delay, start)
+
+# Keeps scheduled cleanups alive until they finish
+_cleanup_tasks = set()
+
+@router.post("/convert", dependencies=[require(pdf_service, storage)])
 async def convert_pdf(
+    request: Request,
     file: UploadFile = File(...),
-    token_data: Dict[str, Any] = Depends(get_token_data),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    job_id: Optional[str] = Query(None, pattern=JOB_ID_PATTERN),
+    delivery: str = Query("inline", pattern=DELIVERY_PATTERN),
+    token_data: Dict[str, Any] = Depends(get_token_data)
 ) -> Response:
-    """Convert a PDF file to bionic reading format."""
+    """Convert a PDF file to bionic reading format.
+
+    Progress can be followed on ``/jobs/{job_id}/events``. Pass ``job_id`` to
+    pick the id up front; the id used is returned in the ``X-Job-Id`` header.
+    ``X-Pages-Converted`` and ``X-Pages-Passed-Through`` report how many pages
+    were rebuilt and how many, having no text to convert, were copied as is.
+    The conversion is cancelled if the client disconnects or it runs past
+    ``CONVERSION_TIMEOUT``.
+
+    Requests for a file that is already being converted wait for that
+    conversion instead of starting their own; ``X-Coalesced-With`` then
+    names the job that did the work, if it was the same user's.
+
+    With ``delivery=url`` the response is JSON with a signed ``url`` the
+    converted PDF can be downloaded from for ``SUPABASE_FILE_EXPIRY``
+    seconds, instead of the PDF itself.
+    """
     logger.debug(f"Starting conversion for file: {file.filename}")
     logger.debug(f"Token data: {token_data}")
     
@@ -55,48 +207,379 @@ async def convert_pdf(
             detail="Only PDF files are supported"
         )
     
-    # Read file content
-    content = await file.read()
+    # Read file content, no more than needed to tell it's too large
+    content = await file.read(settings.MAX_FILE_SIZE + 1)
+    if len(content) > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the maximum size of {settings.MAX_FILE_SIZE // (1024 * 1024)}MB"
+        )
     logger.debug("File validation passed")
     logger.debug(f"File size: {len(content)} bytes")
     
+    return await run_conversion(request, content, file.filename, job_id, delivery, token_data)
+
+async def run_conversion(
+    request: Request,
+    content: bytes,
+    filename: str,
+    job_id: Optional[str],
+    delivery: str,
+    token_data: Dict[str, Any],
+    content_hash: Optional[str] = None
+) -> Response:
+    """Convert a validated upload and respond as ``/convert`` describes.
+
+    Pass ``content_hash``, the SHA-256 of ``content``, if it is already known.
+    """
+    await entitlement_service.check(token_data.get('sub'), len(content))
+    
+    job = await job_service.create(token_data.get('sub'), filename, job_id)
+    worker_stats.job_started()
+    outcome = "failed"
+    
     try:
-        # Upload original file to Supabase
-        input_path = await storage.upload_file(content, file.filename)
-        logger.debug(f"Uploaded original file to Supabase: {input_path}")
+        # Conversions have no options yet, so identical content means an identical result;
+        # only requests for the same delivery share it, as it decides whether the result is kept.
+        # Hashing up to MAX_FILE_SIZE would stall the event loop; the digest is reused by the layout cache.
+        if content_hash is None:
+            content_hash = await run_in_threadpool(lambda: hashlib.sha256(content).hexdigest())
+        (processed_content, output_path), work_job = await conversion_coalescer.run(
+            conversion_coalescer.key(content_hash, delivery=delivery),
+            job,
+            request,
+            lambda work_job: convert_and_store(content, content_hash, filename, work_job, delivery == "url")
+        )
+        outcome = "completed"
         
-        # Start PDF conversion
-        logger.debug("Starting PDF conversion")
-        processed_content = await pdf_service.convert_to_bionic(content, file.filename)
+        download_name = f"{filename.replace('.pdf', '')}_bionic.pdf"
+        headers = {
+            "X-Job-Id": job.id,
+            "X-Pages-Converted": str(work_job.pages_converted),
+            "X-Pages-Passed-Through": str(work_job.pages_passed_through)
+        }
+        # Don't reveal another user's job id, or that they're converting the same file
+        if work_job is not job and work_job.user_id == job.user_id:
+            headers["X-Coalesced-With"] = work_job.id
         
-        # Upload converted file to Supabase
-        output_filename = f"converted_{file.filename}"
-        output_path = await storage.upload_file(processed_content, output_filename)
-        logger.debug(f"Uploaded converted file to Supabase: {output_path}")
+        if delivery == "url":
+            url = await storage.create_signed_url(output_path, settings.SUPABASE_FILE_EXPIRY, download_name)
+            return JSONResponse(
+                content={
+                    "job_id": job.id,
+                    # Local storage hands out URLs relative to this server
+                    "url": urljoin(str(request.base_url), url),
+                    "expires_in": settings.SUPABASE_FILE_EXPIRY,
+                    "filename": download_name,
+                    "pages_converted": work_job.pages_converted,
+                    "pages_passed_through": work_job.pages_passed_through
+                },
+                headers=headers
+            )
         
-        # Schedule cleanup after expiry time
-        background_tasks.add_task(cleanup_files, input_path, output_path)
+        headers["Content-Disposition"] = f"attachment; filename={download_name}"
         
         # Return the processed PDF
         return Response(
             content=processed_content,
             media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename={file.filename.replace('.pdf', '')}_bionic.pdf"
-            }
+            headers=headers
         )
         
+    except HTTPException as e:
+        logger.error(f"Conversion failed: {e.detail}")
+        if e.status_code == status.HTTP_507_INSUFFICIENT_STORAGE:
+            outcome = "over_memory"
+        elif e.status_code in (HTTP_499_CLIENT_CLOSED_REQUEST, status.HTTP_408_REQUEST_TIMEOUT):
+            outcome = "cancelled"
+        raise
     except Exception as e:
         logger.error("Conversion failed:", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+    finally:
+        job_service.release(job)
+        worker_stats.job_finished(outcome, job.memory_growth)
+
+def spool_upload(file: UploadFile):
+    """Copy an upload to a temp file we own, as the request's files are closed before a streamed response finishes."""
+    spool = tempfile.TemporaryFile()
+    shutil.copyfileobj(file.file, spool)
+    spool.seek(0)
+    return spool
+
+class UploadRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+
+@router.post("/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload: UploadRequest,
+    token_data: Dict[str, Any] = Depends(get_token_data)
+) -> Dict[str, Any]:
+    """Start a resumable upload of a PDF of ``size`` bytes.
+
+    The file is then sent in chunks of the returned ``chunk_size``: chunk
+    ``n`` goes to ``PUT /uploads/{upload_id}/chunks/{n}`` with its offset in
+    ``X-Upload-Offset`` and its SHA-256 in ``X-Chunk-SHA256``. Chunks can be
+    sent in any order and retried. ``GET /uploads/{upload_id}`` reports the
+    ranges received so far, and ``POST /uploads/{upload_id}/complete``
+    converts the file once it is all there, after checking it against
+    ``sha256``, the SHA-256 of the whole file, if one was given.
+    """
+    await entitlement_service.check(token_data.get('sub'), upload.size)
+    session = await run_in_threadpool(
+        upload_service.create,
+        token_data.get('sub'),
+        upload.filename,
+        upload.size,
+        upload.sha256
+    )
+    return await run_in_threadpool(session.snapshot)
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(
+    upload_id: str,
+    token_data: Dict[str, Any] = Depends(get_token_data)
+) -> Dict[str, Any]:
+    """Report which byte ranges of an upload have been received."""
+    session = await run_in_threadpool(upload_service.get, token_data.get('sub'), upload_id)
+    return await run_in_threadpool(session.snapshot)
+
+@router.put("/uploads/{upload_id}/chunks/{index}")
+async def put_upload_chunk(
+    request: Request,
+    upload_id: str,
+    index: int,
+    x_upload_offset: int = Header(...),
+    x_chunk_sha256: str = Header(...),
+    token_data: Dict[str, Any] = Depends(get_token_data)
+) -> Dict[str, Any]:
+    """Store one chunk of an upload, kept only if it matches its length and checksum."""
+    session = await run_in_threadpool(upload_service.get, token_data.get('sub'), upload_id)
+    await upload_service.write_chunk(session, index, x_upload_offset, x_chunk_sha256, request.stream())
+    return await run_in_threadpool(session.snapshot)
+
+@router.post("/uploads/{upload_id}/complete", dependencies=[require(pdf_service, storage)])
+async def complete_upload(
+    request: Request,
+    upload_id: str,
+    job_id: Optional[str] = Query(None, pattern=JOB_ID_PATTERN),
+    delivery: str = Query("inline", pattern=DELIVERY_PATTERN),
+    token_data: Dict[str, Any] = Depends(get_token_data)
+) -> Response:
+    """Convert a fully received upload, responding exactly like ``/convert``.
+
+    The upload is kept until the conversion succeeds, so a client that
+    loses the response can finalize again without re-sending the file.
+    """
+    session = await run_in_threadpool(upload_service.get, token_data.get('sub'), upload_id)
+    path, content_hash = await upload_service.assemble(session)
+    content = await run_in_threadpool(path.read_bytes)
+    response = await run_conversion(request, content, session.filename, job_id, delivery, token_data, content_hash)
+    await run_in_threadpool(upload_service.discard, session)
+    return response
+
+@router.post("/convert/batch", dependencies=[require(pdf_service)])
+async def convert_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    token_data: Dict[str, Any] = Depends(get_token_data)
+) -> StreamingResponse:
+    """Convert several PDF files and stream the results back as a ZIP archive.
+
+    Files queue for the worker's conversion slots alongside other requests,
+    and each is added to the archive as soon as it is done. The last entry,
+    ``manifest.json``, reports the outcome of every file, including failures.
+    """
+    if len(files) > settings.MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch can contain at most {settings.MAX_BATCH_FILES} files"
+        )
+    user_id = token_data.get('sub')
+    limits = await entitlement_service.limits(user_id)
+    
+    uploads = []
+    for index, file in enumerate(files):
+        uploads.append({
+            "index": index,
+            "filename": file.filename or f"document_{index + 1}.pdf",
+            "file": await run_in_threadpool(spool_upload, file)
+        })
+    logger.debug(f"Starting batch conversion of {len(uploads)} files")
+    
+    return StreamingResponse(
+        batch_service.stream_zip(request, uploads, user_id, limits["max_file_size"]),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": "attachment; filename=bionic_batch.zip"
+        }
+    )
+
+def parse_byte_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a ``Range`` header into ``(start, end)``, with ``end`` exclusive.
+
+    Returns ``None`` for headers that are ignored, so the whole file is sent:
+    units other than bytes, malformed values, including ranges ending before
+    they start, and requests for several ranges, as RFC 9110 allows.
+
+    Raises:
+        HTTPException: 416 if the range is valid but starts past the end of
+            the file, or asks for an empty suffix
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    match = BYTE_RANGE_PATTERN.fullmatch(spec.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last) + 1, size) if last else size
+    else:
+        # A suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches ``etag``, using weak comparison as RFC 9110 asks."""
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+def iter_file(file: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    """Yield ``file`` from ``start`` to ``end`` in chunks, closing it when done."""
+    try:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+@router.api_route("/files/{file_path}", methods=["GET", "HEAD"], dependencies=[require(storage)])
+async def download_file(
+    request: Request,
+    file_path: str,
+    expires: int = Query(...),
+    signature: str = Query(...),
+    download: Optional[str] = Query(None)
+) -> Response:
+    """Serve a stored file through a signed URL, when files are stored locally.
+
+    Stands in for Supabase's signed URLs in local deployments. The URL is
+    its own credential, so no token is needed; it stops working once
+    ``expires`` has passed.
+
+    The ``ETag`` is the SHA-256 of the file, so a client holding a copy gets
+    304 for ``If-None-Match``. Single byte ranges are answered with 206, as
+    PDF viewers load large documents incrementally; ``If-Range`` falls back
+    to the whole file if the copy it names is stale. The file is streamed
+    from disk, never read into memory whole.
+    """
+    if settings.STORAGE_BACKEND != "local":
+        raise HTTPException(status_code=404, detail="File not found")
+    if not storage.verify(file_path, expires, signature):
+        raise HTTPException(status_code=403, detail="Download link is invalid or has expired")
+    try:
+        file = await run_in_threadpool(open, storage.path(file_path), "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    try:
+        stat_result = os.fstat(file.fileno())
+        etag = f'"{await storage.content_hash(file_path, stat_result)}"'
+        size = stat_result.st_size
+        download_name = quote(download or file_path)
+        headers = {
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": f"private, max-age={max(0, expires - int(time.time()))}",
+            "Content-Disposition": f"attachment; filename*=utf-8''{download_name}"
+        }
+        
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            file.close()
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        
+        start, end = 0, size
+        status_code = status.HTTP_200_OK
+        range_header = request.headers.get("range")
+        if range_header and request.headers.get("if-range", etag) == etag:
+            byte_range = parse_byte_range(range_header, size)
+            if byte_range:
+                start, end = byte_range
+                status_code = status.HTTP_206_PARTIAL_CONTENT
+                headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        headers["Content-Length"] = str(end - start)
+        
+        if request.method == "HEAD":
+            file.close()
+            return Response(status_code=status_code, headers=headers, media_type="application/pdf")
+        return StreamingResponse(
+            iter_file(file, start, end),
+            status_code=status_code,
+            media_type="application/pdf",
+            headers=headers
+        )
+    except BaseException:
+        file.close()
+        raise
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(
+    job_id: str,
+    token_data: Dict[str, Any] = Depends(get_stream_token_data)
+) -> StreamingResponse:
+    """Stream per-page conversion progress as Server-Sent Events.
+
+    Browsers can subscribe with a plain ``EventSource`` by passing the
+    Supabase access token as ``?access_token=``, since ``EventSource``
+    cannot send an ``Authorization`` header.
+    """
+    job = await job_service.wait_for(token_data.get('sub'), job_id, timeout=10)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return StreamingResponse(
+        job_service.stream_events(job),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@router.get("/worker/stats")
+async def get_worker_stats(token_data: Dict[str, Any] = Depends(get_token_data)) -> Dict[str, Any]:
+    """Report conversion, memory, request coalescing and webhook stats for the worker serving this request."""
+    stats = worker_stats.snapshot()
+    stats["coalescing"] = conversion_coalescer.snapshot()
+    stats["webhooks"] = webhook_service.snapshot()
+    stats["entitlements"] = entitlement_service.snapshot()
+    return stats
 
 class CheckoutSessionRequest(BaseModel):
     price_id: str
 
-@router.post("/create-checkout-session")
+@router.post("/create-checkout-session", dependencies=[require(stripe_service)])
 async def create_checkout_session(
     request: CheckoutSessionRequest,
     token_data: Dict[str, Any] = Depends(get_token_data)
@@ -130,7 +613,7 @@ async def create_checkout_session(
             detail=str(e)
         )
 
-@router.post("/create-portal-session")
+@router.post("/create-portal-session", dependencies=[require(stripe_service)])
 async def create_portal_session(
     token_data: Dict[str, Any] = Depends(get_token_data)
 ) -> Dict[str, str]:
@@ -147,16 +630,22 @@ async def create_portal_session(
     
     return {"url": session.url}
 
-@router.post("/webhook")
+@router.post("/webhook", dependencies=[require(stripe_service)])
 async def stripe_webhook(
     request: Request,
     stripe_signature: str = Header(None)
 ) -> JSONResponse:
-    """Handle Stripe webhooks."""
+    """Acknowledge a Stripe webhook and apply it in the background.
+
+    The signature is checked and the event recorded before responding, so
+    an event acknowledged here is applied even if this worker exits first.
+    Events already received are acknowledged again but not applied twice.
+    """
     if not stripe_signature:
         raise HTTPException(status_code=400, detail="Missing stripe signature")
     
     payload = await request.body()
     
-    result = await stripe_service.handle_webhook(payload, stripe_signature)
-    return JSONResponse(content=result) 
\ No newline at end of file
+    event = stripe_service.construct_event(payload, stripe_signature)
+    queued = await webhook_service.receive(event)
+    return JSONResponse(content={"status": "accepted" if queued else "duplicate"}) 
\ No newline at end of file
@@ -1,6 +1,14 @@
 from typing import List, Optional
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# Allowance per uploaded file for multipart boundaries and part headers
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Seconds a draining worker allows, after the conversion deadline, for
+# storing the result and sending the response
+DRAIN_MARGIN = 30
+
 class Settings(BaseSettings):
     """Application settings."""
     
@@ -19,29 +27,80 @@ class Settings(BaseSettings):
     ]
     
     # Server Settings
+    ENVIRONMENT: str = "development"  # "production" runs supervised workers without the reloader
     HOST: str = "127.0.0.1"
     PORT: int = 3003
+    WORKERS: int = 0  # Production worker processes, 0 means one per CPU
+    KEEP_ALIVE_TIMEOUT: int = 5  # Seconds an idle keep-alive connection stays open
+    DRAIN_TIMEOUT: int = 0  # Seconds a stopping worker waits for in-flight requests, 0 derives it from CONVERSION_TIMEOUT
+    MAX_REQUEST_SIZE: int = 64 * 1024  # Body limit of JSON requests and webhooks; uploads are limited by MAX_FILE_SIZE and UPLOAD_CHUNK_SIZE
     
     # PDF Processing Settings
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
     SUPPORTED_FORMATS: List[str] = [".pdf"]
     
+    # Layout Cache Settings
+    LAYOUT_CACHE_DIR: str = ""  # Where analysed layouts are kept, defaults to a directory under the system temp dir
+    LAYOUT_CACHE_MAX_MB: int = 512  # Least recently used layouts are evicted past this size, 0 disables the cache
+    
+    # Conversion Job Settings
+    JOB_RETENTION_SECONDS: int = 60  # How long finished jobs stay visible to progress watchers
+    JOB_STATE_DIR: str = ""  # Where workers share job progress and in-flight conversions, defaults to a directory under the system temp dir; must be local to the host
+    WORKER_MEMORY_CEILING_MB: Optional[int] = None  # Worker RSS at which the conversion that grew most is aborted, 0 disables; defaults to 2048 in production and 0 otherwise
+    MAX_CONCURRENT_CONVERSIONS: int = 2  # Conversions a worker runs at once; above 1 they run in a pool of that many processes, as PyMuPDF can't share one
+    CONVERSION_TIMEOUT: int = 600  # Seconds before a conversion is cancelled, 0 disables the deadline (also sets DRAIN_TIMEOUT)
+    MAX_BATCH_FILES: int = 20  # Together with MAX_FILE_SIZE this limits the size of a batch request
+    
+    # Resumable Upload Settings
+    UPLOAD_DIR: str = ""  # Where uploads are assembled, defaults to a directory under the system temp dir
+    UPLOAD_CHUNK_SIZE: int = 5 * 1024 * 1024  # 5MB
+    UPLOAD_SESSION_TTL: int = 24 * 60 * 60  # Seconds an unfinished upload can be resumed for
+    
+    # Worker Recycling Settings (0 disables)
+    WORKER_MAX_JOBS: int = 0  # Restart a worker after this many conversions
+    WORKER_MAX_RSS_MB: int = 0  # Restart a worker once its RSS passes this size
+    
     # Stripe Settings
-    STRIPE_SECRET_KEY: str
-    STRIPE_WEBHOOK_SECRET: str
-    STRIPE_PRO_MONTHLY_PRICE_ID: str
-    STRIPE_PRO_YEARLY_PRICE_ID: str
-    STRIPE_ULTIMATE_MONTHLY_PRICE_ID: str
-    STRIPE_ULTIMATE_YEARLY_PRICE_ID: str
+    # Stripe and Supabase are optional here so offline tools like
+    # scripts/bulk_convert.py can run without them; the services that need
+    # them refuse to start when they are missing.
+    STRIPE_SECRET_KEY: Optional[str] = None
+    STRIPE_WEBHOOK_SECRET: Optional[str] = None
+    STRIPE_PRO_MONTHLY_PRICE_ID: Optional[str] = None
+    STRIPE_PRO_YEARLY_PRICE_ID: Optional[str] = None
+    STRIPE_ULTIMATE_MONTHLY_PRICE_ID: Optional[str] = None
+    STRIPE_ULTIMATE_YEARLY_PRICE_ID: Optional[str] = None
+    
+    # Subscription Settings
+    DEFAULT_TIER: str = "free"  # Tier of users without an active subscription, or of everyone without Supabase
+    ENTITLEMENT_CACHE_TTL: int = 300  # Seconds a worker trusts a cached tier before reading it again
+    WEBHOOK_DRAIN_TIMEOUT: int = 30  # Seconds a stopping worker waits to apply queued webhooks, longer than the 20s a failing event is retried for
     
     # Frontend URL for redirects
     FRONTEND_URL: str = "http://localhost:3000"
 
     # Supabase Settings
-    SUPABASE_URL: str
-    SUPABASE_KEY: str
+    SUPABASE_URL: Optional[str] = None
+    SUPABASE_KEY: Optional[str] = None
     SUPABASE_BUCKET_NAME: str = "conversions"
-    SUPABASE_FILE_EXPIRY: int = 300  # 5 minutes in seconds
+    SUPABASE_FILE_EXPIRY: int = 300  # 5 minutes in seconds, also how long download URLs stay valid
+    STORAGE_CLEANUP_INTERVAL: int = 600  # How often each worker deletes stored files past SUPABASE_FILE_EXPIRY, 0 disables
+    
+    # Storage Settings
+    STORAGE_BACKEND: str = "supabase"  # "local" keeps files on disk and serves download URLs from /files
+    LOCAL_STORAGE_DIR: str = ""  # Defaults to a directory under the system temp dir
+    FILE_URL_SECRET: Optional[str] = None  # Key signing local download URLs, generated in LOCAL_STORAGE_DIR if unset
+
+    @model_validator(mode="after")
+    def derive_limits(self) -> "Settings":
+        """Fill in the server limits that follow from the conversion settings."""
+        if self.WORKER_MEMORY_CEILING_MB is None:
+            # Enforcing the ceiling needs a supervisor to replace the worker, which costs the reloader in development
+            self.WORKER_MEMORY_CEILING_MB = 2048 if self.ENVIRONMENT == "production" else 0
+        if not self.DRAIN_TIMEOUT:
+            # Let in-flight conversions run to their deadline; without one, allow ten minutes
+            self.DRAIN_TIMEOUT = (self.CONVERSION_TIMEOUT or 600) + DRAIN_MARGIN
+        return self
 
     model_config = SettingsConfigDict(
         case_sensitive=True,
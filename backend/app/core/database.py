@@ -0,0 +1,15 @@
+from functools import lru_cache
+from .config import settings
+
+@lru_cache(maxsize=None)
+def get_client():
+    """Return the Supabase client used for database access, creating it on first use.
+
+    The client is imported here rather than at module level, as importing it
+    is slow and only billing needs the database.
+    """
+    from supabase import create_client
+
+    if not (settings.SUPABASE_URL and settings.SUPABASE_KEY):
+        raise Exception("Supabase is not configured. Set SUPABASE_URL and SUPABASE_KEY.")
+    return create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
@@ -0,0 +1,64 @@
+from typing import Iterable, List, Pattern, Tuple
+from starlette.exceptions import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from fastapi import status
+from fastapi.responses import JSONResponse
+import re
+
+def format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size // (1024 * 1024)}MB"
+    return f"{size // 1024}KB"
+
+class RequestSizeLimitMiddleware:
+    """Reject request bodies larger than their route allows with a 413.
+
+    ``route_limits`` lists ``(method, path pattern, limit)`` for the routes
+    taking uploads; every other request is held to ``max_size``. Requests
+    announcing a larger Content-Length are refused before any of the body is
+    read; chunked bodies are counted as they are received.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int, route_limits: Iterable[Tuple[str, str, int]] = ()):
+        self.app = app
+        self.max_size = max_size
+        self.route_limits: List[Tuple[str, Pattern, int]] = [
+            (method, re.compile(pattern), limit) for method, pattern, limit in route_limits
+        ]
+
+    def limit_for(self, scope: Scope) -> int:
+        for method, pattern, limit in self.route_limits:
+            if scope["method"] == method and pattern.fullmatch(scope["path"]):
+                return limit
+        return self.max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_size = self.limit_for(scope)
+        detail = f"Request body exceeds the maximum size of {format_size(max_size)}"
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > max_size:
+                response = JSONResponse(
+                    content={"detail": detail},
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    headers={"Connection": "close"}
+                )
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_size:
+                    # Raised inside the app, so the exception handlers turn it into a 413
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
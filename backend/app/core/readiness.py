@@ -0,0 +1,130 @@
+from typing import Dict, Any, Callable, Optional
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Delay between warm-up attempts for a subsystem that failed to start
+WARM_UP_RETRY_INTERVAL = 5.0
+
+class LazyService:
+    """Proxy for a service singleton that is only created when first needed.
+
+    Attribute access is forwarded to the real service, so callers use the
+    proxy exactly like the service itself. The factory runs at most once, from
+    the startup warm-up or ``load_async``; if it fails, the next use retries.
+
+    Creating a service can take seconds, so it never happens on the event
+    loop: async code awaits ``load_async`` before using a service, and
+    attribute access on a cold service from the loop raises instead of
+    stalling every request the worker is serving.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.required = required
+        self.state = "cold"
+        self.error: Optional[str] = None
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Any:
+        """Return the service, creating it if needed."""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self.state = "warming"
+                    started = time.monotonic()
+                    try:
+                        instance = self._factory()
+                    except Exception as e:
+                        self.state = "failed"
+                        self.error = str(e)
+                        raise
+                    self._instance = instance
+                    self.state = "ready"
+                    self.error = None
+                    logger.info(f"Service {self.name} ready in {time.monotonic() - started:.2f}s")
+        return self._instance
+
+    async def load_async(self) -> Any:
+        """Return the service, creating it in the threadpool if needed."""
+        if self._instance is not None:
+            return self._instance
+        return await run_in_threadpool(self.load)
+
+    def __getattr__(self, attr: str) -> Any:
+        if self._instance is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # Not on the event loop, so creating the service blocks nobody else
+                return getattr(self.load(), attr)
+            raise RuntimeError(f"Service {self.name} was used on the event loop before load_async")
+        return getattr(self._instance, attr)
+
+class Readiness:
+    """Tracks which lazily created subsystems are warm.
+
+    Only required subsystems decide readiness. Optional ones, like billing,
+    may be left unconfigured; the endpoints that need them fail on their own.
+    """
+
+    def __init__(self):
+        self.services: Dict[str, LazyService] = {}
+        self.started_at = time.time()
+
+    def lazy(self, name: str, factory: Callable[[], Any], required: bool = True) -> LazyService:
+        """Register a service to be created on first use or by ``warm_up``."""
+        service = LazyService(name, factory, required)
+        self.services[name] = service
+        return service
+
+    @property
+    def ready(self) -> bool:
+        return all(service.state == "ready" for service in self.services.values() if service.required)
+
+    async def warm_up(self):
+        """Create every registered service in the background.
+
+        Required services are retried until they start, logging each new
+        error once. Optional services get a single attempt; if that fails
+        they are left to be created on first use.
+        """
+        pending = list(self.services.values())
+        last_errors: Dict[str, str] = {}
+        while pending:
+            for service in list(pending):
+                try:
+                    await run_in_threadpool(service.load)
+                    pending.remove(service)
+                except Exception as e:
+                    if not service.required:
+                        logger.warning(f"Optional service {service.name} is unavailable: {str(e)}")
+                        pending.remove(service)
+                    elif last_errors.get(service.name) != str(e):
+                        logger.error(f"Warming up {service.name} failed, retrying: {str(e)}")
+                    last_errors[service.name] = str(e)
+            if any(service.required for service in pending):
+                await asyncio.sleep(WARM_UP_RETRY_INTERVAL)
+            else:
+                break
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return subsystem states as a JSON-serialisable dict."""
+        subsystems = {}
+        for name, service in self.services.items():
+            subsystems[name] = {"state": service.state, "required": service.required}
+            if service.error:
+                subsystems[name]["error"] = service.error
+        return {
+            "status": "ready" if self.ready else "warming",
+            "uptime": round(time.time() - self.started_at, 1),
+            "subsystems": subsystems
+        }
+
+readiness = Readiness()
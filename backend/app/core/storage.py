@@ -1,14 +1,31 @@
+from typing import Optional, Tuple
+from collections import OrderedDict
 from supabase import create_client, Client
+from starlette.concurrency import run_in_threadpool
+from urllib.parse import quote, urlencode
+from pathlib import Path
+import hashlib
+import hmac
 import os
+import secrets
 import tempfile
+import time
 from datetime import datetime, timedelta
 from .config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Name of the generated key signing local download URLs, in the storage directory
+URL_KEY_FILE = ".url_key"
+
+# Content hashes of stored files each worker remembers for download ETags
+HASH_CACHE_SIZE = 1024
+
 class SupabaseStorage:
     def __init__(self):
+        if not (settings.SUPABASE_URL and settings.SUPABASE_KEY):
+            raise Exception("Supabase is not configured. Set SUPABASE_URL and SUPABASE_KEY.")
         self.supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
         self._check_bucket_exists()
 
@@ -30,21 +47,7 @@ class SupabaseStorage:
             file_path = f"{timestamp}_{file_name}"
             
             logger.info(f"Uploading file to Supabase storage: {file_path}")
-            
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file.flush()
-                
-                # Upload to Supabase
-                self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).upload(
-                    file_path,
-                    temp_file.name
-                )
-            
-            # Clean up temp file
-            os.unlink(temp_file.name)
-            
+            await run_in_threadpool(self._upload, file_content, file_path)
             logger.info(f"File uploaded successfully: {file_path}")
             return file_path
             
@@ -52,26 +55,23 @@ class SupabaseStorage:
             logger.error(f"Error uploading file to Supabase: {str(e)}")
             raise
 
+    def _upload(self, file_content: bytes, file_path: str):
+        # The client uploads from a file on disk
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            temp_file.write(file_content)
+        try:
+            self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).upload(
+                file_path,
+                temp_file.name
+            )
+        finally:
+            os.unlink(temp_file.name)
+
     async def download_file(self, file_path: str) -> bytes:
         """Download a file from Supabase storage."""
         try:
             logger.info(f"Downloading file from Supabase storage: {file_path}")
-            
-            # Create temporary file to store the download
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                # Download from Supabase
-                self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).download(
-                    file_path,
-                    temp_file.name
-                )
-                
-                # Read the file content
-                with open(temp_file.name, 'rb') as f:
-                    content = f.read()
-                
-            # Clean up temp file
-            os.unlink(temp_file.name)
-            
+            content = await run_in_threadpool(self._download, file_path)
             logger.info(f"File downloaded successfully: {file_path}")
             return content
             
@@ -79,11 +79,41 @@ class SupabaseStorage:
             logger.error(f"Error downloading file from Supabase: {str(e)}")
             raise
 
+    def _download(self, file_path: str) -> bytes:
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            pass
+        try:
+            self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).download(
+                file_path,
+                temp_file.name
+            )
+            with open(temp_file.name, 'rb') as f:
+                return f.read()
+        finally:
+            os.unlink(temp_file.name)
+
+    async def create_signed_url(self, file_path: str, expires_in: int, download_name: Optional[str] = None) -> str:
+        """Return a URL the file can be downloaded from directly for ``expires_in`` seconds."""
+        try:
+            options = {"download": download_name} if download_name else None
+            signed = await run_in_threadpool(
+                self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).create_signed_url,
+                file_path,
+                expires_in,
+                options
+            )
+            if not signed.get("signedURL"):
+                raise Exception(f"Supabase returned no signed URL for {file_path}")
+            return signed["signedURL"]
+        except Exception as e:
+            logger.error(f"Error creating signed URL in Supabase: {str(e)}")
+            raise
+
     async def delete_file(self, file_path: str):
         """Delete a file from Supabase storage."""
         try:
             logger.info(f"Deleting file from Supabase storage: {file_path}")
-            self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).remove([file_path])
+            await run_in_threadpool(self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).remove, [file_path])
             logger.info(f"File deleted successfully: {file_path}")
         except Exception as e:
             logger.error(f"Error deleting file from Supabase: {str(e)}")
@@ -96,7 +126,7 @@ class SupabaseStorage:
             expiry_time = datetime.now() - timedelta(seconds=settings.SUPABASE_FILE_EXPIRY)
             
             # List all files
-            files = self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).list()
+            files = await run_in_threadpool(self.supabase.storage.from_(settings.SUPABASE_BUCKET_NAME).list)
             
             # Filter and delete old files
             for file in files:
@@ -118,5 +148,136 @@ class SupabaseStorage:
             logger.error(f"Error during file cleanup: {str(e)}")
             raise
 
+class LocalStorage:
+    """Keeps files on local disk, for deployments without Supabase.
+
+    Signed URLs point at the app's own ``/files`` route. They are signed with
+    ``FILE_URL_SECRET``, or else with a key generated once in the storage
+    directory, so every worker on the machine accepts URLs issued by any other.
+    """
+
+    def __init__(self):
+        self.root = Path(settings.LOCAL_STORAGE_DIR or os.path.join(tempfile.gettempdir(), "bionic-storage")).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._key = settings.FILE_URL_SECRET.encode() if settings.FILE_URL_SECRET else self._load_key()
+        # SHA-256 of recently stored or served files, by (path, mtime, size)
+        self._hashes: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        logger.info(f"Storing files locally in {self.root}")
+
+    def _load_key(self) -> bytes:
+        key_path = self.root / URL_KEY_FILE
+        if not key_path.exists():
+            # Link a fully written key into place, so concurrent workers agree on one
+            with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as temp_file:
+                temp_file.write(secrets.token_bytes(32))
+            try:
+                os.link(temp_file.name, key_path)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(temp_file.name)
+        return key_path.read_bytes()
+
+    def path(self, file_path: str) -> Path:
+        """Return where a stored file lives on disk, refusing paths outside the storage directory."""
+        path = (self.root / file_path).resolve()
+        if path.parent != self.root or path.name == URL_KEY_FILE:
+            raise FileNotFoundError(file_path)
+        return path
+
+    async def upload_file(self, file_content: bytes, file_name: str) -> str:
+        """Write a file to the storage directory and return its path."""
+        try:
+            # Same naming as in Supabase, plus a random part as several workers share the directory
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            file_path = f"{timestamp}_{secrets.token_hex(4)}_{Path(file_name).name}"
+            path = self.path(file_path)
+            
+            def write():
+                part_path = path.with_name(path.name + ".part")
+                part_path.write_bytes(file_content)
+                os.replace(part_path, path)
+            
+            await run_in_threadpool(write)
+            self._remember_hash(file_path, path.stat(), hashlib.sha256(file_content).hexdigest())
+            logger.info(f"File stored locally: {file_path}")
+            return file_path
+            
+        except Exception as e:
+            logger.error(f"Error storing file locally: {str(e)}")
+            raise
+
+    async def download_file(self, file_path: str) -> bytes:
+        """Read a file from the storage directory."""
+        return await run_in_threadpool(self.path(file_path).read_bytes)
+
+    async def content_hash(self, file_path: str, stat_result: os.stat_result) -> str:
+        """Return the SHA-256 of a stored file, hashing it only if this worker hasn't yet.
+
+        Stored files never change, as they are only ever written by renaming
+        a complete file into place, so the hash is remembered by path, mtime
+        and size.
+        """
+        key = (file_path, stat_result.st_mtime_ns, stat_result.st_size)
+        digest = self._hashes.get(key)
+        if digest is None:
+            def hash_file():
+                sha256 = hashlib.sha256()
+                with open(self.path(file_path), "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        sha256.update(chunk)
+                return sha256.hexdigest()
+            digest = await run_in_threadpool(hash_file)
+        self._remember_hash(file_path, stat_result, digest)
+        return digest
+
+    def _remember_hash(self, file_path: str, stat_result: os.stat_result, digest: str):
+        key = (file_path, stat_result.st_mtime_ns, stat_result.st_size)
+        self._hashes[key] = digest
+        self._hashes.move_to_end(key)
+        while len(self._hashes) > HASH_CACHE_SIZE:
+            self._hashes.popitem(last=False)
+
+    def sign(self, file_path: str, expires: int) -> str:
+        message = f"{file_path}\n{expires}".encode()
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()
+
+    def verify(self, file_path: str, expires: int, signature: str) -> bool:
+        """Check a signed URL's signature and that it has not expired."""
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self.sign(file_path, expires), signature)
+
+    async def create_signed_url(self, file_path: str, expires_in: int, download_name: Optional[str] = None) -> str:
+        """Return a URL on this app, relative to its root, that serves the file for ``expires_in`` seconds."""
+        expires = int(time.time()) + expires_in
+        query = {"expires": expires, "signature": self.sign(file_path, expires)}
+        if download_name:
+            query["download"] = download_name
+        return f"{settings.API_V1_STR}/files/{quote(file_path)}?{urlencode(query)}"
+
+    async def delete_file(self, file_path: str):
+        """Delete a file from the storage directory."""
+        try:
+            self.path(file_path).unlink(missing_ok=True)
+            logger.info(f"File deleted successfully: {file_path}")
+        except Exception as e:
+            logger.error(f"Error deleting local file: {str(e)}")
+            raise
+
+    async def cleanup_old_files(self):
+        """Delete files older than the expiry time."""
+        await run_in_threadpool(self._cleanup_old_files)
+
+    def _cleanup_old_files(self):
+        expiry_time = time.time() - settings.SUPABASE_FILE_EXPIRY
+        for path in self.root.iterdir():
+            try:
+                if path.name != URL_KEY_FILE and path.stat().st_mtime < expiry_time:
+                    path.unlink()
+                    logger.info(f"Deleted expired file: {path.name}")
+            except FileNotFoundError:
+                pass  # Deleted by another worker
+
 # Create a singleton instance
-storage = SupabaseStorage() 
\ No newline at end of file
+storage = LocalStorage() if settings.STORAGE_BACKEND == "local" else SupabaseStorage() 
\ No newline at end of file
@@ -0,0 +1,136 @@
+from typing import Dict, Any, Optional
+import logging
+import os
+import signal
+import time
+from .config import settings
+
+try:
+    import psutil
+except ImportError:  # Only needed where /proc is unavailable (e.g. Windows)
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def current_rss() -> Optional[int]:
+    """Return the resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+class WorkerStats:
+    """Conversion accounting for the current worker process.
+
+    Also decides when the worker should be recycled: long-lived workers never
+    give back the heap fragmented by large documents, so after
+    ``WORKER_MAX_JOBS`` conversions or once RSS passes ``WORKER_MAX_RSS_MB``
+    the worker shuts itself down gracefully and the supervisor in ``run.py``
+    starts a fresh one. Shutdown starts right away, without waiting for the
+    worker to go idle, which under sustained load it never does; uvicorn
+    stops taking new connections and lets in-flight conversions finish.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.jobs_started = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.jobs_over_memory = 0
+        self.jobs_cancelled = 0
+        self.in_flight = 0
+        self.peak_rss = 0
+        self.peak_job_growth = 0
+        self.recycle_reason: Optional[str] = None
+        self._recycling = False
+
+    def job_started(self):
+        self.jobs_started += 1
+        self.in_flight += 1
+
+    def job_finished(self, outcome: str, job_growth: int = 0):
+        """Record the end of a conversion and recycle the worker if it is due.
+
+        ``outcome`` is one of ``completed``, ``failed``, ``over_memory`` or
+        ``cancelled``; ``job_growth`` is the RSS growth credited to the job.
+        """
+        self.in_flight -= 1
+        if outcome == "completed":
+            self.jobs_completed += 1
+        elif outcome == "over_memory":
+            self.jobs_over_memory += 1
+        elif outcome == "cancelled":
+            self.jobs_cancelled += 1
+        else:
+            self.jobs_failed += 1
+        self.peak_job_growth = max(self.peak_job_growth, job_growth)
+
+        rss = current_rss()
+        if rss:
+            self.peak_rss = max(self.peak_rss, rss)
+
+        if self.recycle_reason is None:
+            reason = self._recycle_reason(rss)
+            if reason:
+                self.request_recycle(reason)
+
+    def request_recycle(self, reason: str):
+        """Start recycling the worker; conversions in flight are allowed to finish.
+
+        Safe to call from the converter threads.
+        """
+        if self.recycle_reason is None:
+            self.recycle_reason = reason
+            logger.warning(f"Worker {self.pid} will be recycled: {reason}")
+        self._recycle()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the worker stats as a JSON-serialisable dict."""
+        rss = current_rss()
+        return {
+            "pid": self.pid,
+            "uptime": round(time.time() - self.started_at, 1),
+            "jobs_started": self.jobs_started,
+            "jobs_completed": self.jobs_completed,
+            "jobs_failed": self.jobs_failed,
+            "jobs_over_memory": self.jobs_over_memory,
+            "jobs_cancelled": self.jobs_cancelled,
+            "in_flight": self.in_flight,
+            "rss_mb": round(rss / MB, 1) if rss else None,
+            "peak_rss_mb": round(max(self.peak_rss, rss or 0) / MB, 1),
+            "peak_job_growth_mb": round(self.peak_job_growth / MB, 1),
+            "memory_ceiling_mb": settings.WORKER_MEMORY_CEILING_MB or None,
+            "max_jobs": settings.WORKER_MAX_JOBS or None,
+            "max_rss_mb": settings.WORKER_MAX_RSS_MB or None,
+            "recycle_pending": self.recycle_reason is not None
+        }
+
+    def _recycle_reason(self, rss: Optional[int]) -> Optional[str]:
+        finished = self.jobs_completed + self.jobs_failed + self.jobs_over_memory + self.jobs_cancelled
+        if settings.WORKER_MAX_JOBS and finished >= settings.WORKER_MAX_JOBS:
+            return f"served {finished} jobs"
+        if settings.WORKER_MAX_RSS_MB and rss and rss > settings.WORKER_MAX_RSS_MB * MB:
+            return f"RSS {rss // MB}MB above {settings.WORKER_MAX_RSS_MB}MB"
+        return None
+
+    def _recycle(self):
+        # uvicorn treats SIGTERM as a graceful shutdown: it stops accepting
+        # connections and lets in-flight requests finish before exiting.
+        # Signal the process rather than the calling thread, which may be a
+        # converter thread.
+        if self._recycling:
+            return
+        self._recycling = True
+        logger.info(f"Recycling worker {self.pid} with {self.in_flight} conversions in flight")
+        os.kill(self.pid, signal.SIGTERM)
+
+worker_stats = WorkerStats()
@@ -1,11 +1,71 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from .api.endpoints import router
-from .core.config import settings
+from .core.config import settings, MULTIPART_OVERHEAD
+from .core.middleware import RequestSizeLimitMiddleware
+from .core.readiness import readiness, WARM_UP_RETRY_INTERVAL
+from .services import storage
+from .services.job_board import job_board
+from .services.webhooks import webhook_service
+import asyncio
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+async def sweep_expired_files():
+    """Delete stored files past their expiry every ``STORAGE_CLEANUP_INTERVAL`` seconds.
+
+    Results kept for download URLs are deleted on a timer, which is lost
+    when the worker exits, as it routinely does when recycled or redeployed.
+    The first sweep waits for the warm-up to have created storage, so it
+    adds nothing to startup.
+    """
+    while storage.state != "ready":
+        await asyncio.sleep(WARM_UP_RETRY_INTERVAL)
+    while True:
+        try:
+            await storage.cleanup_old_files()
+        except Exception as e:
+            logger.error(f"Sweeping expired files failed: {str(e)}")
+        await asyncio.sleep(settings.STORAGE_CLEANUP_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Forget the jobs and conversions of workers this one replaces
+    await run_in_threadpool(job_board.sweep)
+    # Warm up storage, Stripe and PDF processing without holding up startup
+    warm_up = asyncio.create_task(readiness.warm_up())
+    sweeper = asyncio.create_task(sweep_expired_files()) if settings.STORAGE_CLEANUP_INTERVAL else None
+    # Apply webhook events recorded but lost by a worker that exited, when billing is set up
+    billing = settings.STRIPE_SECRET_KEY and settings.SUPABASE_URL and settings.SUPABASE_KEY
+    recovery = asyncio.create_task(webhook_service.recover()) if billing else None
+    yield
+    warm_up.cancel()
+    if sweeper:
+        sweeper.cancel()
+    if recovery:
+        recovery.cancel()
+    # Webhooks were acknowledged before being applied, so apply them before exiting
+    await webhook_service.drain(settings.WEBHOOK_DRAIN_TIMEOUT)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
+)
+
+# Refuse oversized uploads before they are buffered, each route to what it takes
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    max_size=settings.MAX_REQUEST_SIZE,
+    route_limits=[
+        ("POST", f"{settings.API_V1_STR}/convert", settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD),
+        ("POST", f"{settings.API_V1_STR}/convert/batch", settings.MAX_BATCH_FILES * (settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD)),
+        ("PUT", f"{settings.API_V1_STR}/uploads/[^/]+/chunks/[^/]+", settings.UPLOAD_CHUNK_SIZE)
+    ]
 )
 
 # Set up CORS middleware
@@ -15,6 +75,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Job-Id", "X-Pages-Converted", "X-Pages-Passed-Through", "X-Coalesced-With"],
 )
 
 # Include API router
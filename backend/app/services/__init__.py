@@ -1 +1,20 @@
+"""
+Lazily created service singletons.
 
+Importing PyMuPDF, Stripe and the Supabase client is slow, and the storage
+client checks its bucket over the network, so none of that happens at import
+time. Each service is created in the threadpool, by the warm-up the app
+starts in the background or by the first request needing it (see
+``require`` in the endpoints), whichever comes first.
+"""
+from importlib import import_module
+from ..core.readiness import readiness
+
+pdf_service = readiness.lazy("pdf", lambda: import_module(".pdf", __name__).pdf_service)
+storage = readiness.lazy("storage", lambda: import_module("..core.storage", __name__).storage)
+# Billing is optional: without Stripe configured the app still converts PDFs
+stripe_service = readiness.lazy(
+    "stripe",
+    lambda: import_module(".stripe", __name__).stripe_service,
+    required=False
+)
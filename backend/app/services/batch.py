@@ -0,0 +1,192 @@
+from typing import Dict, Any, List, Optional, AsyncIterator, BinaryIO
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
+import logging
+import zipfile
+from pathlib import PurePath
+from . import pdf_service
+from .jobs import job_service, ConversionJob, HTTP_499_CLIENT_CLOSED_REQUEST
+from ..core.worker import worker_stats
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ZipStreamBuffer:
+    """Write-only file object that collects ZIP output until it is drained.
+
+    ``zipfile`` falls back to data descriptors when it can't seek, so each
+    entry can be sent to the client as soon as it has been written.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class BatchService:
+    """Service for converting many PDFs into a single streamed ZIP archive."""
+
+    async def stream_zip(
+        self,
+        request: Request,
+        uploads: List[Dict[str, Any]],
+        user_id: Optional[str],
+        max_file_size: int
+    ) -> AsyncIterator[bytes]:
+        """Convert uploads side by side and yield the ZIP archive as entries complete.
+
+        Each upload is a dict with ``index``, ``filename`` and a readable
+        ``file``, which is closed once the archive is done. Files that fail
+        are listed in ``manifest.json``, written last, instead of failing the
+        whole batch, as do files larger than ``max_file_size``. Uploads take
+        the worker's conversion slots as they free up, so up to
+        ``MAX_CONCURRENT_CONVERSIONS`` convert at once. If the client
+        disconnects, pending conversions are cancelled straight away rather
+        than when the next entry is sent.
+        """
+        buffer = ZipStreamBuffer()
+        archive = zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED)
+        jobs = [await job_service.create(user_id, upload["filename"]) for upload in uploads]
+        tasks = [
+            asyncio.create_task(self._convert_entry(upload, job, max_file_size))
+            for upload, job in zip(uploads, jobs)
+        ]
+        manifest = []
+        used_names = set()
+        closed = False
+
+        def close():
+            nonlocal closed
+            if closed:
+                return
+            closed = True
+            for job in jobs:
+                if not job.done:
+                    job.cancel(HTTP_499_CLIENT_CLOSED_REQUEST, "Client disconnected")
+            for task in tasks:
+                task.cancel()
+            for job in jobs:
+                job_service.release(job)
+            for upload in uploads:
+                upload["file"].close()
+
+        async def watch_disconnect():
+            # A generator suspended at a yield only finds out about the
+            # disconnect once it is resumed or collected, so clean up here
+            # as soon as the cancelled conversions have wound down
+            if await job_service.cancel_on_disconnect(request, *jobs):
+                await asyncio.gather(*tasks, return_exceptions=True)
+                close()
+
+        watcher = asyncio.create_task(watch_disconnect())
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                entry, processed_content = await next_done
+                if processed_content is not None:
+                    entry["output"] = self._unique_name(entry["file"], used_names)
+                    archive.writestr(entry["output"], processed_content)
+                    yield buffer.drain()
+                manifest.append(entry)
+
+            manifest.sort(key=lambda entry: entry["index"])
+            archive.writestr("manifest.json", json.dumps({
+                "converted": sum(1 for entry in manifest if entry["status"] == "converted"),
+                "failed": sum(1 for entry in manifest if entry["status"] == "failed"),
+                "files": manifest
+            }, indent=2))
+            archive.close()
+            yield buffer.drain()
+        finally:
+            watcher.cancel()
+            close()
+
+    async def _convert_entry(self, upload: Dict[str, Any], job: ConversionJob, max_file_size: int):
+        """Convert one upload, returning its manifest entry and the converted bytes."""
+        filename = upload["filename"]
+        entry: Dict[str, Any] = {"index": upload["index"], "file": filename, "job_id": job.id}
+        worker_stats.job_started()
+        outcome = "failed"
+
+        try:
+            if not filename.lower().endswith(".pdf"):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Only PDF files are supported"
+                )
+
+            async with job_service.conversion_slot():
+                # Only read files once a slot is free, so no more uploads
+                # are held in memory than are converting
+                content = await run_in_threadpool(self._read, upload["file"], max_file_size)
+                processed_content = await pdf_service.convert_to_bionic(content, filename, job)
+
+            job.finish()
+            outcome = "completed"
+            entry.update({
+                "status": "converted",
+                "pages": job.total_pages,
+                "pages_converted": job.pages_converted,
+                "pages_passed_through": job.pages_passed_through,
+                "elapsed": round(job.elapsed, 3)
+            })
+            return entry, processed_content
+
+        except HTTPException as e:
+            logger.warning(f"Batch entry {filename} failed: {e.detail}")
+            job.fail(str(e.detail))
+            if e.status_code == status.HTTP_507_INSUFFICIENT_STORAGE:
+                outcome = "over_memory"
+            elif job.cancelled:
+                outcome = "cancelled"
+            entry.update({"status": "failed", "status_code": e.status_code, "error": str(e.detail)})
+            return entry, None
+        except asyncio.CancelledError:
+            # The batch was abandoned, e.g. the client disconnected
+            outcome = "cancelled"
+            job.cancel(HTTP_499_CLIENT_CLOSED_REQUEST, "Client disconnected")
+            job.fail(str(job.cancellation.detail))
+            raise
+        except Exception as e:
+            logger.error(f"Batch entry {filename} failed:", exc_info=True)
+            job.fail(str(e))
+            entry.update({"status": "failed", "status_code": 500, "error": str(e)})
+            return entry, None
+        finally:
+            worker_stats.job_finished(outcome, job.memory_growth)
+
+    @staticmethod
+    def _read(file: BinaryIO, max_file_size: int) -> bytes:
+        content = file.read(max_file_size + 1)
+        if len(content) > max_file_size:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File exceeds the maximum size of {max_file_size // (1024 * 1024)}MB"
+            )
+        return content
+
+    @staticmethod
+    def _unique_name(filename: str, used_names: set) -> str:
+        """Name the converted file after its source, disambiguating duplicates."""
+        stem = PurePath(filename).stem or "document"
+        name = f"{stem}_bionic.pdf"
+        counter = 2
+        while name in used_names:
+            name = f"{stem}_bionic ({counter}).pdf"
+            counter += 1
+        used_names.add(name)
+        return name
+
+batch_service = BatchService()
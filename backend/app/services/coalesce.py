@@ -0,0 +1,235 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
+from ..core.config import settings
+from .jobs import ConversionJob, job_service, HTTP_499_CLIENT_CLOSED_REQUEST
+from .job_board import job_board, POLL_INTERVAL, WORKER_EXITED
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class InFlightConversion:
+    """A conversion shared by every identical request that arrives while it runs."""
+
+    def __init__(self, job: ConversionJob, task: asyncio.Task):
+        self.job = job
+        self.task = task
+        self.waiters = 0
+
+class ConversionCoalescer:
+    """Runs one conversion for concurrent requests with the same input and parameters.
+
+    When a link to a document circulates, many users upload the same file
+    within seconds. The first request does the work under its own job, and
+    identical requests arriving before it completes wait for the same result
+    instead of converting and storing the file again, their own jobs
+    reporting its progress. A client that disconnects stops waiting; the
+    shared work is only cancelled once nobody is waiting for it.
+
+    Conversions are claimed on the job board, so identical requests reaching
+    other workers wait too: one request per worker follows the conversion
+    there and picks up the result it leaves on the board. If that worker's
+    clients all disconnect or it exits, the conversion starts over here.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, InFlightConversion] = {}
+        self.requests = 0
+        self.coalesced = 0
+        # Requests that waited for a conversion on another worker
+        self.coalesced_remote = 0
+        self.peak_waiters = 0
+
+    @staticmethod
+    def key(content_hash: str, **params: Any) -> Tuple[str, Tuple]:
+        """Key requests by the SHA-256 of the input and the parameters they convert with."""
+        return content_hash, tuple(sorted(params.items()))
+
+    @property
+    def waiters(self) -> int:
+        """Requests currently waiting on a conversion, including the ones doing it."""
+        return sum(entry.waiters for entry in self._in_flight.values())
+
+    async def run(
+        self,
+        key: Hashable,
+        job: ConversionJob,
+        request: Request,
+        work: Callable[[ConversionJob], Awaitable[Any]]
+    ) -> Tuple[Any, ConversionJob]:
+        """Return the result of ``work`` for ``key``, starting it under ``job`` if none is in flight.
+
+        Also returns the job the work ran under, which is ``job`` only for
+        the request that did the work, and a ``remote`` job when another
+        worker did it. That job is finished or failed with the work; ``job``
+        is too when the request only waited.
+
+        Raises:
+            HTTPException: the error the work failed with, or 499 if the
+                client disconnected first
+        """
+        self.requests += 1
+        entry = self._in_flight.get(key)
+        if entry is None:
+            entry = InFlightConversion(job, asyncio.create_task(self._run_work(key, work, job)))
+            self._in_flight[key] = entry
+            entry.task.add_done_callback(lambda task: self._forget(key, entry, task))
+        else:
+            self.coalesced += 1
+            logger.info(f"Job {job.id} is waiting for identical conversion {entry.job.id}")
+            job.follow(entry.job)
+        entry.waiters += 1
+        self.peak_waiters = max(self.peak_waiters, entry.waiters)
+
+        result = asyncio.ensure_future(asyncio.shield(entry.task))
+        disconnected = asyncio.create_task(job_service.wait_for_disconnect(request))
+        try:
+            await asyncio.wait((result, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not result.done():
+                raise HTTPException(status_code=HTTP_499_CLIENT_CLOSED_REQUEST, detail="Client disconnected")
+            if job is not entry.job:
+                self._follow(job, entry.job, result.exception())
+            return result.result()
+        finally:
+            disconnected.cancel()
+            result.cancel()
+            entry.waiters -= 1
+            if job is not entry.job:
+                job.unfollow(entry.job)
+                if not job.done:
+                    job.fail("Client disconnected")
+            if entry.waiters == 0 and not entry.task.done():
+                entry.job.cancel(HTTP_499_CLIENT_CLOSED_REQUEST, "Every client waiting for the conversion disconnected")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the coalescing metrics as a JSON-serialisable dict."""
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "coalesced_remote": self.coalesced_remote,
+            "coalescing_ratio": round((self.coalesced + self.coalesced_remote) / self.requests, 3) if self.requests else 0.0,
+            "in_flight": len(self._in_flight),
+            "waiters": self.waiters,
+            "peak_waiters": self.peak_waiters
+        }
+
+    async def _run_work(
+        self,
+        key: Hashable,
+        work: Callable[[ConversionJob], Awaitable[Any]],
+        job: ConversionJob
+    ) -> Tuple[Any, ConversionJob]:
+        try:
+            result = await self._lead(key, work, job)
+        except HTTPException as e:
+            job.fail(str(e.detail))
+            raise
+        except Exception as e:
+            job.fail(str(e))
+            raise
+        job.finish()
+        return result
+
+    async def _lead(
+        self,
+        key: Hashable,
+        work: Callable[[ConversionJob], Awaitable[Any]],
+        job: ConversionJob
+    ) -> Tuple[Any, ConversionJob]:
+        """Do the work for ``key``, or wait for the worker that claimed it first."""
+        while True:
+            claim = await run_in_threadpool(job_board.claim, key, job.user_id, job.id)
+            if claim is None:
+                return await self._run_claimed(key, work, job), job
+            self.coalesced_remote += 1
+            logger.info(f"Job {job.id} is waiting for identical conversion {claim['job_id']} on worker {claim['pid']}")
+            outcome = await self._follow_remote(key, claim, job)
+            if outcome is not None:
+                return outcome
+            logger.info(f"Identical conversion {claim['job_id']} was abandoned, job {job.id} converts the file itself")
+
+    async def _run_claimed(self, key: Hashable, work: Callable[[ConversionJob], Awaitable[Any]], job: ConversionJob) -> Any:
+        loop = asyncio.get_running_loop()
+        try:
+            result = await work(job)
+        except BaseException as e:
+            status_code = e.status_code if isinstance(e, HTTPException) else None
+            detail = str(e.detail) if isinstance(e, HTTPException) else str(e)
+            # Not awaited, as a cancelled task can't wait
+            loop.run_in_executor(None, job_board.fail_claim, key, job.id, status_code, detail)
+            raise
+        else:
+            try:
+                await run_in_threadpool(job_board.finish_claim, key, job.id, result)
+            except OSError as e:
+                # Workers waiting for it find the claim released and convert the file themselves
+                logger.warning(f"Could not leave the result of job {job.id} on the job board: {str(e)}")
+            return result
+        finally:
+            loop.call_later(
+                settings.JOB_RETENTION_SECONDS,
+                lambda: loop.run_in_executor(None, job_board.release_claim, key, job.id)
+            )
+
+    async def _follow_remote(self, key: Hashable, claim: Dict[str, Any], job: ConversionJob) -> Optional[Tuple[Any, ConversionJob]]:
+        """Report the progress of a conversion on another worker as ``job``'s and return its result.
+
+        Returns ``None`` if the conversion was abandoned, so it should be
+        done here instead.
+
+        Raises:
+            HTTPException: the error the conversion failed with, or ``job``'s
+                cancellation
+        """
+        leader = ConversionJob(claim["job_id"], claim["user_id"], job.filename, asyncio.get_running_loop())
+        leader.remote = True
+        waiter = await run_in_threadpool(job_board.add_waiter, key)
+        try:
+            while True:
+                job.check_cancelled()
+                current = await run_in_threadpool(job_board.read_claim, key)
+                if current is None or current["job_id"] != claim["job_id"]:
+                    return None
+                entry = await run_in_threadpool(job_board.read_job, claim["user_id"], claim["job_id"])
+                if entry is not None:
+                    leader.apply(entry["snapshot"])
+                    if not leader.done:
+                        job.apply(entry["snapshot"])
+
+                if current["status"] == "completed":
+                    try:
+                        result = await run_in_threadpool(job_board.read_result, current)
+                    except (OSError, ValueError):
+                        return None
+                    leader.status = "completed"
+                    return result, leader
+                if current["status"] == "failed":
+                    status_code = current.get("status_code")
+                    if current["error"] == WORKER_EXITED or status_code in (None, HTTP_499_CLIENT_CLOSED_REQUEST):
+                        return None
+                    raise HTTPException(status_code=status_code, detail=current["error"])
+                await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            await run_in_threadpool(job_board.remove_waiter, waiter)
+
+    @staticmethod
+    def _follow(job: ConversionJob, leader: ConversionJob, error: Optional[BaseException]):
+        # Report the shared conversion's outcome on the waiting request's own job
+        job.total_pages = leader.total_pages
+        job.pages_done = leader.pages_done
+        job.pages_passed_through = leader.pages_passed_through
+        if error is None:
+            job.finish()
+        else:
+            job.fail(str(error.detail) if isinstance(error, HTTPException) else str(error))
+
+    def _forget(self, key: Hashable, entry: InFlightConversion, task: asyncio.Task):
+        if self._in_flight.get(key) is entry:
+            del self._in_flight[key]
+        # Work abandoned by every waiter fails with nobody left to read the error
+        if not task.cancelled():
+            task.exception()
+
+conversion_coalescer = ConversionCoalescer()
@@ -0,0 +1,145 @@
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+import logging
+import time
+from ..core.config import settings
+from ..core.database import get_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Users each worker keeps a tier for; the least recently used are forgotten past this
+CACHE_SIZE = 10000
+
+# What each subscription tier may convert, matching the limits shown in the
+# frontend. MAX_FILE_SIZE still caps every tier; the number of files in a
+# batch is the same for everyone, MAX_BATCH_FILES.
+TIER_LIMITS = {
+    "free": {"max_file_size": 10 * MB},
+    "pro": {"max_file_size": 50 * MB},
+    "ultimate": {"max_file_size": 100 * MB}
+}
+
+class Entitlement:
+    """A user's subscription tier, as last loaded or changed by a webhook."""
+    __slots__ = ("tier", "changed_at", "loaded_at")
+
+    def __init__(self, tier: str, changed_at: float, loaded_at: float):
+        self.tier = tier
+        # Stripe event time of the change, so late or replayed events are ignored
+        self.changed_at = changed_at
+        self.loaded_at = loaded_at
+
+class EntitlementService:
+    """In-process cache of subscription tiers, keyed by user id.
+
+    ``/convert`` checks every request against the user's tier. The tier is
+    read from ``user_subscriptions`` on first use and cached for
+    ``ENTITLEMENT_CACHE_TTL`` seconds; Stripe webhooks update the cache
+    directly when a subscription changes. Webhooks reach one worker only, so
+    other workers pick changes up when their entry expires. At most
+    ``CACHE_SIZE`` users are kept.
+    """
+
+    def __init__(self):
+        self._entitlements: "OrderedDict[str, Entitlement]" = OrderedDict()
+
+    async def tier(self, user_id: Optional[str]) -> str:
+        """Return the user's tier, from the cache unless it's missing or stale."""
+        if not user_id:
+            return settings.DEFAULT_TIER
+        entitlement = self._entitlements.get(user_id)
+        if entitlement and time.monotonic() - entitlement.loaded_at <= settings.ENTITLEMENT_CACHE_TTL:
+            self._entitlements.move_to_end(user_id)
+            return entitlement.tier
+
+        started = time.monotonic()
+        loaded = await run_in_threadpool(self._load_tier, user_id)
+        current = self._entitlements.get(user_id)
+        if current and current.loaded_at > started:
+            # A webhook changed the tier while the database was read
+            return current.tier
+        if loaded is None:
+            # Keep what we knew rather than downgrade while the database is unreachable
+            return current.tier if current else settings.DEFAULT_TIER
+        tier, changed_at = loaded
+        self._remember(user_id, Entitlement(tier, changed_at, time.monotonic()))
+        return tier
+
+    def update(self, user_id: str, tier: str, changed_at: float) -> bool:
+        """Record a tier change from a webhook, unless a newer change is already known.
+
+        Returns ``True`` if the change was applied.
+        """
+        current = self._entitlements.get(user_id)
+        if current and current.changed_at > changed_at:
+            logger.info(f"Ignoring tier change for user {user_id} older than the one applied")
+            return False
+        self._remember(user_id, Entitlement(tier, changed_at, time.monotonic()))
+        logger.info(f"User {user_id} is now on the {tier} tier")
+        return True
+
+    async def limits(self, user_id: Optional[str]) -> Dict[str, Any]:
+        """Return what the user may convert, capped by the server-wide limits."""
+        tier = await self.tier(user_id)
+        limits = TIER_LIMITS.get(tier, TIER_LIMITS["free"])
+        return {
+            "tier": tier,
+            "max_file_size": min(limits["max_file_size"], settings.MAX_FILE_SIZE)
+        }
+
+    async def check(self, user_id: Optional[str], file_size: int):
+        """Refuse a conversion that exceeds the user's tier.
+
+        Raises:
+            HTTPException: 413 if the file is too large for the tier
+        """
+        limits = await self.limits(user_id)
+        if file_size > limits["max_file_size"]:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File exceeds the {limits['max_file_size'] // MB}MB limit of the {limits['tier']} plan"
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"cached_users": len(self._entitlements)}
+
+    def _remember(self, user_id: str, entitlement: Entitlement):
+        self._entitlements[user_id] = entitlement
+        self._entitlements.move_to_end(user_id)
+        while len(self._entitlements) > CACHE_SIZE:
+            self._entitlements.popitem(last=False)
+
+    @staticmethod
+    def _load_tier(user_id: str) -> Optional[Tuple[str, float]]:
+        """Read the user's tier and the Stripe event time it was set at.
+
+        Returns ``None`` if the database can't be reached.
+        """
+        if not (settings.SUPABASE_URL and settings.SUPABASE_KEY):
+            # Without a database every user gets the default tier
+            return settings.DEFAULT_TIER, 0.0
+        try:
+            result = (
+                get_client().table("user_subscriptions")
+                .select("status, stripe_event_created, subscription_plans(tier)")
+                .eq("user_id", user_id)
+                .limit(1)
+                .execute()
+            )
+        except Exception as e:
+            logger.warning(f"Could not load the subscription of user {user_id}: {str(e)}")
+            return None
+        if not result.data:
+            return settings.DEFAULT_TIER, 0.0
+        row = result.data[0]
+        changed_at = float(row.get("stripe_event_created") or 0)
+        if row["status"] == "active" and row.get("subscription_plans"):
+            return row["subscription_plans"]["tier"], changed_at
+        return settings.DEFAULT_TIER, changed_at
+
+entitlement_service = EntitlementService()
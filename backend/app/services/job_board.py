@@ -0,0 +1,277 @@
+from typing import Any, Dict, Hashable, Optional
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from ..core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = "jobs"
+CONVERSIONS_DIR = "conversions"
+
+CLAIM_SUFFIX = ".claim"
+RESULT_SUFFIX = ".result"
+WAITER_SUFFIX = ".wait"
+
+# How often a worker reads the board for a job or conversion another worker runs
+POLL_INTERVAL = 0.25
+
+# Temp files older than this were left by a worker that exited while writing
+ORPHAN_AGE = 3600
+
+# Error of jobs and conversions whose worker exited before finishing them
+WORKER_EXITED = "The worker running the conversion exited"
+
+def pid_alive(pid: int) -> bool:
+    """Return whether a process with ``pid`` is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running, as another user
+    return True
+
+class JobBoard:
+    """Job progress and in-flight conversions, shared by the workers on this host.
+
+    Workers share the listening socket, so a progress watcher or an
+    identical conversion request can reach another worker than the one
+    running the job. Each worker writes the progress of its jobs here, a
+    small JSON file per job replaced atomically, for the others to read.
+    A worker converting a file claims it with a file that only one worker
+    can create; when others wait for the same conversion, the result is
+    left next to the claim for them. Entries name the worker's pid, so
+    those of a worker that exited are recognised and ignored.
+
+    The board is best effort: when the directory can't be written, workers
+    just don't see each other's jobs. Every method does blocking IO and is
+    meant to run in the threadpool.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def publish_job(self, user_id: Optional[str], job_id: str, filename: str, snapshot: Dict[str, Any]):
+        """Share the progress of a job running in this worker."""
+        self._write(self._job_path(user_id, job_id), {
+            "pid": os.getpid(),
+            "user_id": user_id,
+            "filename": filename,
+            "snapshot": snapshot
+        })
+
+    def read_job(self, user_id: Optional[str], job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the shared entry of a job, or ``None`` if no worker has it.
+
+        A job left unfinished by a worker that exited is reported as failed.
+        """
+        entry = self._read(self._job_path(user_id, job_id))
+        if entry is None:
+            return None
+        snapshot = entry["snapshot"]
+        if snapshot["status"] not in ("completed", "failed") and not pid_alive(entry["pid"]):
+            snapshot["status"] = "failed"
+            snapshot["error"] = WORKER_EXITED
+        return entry
+
+    def remove_job(self, user_id: Optional[str], job_id: str):
+        """Remove the entry of a job of this worker, unless another worker has reused the id since."""
+        path = self._job_path(user_id, job_id)
+        entry = self._read(path)
+        if entry is not None and entry["pid"] == os.getpid():
+            path.unlink(missing_ok=True)
+
+    def claim(self, key: Hashable, user_id: Optional[str], job_id: str) -> Optional[Dict[str, Any]]:
+        """Claim the conversion for ``key``, returning ``None`` once claimed.
+
+        Returns the claim of the worker already running it otherwise.
+        Claims of conversions that are over, or whose worker exited, are
+        taken over. Claiming is skipped when the board is unavailable.
+        """
+        path = self._claim_path(key)
+        claim = {"pid": os.getpid(), "user_id": user_id, "job_id": job_id, "status": "running"}
+        for _ in range(3):
+            try:
+                self._write(path, claim, replace=False)
+                return None
+            except FileExistsError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not claim a conversion on the job board: {str(e)}")
+                return None
+            current = self._read(path)
+            if current is None:
+                continue  # Released in the meantime
+            if current["status"] == "running" and pid_alive(current["pid"]):
+                return current
+            self._remove_claim(path, current)
+        return None
+
+    def read_claim(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """Return the claim on the conversion for ``key``, reporting it failed if its worker exited."""
+        claim = self._read(self._claim_path(key))
+        if claim is not None and claim["status"] == "running" and not pid_alive(claim["pid"]):
+            claim["status"] = "failed"
+            claim["error"] = WORKER_EXITED
+        return claim
+
+    def finish_claim(self, key: Hashable, job_id: str, result: Any):
+        """Mark a conversion of this worker as completed, leaving the result if anyone waits for it."""
+        path = self._claim_path(key)
+        claim = self._read(path)
+        if claim is None or claim["job_id"] != job_id:
+            return
+        claim["status"] = "completed"
+        if any(self._conversions.glob(f"{path.stem}.*{WAITER_SUFFIX}")):
+            result_path = self._conversions / f"{path.stem}.{uuid.uuid4().hex}{RESULT_SUFFIX}"
+            self._write_bytes(result_path, pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+            claim["result"] = result_path.name
+        self._write(path, claim)
+
+    def fail_claim(self, key: Hashable, job_id: str, status_code: Optional[int], detail: str):
+        """Mark a conversion of this worker as failed with the error its requests got."""
+        path = self._claim_path(key)
+        claim = self._read(path)
+        if claim is None or claim["job_id"] != job_id:
+            return
+        claim.update(status="failed", status_code=status_code, error=detail)
+        self._write(path, claim)
+
+    def release_claim(self, key: Hashable, job_id: str):
+        """Remove the claim on a conversion of this worker and its result."""
+        path = self._claim_path(key)
+        claim = self._read(path)
+        if claim is not None and claim["job_id"] == job_id and claim["pid"] == os.getpid():
+            self._remove_claim(path, claim)
+
+    def read_result(self, claim: Dict[str, Any]) -> Any:
+        """Return the result left with a completed claim.
+
+        Raises:
+            FileNotFoundError: if no result was left, or it was released
+        """
+        if not claim.get("result"):
+            raise FileNotFoundError("No result was left for the conversion")
+        return pickle.loads((self._conversions / claim["result"]).read_bytes())
+
+    def add_waiter(self, key: Hashable) -> Optional[Path]:
+        """Ask the worker running the conversion for ``key`` to leave its result on the board."""
+        path = self._conversions / f"{self._claim_path(key).stem}.{os.getpid()}.{uuid.uuid4().hex}{WAITER_SUFFIX}"
+        try:
+            path.touch()
+        except OSError as e:
+            logger.warning(f"Could not wait for a conversion on the job board: {str(e)}")
+            return None
+        return path
+
+    def remove_waiter(self, path: Optional[Path]):
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def sweep(self):
+        """Remove the entries left behind by workers that exited.
+
+        Also removes entries naming this worker's pid, which can only be a
+        previous worker's that had the same pid.
+        """
+        pid = os.getpid()
+        removed = 0
+        for directory in (self._jobs, self._conversions):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                path = Path(entry.path)
+                if path.suffix == WAITER_SUFFIX:
+                    owner = int(path.name.split(".")[1])
+                elif path.suffix in (".json", CLAIM_SUFFIX):
+                    data = self._read(path)
+                    if data is None:
+                        continue
+                    owner = data["pid"]
+                elif path.suffix == ".part":
+                    try:
+                        orphaned = time.time() - entry.stat().st_mtime > ORPHAN_AGE
+                    except FileNotFoundError:
+                        continue  # Written since
+                    if orphaned:
+                        # Half-written by a worker that exited
+                        path.unlink(missing_ok=True)
+                        removed += 1
+                    continue
+                else:
+                    continue  # Results go with their claim
+                if owner == pid or not pid_alive(owner):
+                    if path.suffix == CLAIM_SUFFIX:
+                        self._remove_claim(path, data)
+                    else:
+                        path.unlink(missing_ok=True)
+                    removed += 1
+        if removed:
+            logger.info(f"Removed {removed} job board entries left by exited workers")
+
+    @property
+    def _jobs(self) -> Path:
+        return self.directory / JOBS_DIR
+
+    @property
+    def _conversions(self) -> Path:
+        return self.directory / CONVERSIONS_DIR
+
+    def _job_path(self, user_id: Optional[str], job_id: str) -> Path:
+        # Job ids are only unique per user, and user ids needn't be valid file names
+        digest = hashlib.sha256(json.dumps([user_id, job_id]).encode()).hexdigest()
+        return self._jobs / f"{digest}.json"
+
+    def _claim_path(self, key: Hashable) -> Path:
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return self._conversions / f"{digest}{CLAIM_SUFFIX}"
+
+    def _remove_claim(self, path: Path, claim: Dict[str, Any]):
+        path.unlink(missing_ok=True)
+        if claim.get("result"):
+            (self._conversions / claim["result"]).unlink(missing_ok=True)
+
+    @staticmethod
+    def _read(path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: Path, data: Dict[str, Any], replace: bool = True):
+        self._write_bytes(path, json.dumps(data).encode(), replace)
+
+    @staticmethod
+    def _write_bytes(path: Path, data: bytes, replace: bool = True):
+        """Write a file so readers only ever see it complete.
+
+        With ``replace=False`` the write fails with ``FileExistsError`` if
+        the file already exists, which is how a conversion is claimed.
+        """
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            if replace:
+                os.replace(temp_name, path)
+            else:
+                os.link(temp_name, path)
+        finally:
+            # Already renamed into place unless linked or failed
+            try:
+                os.unlink(temp_name)
+            except FileNotFoundError:
+                pass
+
+job_board = JobBoard(settings.JOB_STATE_DIR or os.path.join(tempfile.gettempdir(), "bionic-job-board"))
@@ -0,0 +1,455 @@
+from typing import Dict, Any, List, Optional, AsyncIterator, Set, Tuple
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from ..core.config import settings
+from ..core.worker import current_rss, worker_stats, MB
+from .job_board import job_board, POLL_INTERVAL
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Minimum time between two progress notifications for the same job. Pages
+# finishing faster than this are coalesced into a single event, which keeps the
+# per-page cost in the conversion loop to a couple of attribute writes.
+PROGRESS_INTERVAL = 0.1
+
+# Nginx's non-standard status for requests the client abandoned
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
+
+# Comment line sent to idle SSE connections so proxies don't close them
+KEEPALIVE_INTERVAL = 15.0
+
+# How often a running conversion checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 1.0
+
+class ConversionJob:
+    """State of a single conversion, shared by the converter thread and its watchers.
+
+    The converter thread only ever calls ``start`` and ``page_done``; everything
+    else runs on the event loop the job was created on. A ``remote`` job is a
+    view of one running on another worker, updated from the job board.
+    """
+
+    def __init__(self, job_id: str, user_id: Optional[str], filename: str, loop: asyncio.AbstractEventLoop):
+        self.id = job_id
+        self.user_id = user_id
+        self.filename = filename
+        self.status = "queued"
+        self.total_pages = 0
+        self.pages_done = 0
+        self.pages_passed_through = 0
+        self.error: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.deadline = self.created_at + settings.CONVERSION_TIMEOUT if settings.CONVERSION_TIMEOUT else None
+        self.cancellation: Optional[HTTPException] = None
+        self.memory_growth = 0
+        self._last_rss: Optional[int] = None
+        self._loop = loop
+        self._changed = asyncio.Event()
+        self._last_notify = 0.0
+        # Jobs of coalesced requests waiting for this job's conversion
+        self._followers: List["ConversionJob"] = []
+        self.remote = False
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def pages_converted(self) -> int:
+        return self.pages_done - self.pages_passed_through
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancellation is not None
+
+    def start(self, total_pages: int, process_rss: Optional[int] = None):
+        """Mark the job as running. Called from the converter thread.
+
+        ``process_rss`` is the size of the pool process converting the job,
+        when it runs in one (see ``ConversionPool``).
+        """
+        self.check_cancelled()
+        self.total_pages = total_pages
+        self.started_at = time.monotonic()
+        self.status = "running"
+        if settings.WORKER_MEMORY_CEILING_MB:
+            if process_rss is not None:
+                self._last_rss = process_rss
+            else:
+                self._last_rss = current_rss()
+                with _running_lock:
+                    _running.add(self)
+        self._notify_threadsafe()
+
+    def page_done(self, page_num: int, passed_through: bool = False, process_rss: Optional[int] = None):
+        """Record a completed page. Called from the converter thread.
+
+        ``passed_through`` marks a page copied to the output unchanged, and
+        ``process_rss`` is as for ``start``.
+
+        Raises:
+            HTTPException: the cancellation error once the job has been cancelled,
+                including 507 when it was shed at the memory ceiling
+        """
+        self.pages_done = page_num + 1
+        if passed_through:
+            self.pages_passed_through += 1
+        if self._last_rss is not None:
+            self._check_memory(process_rss)
+        self.check_cancelled()
+        now = time.monotonic()
+        if self.pages_done == self.total_pages or now - self._last_notify >= PROGRESS_INTERVAL:
+            self._last_notify = now
+            self._notify_threadsafe()
+
+    def cancel(self, status_code: int, detail: str):
+        """Ask the converter to stop at the next page boundary.
+
+        Safe to call from any thread; only the first cancellation is kept.
+        """
+        if self.cancellation is None:
+            logger.info(f"Cancelling job {self.id}: {detail}")
+            self.cancellation = HTTPException(status_code=status_code, detail=detail)
+
+    def check_cancelled(self):
+        """Raise the cancellation error if the job was cancelled or ran past its deadline."""
+        if self.cancellation is None and self.deadline and time.monotonic() > self.deadline:
+            self.cancel(
+                status.HTTP_408_REQUEST_TIMEOUT,
+                f"Conversion exceeded the {settings.CONVERSION_TIMEOUT} second deadline"
+            )
+        if self.cancellation is not None:
+            raise self.cancellation
+
+    def finish(self):
+        """Mark the job as completed."""
+        self.finished_at = time.monotonic()
+        self.status = "completed"
+        self._stop_memory_tracking()
+        self._notify()
+
+    def fail(self, error: str):
+        """Mark the job as failed."""
+        self.finished_at = time.monotonic()
+        self.status = "failed"
+        self.error = error
+        self._stop_memory_tracking()
+        self._notify()
+
+    def follow(self, leader: "ConversionJob"):
+        """Report the progress of ``leader``, whose conversion this job waits for, as its own.
+
+        The final outcome is still up to the caller, since the leader's
+        result may not be this job's, e.g. when this client disconnects.
+        """
+        leader._followers.append(self)
+        self._mirror(leader)
+
+    def unfollow(self, leader: "ConversionJob"):
+        if self in leader._followers:
+            leader._followers.remove(self)
+
+    def apply(self, snapshot: Dict[str, Any]):
+        """Take over the progress in a ``snapshot`` of a job on another worker."""
+        now = time.monotonic()
+        self.status = snapshot["status"]
+        self.total_pages = snapshot["total_pages"]
+        self.pages_done = snapshot["pages_done"]
+        self.pages_passed_through = snapshot["pages_passed_through"]
+        self.error = snapshot.get("error")
+        if self.status != "queued":
+            self.started_at = now - snapshot["elapsed"]
+        self.finished_at = now if self.done else None
+        self._notify()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current progress as a JSON-serialisable dict."""
+        snapshot = {
+            "job_id": self.id,
+            "status": self.status,
+            "pages_done": self.pages_done,
+            "total_pages": self.total_pages,
+            "pages_passed_through": self.pages_passed_through,
+            "elapsed": round(self.elapsed, 3)
+        }
+        if self.error:
+            snapshot["error"] = self.error
+        return snapshot
+
+    def _check_memory(self, process_rss: Optional[int] = None):
+        # Credit the job with RSS growth seen while its own pages were
+        # processed, then enforce the ceiling on the worker as a whole
+        rss = current_rss() if process_rss is None else process_rss
+        if rss is None:
+            return
+        grew = rss > self._last_rss
+        if grew:
+            self.memory_growth += rss - self._last_rss
+        self._last_rss = rss
+        if rss <= settings.WORKER_MEMORY_CEILING_MB * MB:
+            return
+        if process_rss is None:
+            _shed_memory(rss)
+        elif grew:
+            # Alone in its pool process, which is replaced after POOL_MAX_TASKS
+            # conversions; like a shed, memory that merely stays high aborts nothing
+            logger.warning(
+                f"Pool process RSS {rss // MB}MB is above the {settings.WORKER_MEMORY_CEILING_MB}MB ceiling, "
+                f"aborting job {self.id} which grew {self.memory_growth // MB}MB"
+            )
+            self.cancel(
+                status.HTTP_507_INSUFFICIENT_STORAGE,
+                f"Conversion aborted: its process reached the {settings.WORKER_MEMORY_CEILING_MB}MB ceiling"
+            )
+
+    def _stop_memory_tracking(self):
+        with _running_lock:
+            _running.discard(self)
+
+    def _notify_threadsafe(self):
+        try:
+            self._loop.call_soon_threadsafe(self._notify)
+        except RuntimeError:
+            # Event loop already closed, nobody is listening anymore
+            pass
+
+    def _mirror(self, leader: "ConversionJob"):
+        if self.done or leader.done:
+            return
+        self.status = leader.status
+        self.started_at = leader.started_at
+        self.total_pages = leader.total_pages
+        self.pages_done = leader.pages_done
+        self.pages_passed_through = leader.pages_passed_through
+        self._notify()
+
+    def _notify(self):
+        # Wake every watcher waiting on the current event and hand out a fresh one
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+        for follower in self._followers:
+            follower._mirror(self)
+
+# Jobs converting in this worker with memory tracking, shared by converter threads
+_running: Set[ConversionJob] = set()
+_running_lock = threading.Lock()
+_rss_at_last_shed = 0
+
+def _shed_memory(rss: int):
+    """Abort the running job that grew the most once the worker passes its memory ceiling.
+
+    Only the largest contributor is aborted, so small conversions sharing the
+    worker carry on. The worker is recycled right away, since the heap is
+    rarely handed back to the OS. Memory that merely stays high after a shed
+    does not abort further jobs; only fresh growth does.
+    """
+    global _rss_at_last_shed
+    with _running_lock:
+        if rss <= _rss_at_last_shed:
+            return
+        candidates = [job for job in _running if not job.cancelled]
+        if not candidates:
+            return
+        culprit = max(candidates, key=lambda job: job.memory_growth)
+        _rss_at_last_shed = rss
+    logger.warning(
+        f"Worker RSS {rss // MB}MB is above the {settings.WORKER_MEMORY_CEILING_MB}MB ceiling, "
+        f"aborting job {culprit.id} which grew {culprit.memory_growth // MB}MB"
+    )
+    culprit.cancel(
+        status.HTTP_507_INSUFFICIENT_STORAGE,
+        f"Conversion aborted: it used the most memory when the worker reached "
+        f"its {settings.WORKER_MEMORY_CEILING_MB}MB ceiling"
+    )
+    worker_stats.request_recycle(f"RSS {rss // MB}MB reached the memory ceiling")
+
+class JobService:
+    """Registry of conversion jobs and their progress streams."""
+
+    def __init__(self):
+        # Keyed by (user_id, job_id): client supplied ids are only unique per user
+        self._jobs: Dict[Tuple[Optional[str], str], ConversionJob] = {}
+        # Tasks sharing the progress of this worker's jobs on the job board
+        self._publishers: Dict[ConversionJob, asyncio.Task] = {}
+        # PyMuPDF converts one document at a time per process (see pdf.py)
+        self._slots = asyncio.Semaphore(max(1, settings.MAX_CONCURRENT_CONVERSIONS))
+        self.queued = 0
+
+    async def create(self, user_id: Optional[str], filename: str, job_id: Optional[str] = None) -> ConversionJob:
+        """Register a new job, generating an id if the client didn't supply one.
+
+        Its progress is shared on the job board, so watchers reaching other
+        workers can follow it.
+
+        Raises:
+            HTTPException: 409 if a job with the client's id is running on any worker
+        """
+        if job_id:
+            existing = self._jobs.get((user_id, job_id))
+            if existing is not None:
+                running = not existing.done
+            else:
+                entry = await run_in_threadpool(job_board.read_job, user_id, job_id)
+                running = entry is not None and entry["snapshot"]["status"] not in ("completed", "failed")
+            if running:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Job {job_id} is already running"
+                )
+
+        job = ConversionJob(job_id or uuid.uuid4().hex, user_id, filename, asyncio.get_running_loop())
+        self._jobs[(user_id, job.id)] = job
+        self._publishers[job] = asyncio.create_task(self._publish(job))
+        logger.debug(f"Registered conversion job {job.id} for {filename}")
+        return job
+
+    def get(self, user_id: Optional[str], job_id: str) -> Optional[ConversionJob]:
+        return self._jobs.get((user_id, job_id))
+
+    @asynccontextmanager
+    async def conversion_slot(self):
+        """Hold one of the worker's ``MAX_CONCURRENT_CONVERSIONS`` conversion slots, shared by every endpoint."""
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def release(self, job: ConversionJob):
+        """Forget a finished job once late watchers have had a chance to read its result."""
+        key = (job.user_id, job.id)
+
+        def _remove():
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+            publisher = self._publishers.pop(job, None)
+            if publisher:
+                publisher.cancel()
+            asyncio.get_running_loop().run_in_executor(None, job_board.remove_job, job.user_id, job.id)
+
+        asyncio.get_running_loop().call_later(settings.JOB_RETENTION_SECONDS, _remove)
+
+    async def cancel_on_disconnect(self, request: Request, *jobs: ConversionJob) -> bool:
+        """Cancel jobs once their client goes away, so abandoned work stops early.
+
+        Returns ``True`` if the client disconnected before every job was done.
+        """
+        while not all(job.done for job in jobs):
+            if await request.is_disconnected():
+                for job in jobs:
+                    if not job.done:
+                        job.cancel(HTTP_499_CLIENT_CLOSED_REQUEST, "Client disconnected")
+                return True
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+        return False
+
+    async def wait_for_disconnect(self, request: Request):
+        """Return once the client of ``request`` has gone away."""
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+    async def wait_for(self, user_id: Optional[str], job_id: str, timeout: float) -> Optional[ConversionJob]:
+        """Wait for a job to be registered on any worker. Watchers often connect before the upload finishes.
+
+        Jobs of other workers are returned as ``remote`` jobs.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._jobs.get((user_id, job_id))
+            if job:
+                return job
+            entry = await run_in_threadpool(job_board.read_job, user_id, job_id)
+            if entry:
+                job = ConversionJob(job_id, user_id, entry["filename"], asyncio.get_running_loop())
+                job.remote = True
+                job.apply(entry["snapshot"])
+                return job
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def stream_events(self, job: ConversionJob) -> AsyncIterator[str]:
+        """Yield Server-Sent Events for a job until it completes or fails."""
+        watcher = asyncio.create_task(self._watch_remote(job)) if job.remote else None
+        try:
+            async for event in self._events(job):
+                yield event
+        finally:
+            if watcher:
+                watcher.cancel()
+
+    async def _events(self, job: ConversionJob) -> AsyncIterator[str]:
+        while True:
+            # Grab the event before reading state so no update can slip in between
+            changed = job._changed
+            snapshot = job.snapshot()
+
+            if job.status == "completed":
+                yield self._format_event("done", snapshot)
+                return
+            if job.status == "failed":
+                yield self._format_event("error", snapshot)
+                return
+            yield self._format_event("progress", snapshot)
+
+            while not changed.is_set():
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+
+    async def _publish(self, job: ConversionJob):
+        """Share a job's progress on the job board until it is done.
+
+        Updates that come faster than the board is written are skipped
+        over, as only the latest progress matters.
+        """
+        while True:
+            changed = job._changed
+            try:
+                await run_in_threadpool(job_board.publish_job, job.user_id, job.id, job.filename, job.snapshot())
+            except OSError as e:
+                logger.warning(f"Could not share the progress of job {job.id}: {str(e)}")
+                return
+            if job.done:
+                return
+            await changed.wait()
+
+    async def _watch_remote(self, job: ConversionJob):
+        """Keep a job running on another worker up to date from the job board."""
+        while not job.done:
+            await asyncio.sleep(POLL_INTERVAL)
+            entry = await run_in_threadpool(job_board.read_job, job.user_id, job.id)
+            if entry is None:
+                job.fail("Job not found")
+                return
+            snapshot = entry["snapshot"]
+            if (snapshot["status"], snapshot["pages_done"], snapshot["total_pages"]) != (job.status, job.pages_done, job.total_pages):
+                job.apply(snapshot)
+
+    @staticmethod
+    def _format_event(event: str, data: Dict[str, Any]) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+job_service = JobService()
@@ -0,0 +1,278 @@
+from typing import Iterator, List, Optional, Tuple
+import logging
+import re
+import fitz  # PyMuPDF
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Ligatures and whitespace as printed, clipped to the page. Unlike the HTML
+# flags this leaves out TEXT_PRESERVE_IMAGES, which copies every image's data
+# into the extracted dict; images are located with get_image_info instead.
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT
+
+# Settings for PyMuPDF's table finder, which only looks for ruled tables
+TABLE_SETTINGS = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines",
+    "snap_tolerance": 3,
+    "join_tolerance": 3,
+    "edge_min_length": 3
+}
+
+# Height of the bands at the top and bottom of a page holding headers and footers
+HEADER_FOOTER_MARGIN = 72  # 1 inch
+
+# Share of a page an image has to cover for the page to count as a scan
+FULL_PAGE_IMAGE_COVERAGE = 0.9
+
+# Text trace type of spans drawn with render mode 3, i.e. not drawn at all
+INVISIBLE_TEXT = 3
+
+# A bullet, or an item number or letter, on its own or followed by a space
+LIST_MARKER = re.compile(r"(?:[•\-*○▪◦]|\d{1,3}[.)]|[a-zA-Z][.)])(?:\s|$)")
+
+BBox = Tuple[float, float, float, float]
+
+# Page layout is held in slotted records rather than dicts: a 2000 page
+# document has hundreds of thousands of spans, and a dict per span on top of
+# PyMuPDF's own nested dicts was most of the memory used by analysis.
+
+class Span:
+    """A run of text in one font, with only the fields the renderer uses."""
+    __slots__ = ("text", "origin", "size", "color", "bbox")
+
+    def __init__(self, text: str, origin: Tuple[float, float], size: float, color: Tuple[float, ...], bbox: BBox):
+        self.text = text
+        self.origin = origin
+        self.size = size
+        self.color = color
+        self.bbox = bbox
+
+class TextBlock:
+    """A block of text, with the spans of all its lines in reading order."""
+    __slots__ = ("bbox", "spans")
+
+    def __init__(self, bbox: BBox, spans: List[Span]):
+        self.bbox = bbox
+        self.spans = spans
+
+class ImageBlock:
+    """An image drawn on the page, by xref (0 for inline images)."""
+    __slots__ = ("bbox", "xref")
+
+    def __init__(self, bbox: BBox, xref: int):
+        self.bbox = bbox
+        self.xref = xref
+
+class TableCell:
+    __slots__ = ("bbox", "text")
+
+    def __init__(self, bbox: BBox, text: str):
+        self.bbox = bbox
+        self.text = text
+
+class Table:
+    """A ruled table, as rows of cells."""
+    __slots__ = ("bbox", "rows")
+
+    def __init__(self, bbox: BBox, rows: List[List[TableCell]]):
+        self.bbox = bbox
+        self.rows = rows
+
+class Element:
+    """One classified part of a page, in the order it is rendered.
+
+    ``kind`` is ``text``, ``list``, ``header_footer``, ``image`` or ``table``.
+    Text kinds carry their ``blocks`` (one per item for lists), images their
+    ``image`` and tables their ``table``.
+    """
+    __slots__ = ("kind", "bbox", "blocks", "image", "table")
+
+    def __init__(
+        self,
+        kind: str,
+        bbox: BBox,
+        blocks: Optional[List[TextBlock]] = None,
+        image: Optional[ImageBlock] = None,
+        table: Optional[Table] = None
+    ):
+        self.kind = kind
+        self.bbox = bbox
+        self.blocks = blocks
+        self.image = image
+        self.table = table
+
+class PageText:
+    """Text of one page, extracted once and shared by every stage of the conversion.
+
+    The MuPDF TextPage is built on first use and reused for text extraction,
+    table cell text and header/footer classification, instead of each stage
+    re-parsing the page. PyMuPDF's dict output is turned into ``TextBlock``
+    and ``Span`` records straight away and dropped, so only the fields the
+    renderer uses stay in memory.
+    """
+
+    def __init__(self, page: fitz.Page):
+        self.page = page
+        self._textpage: Optional[fitz.TextPage] = None
+        self._text_blocks: Optional[List[TextBlock]] = None
+        self._images: Optional[List[ImageBlock]] = None
+        self._tables: Optional[List[Table]] = None
+
+    @property
+    def textpage(self) -> fitz.TextPage:
+        if self._textpage is None:
+            self._textpage = self.page.get_textpage(flags=TEXT_FLAGS)
+        return self._textpage
+
+    @property
+    def text_blocks(self) -> List[TextBlock]:
+        if self._text_blocks is None:
+            self._text_blocks = [
+                TextBlock(block["bbox"], [
+                    Span(span["text"], span["origin"], span["size"], fitz.sRGB_to_pdf(span["color"]), span["bbox"])
+                    for line in block["lines"]
+                    for span in line["spans"]
+                ])
+                for block in self.textpage.extractDICT()["blocks"]
+            ]
+        return self._text_blocks
+
+    @property
+    def images(self) -> List[ImageBlock]:
+        if self._images is None:
+            # Resolving image xrefs is slow, so skip it on pages without images
+            self._images = []
+            if self.page.get_images():
+                self._images = [
+                    ImageBlock(info["bbox"], info["xref"])
+                    for info in self.page.get_image_info(xrefs=True)
+                ]
+        return self._images
+
+    @property
+    def tables(self) -> List[Table]:
+        """Ruled tables on the page.
+
+        A page without vector drawings cannot have ruled tables, so the table
+        finder, which is costly, only runs on pages that have some.
+        """
+        if self._tables is None:
+            self._tables = []
+            if self.page.get_cdrawings():
+                try:
+                    found = self.page.find_tables(**TABLE_SETTINGS)
+                except Exception as e:
+                    logger.warning(f"Error detecting tables: {str(e)}")
+                    found = []
+                for table in found:
+                    rows = [
+                        [TableCell(tuple(cell), self.text_in(cell)) for cell in row.cells if cell]
+                        for row in table.rows
+                    ]
+                    self._tables.append(Table(tuple(table.bbox), rows))
+        return self._tables
+
+    def text_in(self, rect) -> str:
+        """Return the text of the spans centred inside ``rect``.
+
+        Reads the spans already extracted rather than ``extractTextbox``,
+        which walks every character on the page for each call.
+        """
+        rect = fitz.Rect(rect)
+        words = []
+        for block in self.text_blocks:
+            if not rect.intersects(block.bbox):
+                continue
+            for span in block.spans:
+                x0, y0, x1, y1 = span.bbox
+                if fitz.Point((x0 + x1) / 2, (y0 + y1) / 2) in rect:
+                    words.append(span.text.strip())
+        return " ".join(word for word in words if word)
+
+    def close(self):
+        """Release the TextPage and extracted blocks once the page is rendered."""
+        self._textpage = None
+        self._text_blocks = None
+        self._images = None
+        self._tables = None
+
+def should_pass_through(page_text: PageText) -> bool:
+    """Whether a page has nothing to convert and can be copied to the output as is.
+
+    That is a scan, a single image covering the page whose text, if any, is
+    an invisible OCR layer that should stay under the image, or a page
+    without any text. Visible text over a full-page image, as on slides, is
+    converted as usual.
+    """
+    page = page_text.page
+    if len(page.get_images()) == 1:
+        images = page.get_image_info()
+        if len(images) == 1:
+            covered = fitz.Rect(images[0]["bbox"]) & page.rect
+            if covered.get_area() >= FULL_PAGE_IMAGE_COVERAGE * page.rect.get_area():
+                # Render mode 3 draws nothing, which is how OCR layers are written
+                if all(trace["type"] == INVISIBLE_TEXT for trace in page.get_texttrace()):
+                    return True
+    return not any(span.text.strip() for block in page_text.text_blocks for span in block.spans)
+
+def classify_page(page_text: PageText) -> Iterator[Element]:
+    """Yield the elements of a page in render order, in a single pass over its blocks.
+
+    Images come first so text is drawn over them. Each text block is then a
+    header or footer if it lies in the top or bottom band, part of a table if
+    its centre is inside one (the whole table is yielded once, at its first
+    block), a list item if it starts with a list marker, or plain text.
+    Consecutive list items are grouped into one ``list`` element.
+    """
+    page_height = page_text.page.rect.height
+    for image in page_text.images:
+        yield Element("image", image.bbox, image=image)
+
+    tables = [(fitz.Rect(table.bbox), table) for table in page_text.tables]
+    yielded_tables = set()
+    list_run: List[TextBlock] = []
+
+    for block in page_text.text_blocks:
+        if not block.spans:
+            continue
+        x0, y0, x1, y1 = block.bbox
+        center = fitz.Point((x0 + x1) / 2, (y0 + y1) / 2)
+        table = None
+
+        if y0 < HEADER_FOOTER_MARGIN or y1 > page_height - HEADER_FOOTER_MARGIN:
+            kind = "header_footer"
+        elif tables and (table := next((table for rect, table in tables if center in rect), None)):
+            kind = "table"
+        elif LIST_MARKER.match(block.spans[0].text.lstrip()):
+            list_run.append(block)
+            continue
+        else:
+            kind = "text"
+
+        if list_run:
+            yield _list_element(list_run)
+            list_run = []
+        if kind != "table":
+            yield Element(kind, block.bbox, blocks=[block])
+        elif id(table) not in yielded_tables:
+            yielded_tables.add(id(table))
+            yield Element("table", table.bbox, table=table)
+
+    if list_run:
+        yield _list_element(list_run)
+
+    # Ruled tables with no text in them still have their grid drawn
+    for _, table in tables:
+        if id(table) not in yielded_tables:
+            yield Element("table", table.bbox, table=table)
+
+def _list_element(items: List[TextBlock]) -> Element:
+    bbox = (
+        min(item.bbox[0] for item in items),
+        min(item.bbox[1] for item in items),
+        max(item.bbox[2] for item in items),
+        max(item.bbox[3] for item in items)
+    )
+    return Element("list", bbox, blocks=items)
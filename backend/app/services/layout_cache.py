@@ -0,0 +1,275 @@
+from typing import BinaryIO, List, Optional
+import logging
+import os
+import struct
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from .layout import Element, ImageBlock, Span, Table, TableCell, TextBlock
+from ..core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the format or the classification it stores changes, so
+# entries written by older code are ignored rather than misread
+LAYOUT_CACHE_VERSION = 1
+
+MAGIC = b"BRLC"
+SUFFIX = ".layout"
+PART_SUFFIX = ".part"
+
+# Entries still being written are renamed into place well within this many
+# seconds; older temp files were left by a worker that exited while writing
+ORPHAN_AGE = 3600
+
+# Entries are written compressed, in a stream of fixed-size little-endian
+# records: the file header, then per page a pass-through flag and its
+# elements. Text is UTF-8 behind a u32 length. Coordinates are float32,
+# which is plenty for points on a page.
+HEADER = struct.Struct("<4sHI")     # magic, version, page count
+PAGE = struct.Struct("<BI")         # passed through, element count
+ELEMENT = struct.Struct("<B4f")     # kind, bbox
+COUNT = struct.Struct("<I")
+BLOCK = struct.Struct("<4fI")       # bbox, span count
+SPAN = struct.Struct("<10fI")       # origin, size, color, bbox, text length
+XREF = struct.Struct("<i")
+CELL = struct.Struct("<4fI")        # bbox, text length
+
+KINDS = ("text", "list", "header_footer", "image", "table")
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+PageLayout = Optional[List[Element]]
+
+def encode_page(elements: PageLayout) -> bytes:
+    """Serialise one page: ``None`` for a page passed through, else its elements."""
+    if elements is None:
+        return PAGE.pack(1, 0)
+    parts = [PAGE.pack(0, len(elements))]
+    for element in elements:
+        parts.append(ELEMENT.pack(KIND_CODES[element.kind], *element.bbox))
+        if element.kind == "image":
+            parts.append(XREF.pack(element.image.xref))
+        elif element.kind == "table":
+            parts.append(COUNT.pack(len(element.table.rows)))
+            for row in element.table.rows:
+                parts.append(COUNT.pack(len(row)))
+                for cell in row:
+                    text = cell.text.encode("utf-8")
+                    parts.append(CELL.pack(*cell.bbox, len(text)))
+                    parts.append(text)
+        else:
+            parts.append(COUNT.pack(len(element.blocks)))
+            for block in element.blocks:
+                parts.append(BLOCK.pack(*block.bbox, len(block.spans)))
+                for span in block.spans:
+                    text = span.text.encode("utf-8")
+                    # Span colours are RGB tuples, see ``PageText.text_blocks``
+                    parts.append(SPAN.pack(*span.origin, span.size, *span.color, *span.bbox, len(text)))
+                    parts.append(text)
+    return b"".join(parts)
+
+class LayoutReader:
+    """Decodes the pages of a cached layout in order."""
+
+    def __init__(self, data: memoryview, page_count: int):
+        self.page_count = page_count
+        self._data = data
+        self._offset = HEADER.size
+
+    def _unpack(self, record: struct.Struct) -> tuple:
+        values = record.unpack_from(self._data, self._offset)
+        self._offset += record.size
+        return values
+
+    def _text(self, length: int) -> str:
+        text = str(self._data[self._offset:self._offset + length], "utf-8")
+        self._offset += length
+        return text
+
+    def next_page(self) -> PageLayout:
+        passed_through, element_count = self._unpack(PAGE)
+        if passed_through:
+            return None
+        elements = []
+        for _ in range(element_count):
+            code, *bbox = self._unpack(ELEMENT)
+            kind = KINDS[code]
+            bbox = tuple(bbox)
+            if kind == "image":
+                xref, = self._unpack(XREF)
+                elements.append(Element(kind, bbox, image=ImageBlock(bbox, xref)))
+            elif kind == "table":
+                rows = []
+                for _ in range(self._unpack(COUNT)[0]):
+                    row = []
+                    for _ in range(self._unpack(COUNT)[0]):
+                        *cell_bbox, length = self._unpack(CELL)
+                        row.append(TableCell(tuple(cell_bbox), self._text(length)))
+                    rows.append(row)
+                elements.append(Element(kind, bbox, table=Table(bbox, rows)))
+            else:
+                blocks = []
+                for _ in range(self._unpack(COUNT)[0]):
+                    *block_bbox, span_count = self._unpack(BLOCK)
+                    spans = []
+                    for _ in range(span_count):
+                        x, y, size, r, g, b, x0, y0, x1, y1, length = self._unpack(SPAN)
+                        spans.append(Span(self._text(length), (x, y), size, (r, g, b), (x0, y0, x1, y1)))
+                    blocks.append(TextBlock(tuple(block_bbox), spans))
+                elements.append(Element(kind, bbox, blocks=blocks))
+        return elements
+
+class LayoutWriter:
+    """Streams the pages of a layout into a cache entry, which appears on ``commit``.
+
+    Writing is best effort: if the disk fills up or the directory goes
+    away, the entry is discarded and ``add_page`` and ``commit`` return
+    ``False``, and the conversion carries on without caching.
+    """
+
+    def __init__(self, cache: "LayoutCache", key: str, page_count: int):
+        self._cache = cache
+        self._path = cache.path(key)
+        fd, temp_name = tempfile.mkstemp(dir=cache.directory, suffix=PART_SUFFIX)
+        self._temp_path = Path(temp_name)
+        self._file: BinaryIO = os.fdopen(fd, "wb")
+        self._compressor = zlib.compressobj(1)
+        self._write(HEADER.pack(MAGIC, LAYOUT_CACHE_VERSION, page_count))
+
+    def _write(self, data: bytes):
+        self._file.write(self._compressor.compress(data))
+
+    def add_page(self, elements: PageLayout) -> bool:
+        try:
+            self._write(encode_page(elements))
+        except OSError as e:
+            self._abandon(e)
+            return False
+        return True
+
+    def commit(self) -> bool:
+        try:
+            self._file.write(self._compressor.flush())
+            self._file.close()
+            os.replace(self._temp_path, self._path)
+        except OSError as e:
+            self._abandon(e)
+            return False
+        try:
+            self._cache.evict()
+        except OSError as e:
+            logger.warning(f"Evicting layout cache entries failed: {str(e)}")
+        return True
+
+    def discard(self):
+        try:
+            self._file.close()
+        except OSError:
+            pass  # Unflushed data of an entry nobody will read
+        self._temp_path.unlink(missing_ok=True)
+
+    def _abandon(self, error: OSError):
+        logger.warning(f"Not caching the layout of {self._path.name}: {str(error)}")
+        self.discard()
+
+class LayoutCache:
+    """Analysed page layouts on disk, keyed by the SHA-256 of the input PDF.
+
+    Converting a document again, by the same user or another, skips text
+    extraction, table detection and classification and goes straight to
+    rendering. Entries are versioned; ones written by another version are
+    ignored and removed. The least recently used entries are evicted once
+    the directory grows past ``LAYOUT_CACHE_MAX_MB``. Worker processes can
+    share the directory, as entries only appear through an atomic rename.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}{SUFFIX}"
+
+    def load(self, key: str, page_count: int) -> Optional[LayoutReader]:
+        """Return a reader for a cached layout, or ``None`` if there is no usable entry."""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            data = zlib.decompress(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error) as e:
+            logger.warning(f"Ignoring unreadable layout cache entry {path.name}: {str(e)}")
+            path.unlink(missing_ok=True)
+            return None
+
+        if len(data) < HEADER.size:
+            magic, version, cached_pages = b"", 0, 0
+        else:
+            magic, version, cached_pages = HEADER.unpack_from(data)
+        if magic != MAGIC or version != LAYOUT_CACHE_VERSION or cached_pages != page_count:
+            logger.info(f"Ignoring stale layout cache entry {path.name} (version {version})")
+            path.unlink(missing_ok=True)
+            return None
+
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Evicted meanwhile, the data is already read
+        return LayoutReader(memoryview(data), page_count)
+
+    def writer(self, key: str, page_count: int) -> Optional[LayoutWriter]:
+        """Start writing a layout for ``key``, or return ``None`` if caching is off or impossible."""
+        if not self.enabled:
+            return None
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            return LayoutWriter(self, key, page_count)
+        except OSError as e:
+            logger.warning(f"Layout cache unavailable: {str(e)}")
+            return None
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in ``max_bytes``.
+
+        Also deletes temp files of entries abandoned by a worker that exited.
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Evicted or committed by another worker
+            if entry.name.endswith(SUFFIX):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            elif entry.name.endswith(PART_SUFFIX) and now - stat.st_mtime > ORPHAN_AGE:
+                logger.info(f"Deleting abandoned layout cache file {entry.name}")
+                Path(entry.path).unlink(missing_ok=True)
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass  # Evicted by another worker
+
+layout_cache = LayoutCache(
+    settings.LAYOUT_CACHE_DIR or os.path.join(tempfile.gettempdir(), "bionic-layout-cache"),
+    settings.LAYOUT_CACHE_MAX_MB * 1024 * 1024
+)
@@ -1,16 +1,41 @@
-from typing import Dict, Tuple, Optional, List
+from typing import Any, Dict, Iterable, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import itertools
 import logging
+import multiprocessing
+import threading
 from pathlib import Path
 import tempfile
 import fitz  # PyMuPDF
 import os
 import time
+import hashlib
 from math import ceil
+from .jobs import ConversionJob, HTTP_499_CLIENT_CLOSED_REQUEST
+from .layout import PageText, Element, classify_page, should_pass_through
+from .layout_cache import layout_cache
+from ..core.config import settings
+from ..core.worker import current_rss
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# PyMuPDF isn't thread safe and holds the GIL while it works, so a worker
+# converts on this one thread, or with MAX_CONCURRENT_CONVERSIONS above 1 in
+# a pool of that many processes (see ``ConversionPool``)
+_converter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-converter")
+
+# Conversions a pool process runs before it is replaced, which hands the heap
+# fragmented by large documents back to the OS, as in scripts/bulk_convert.py
+POOL_MAX_TASKS = 50
+
+# Cancellation flags shared with the pool processes, one per conversion in
+# flight; tokens wrap around far beyond the number of conversions in flight
+TOKEN_SLOTS = 4096
+
 class PDFService:
     """Service for handling PDF processing and conversion."""
     
@@ -18,84 +43,13 @@ class PDFService:
     def calculate_bold_length(word: str) -> int:
         """Calculate how many characters should be bold based on word length."""
         return len(word) // 2
-    
-    @staticmethod
-    def get_element_bbox(element: Dict) -> fitz.Rect:
-        """Get the bounding box of an element."""
-        if "bbox" in element:
-            return fitz.Rect(element["bbox"])
-        return None
-        
-    @staticmethod
-    def is_overlapping(rect1: fitz.Rect, rect2: fitz.Rect, threshold: float = 1.0) -> bool:
-        """Check if two rectangles overlap with a threshold."""
-        if not (rect1 and rect2):
-            return False
-        return rect1.intersects(rect2.inflate(threshold))
-        
-    @staticmethod
-    def process_table(page: fitz.Page, table_block: Dict) -> List[Dict]:
-        """Process a table block and return its cells as structured data."""
-        try:
-            # Extract table structure using PyMuPDF's built-in table detection
-            table = page.find_tables(table_settings={
-                "vertical_strategy": "lines",
-                "horizontal_strategy": "lines",
-                "snap_tolerance": 3,
-                "join_tolerance": 3,
-                "edge_min_length": 3
-            })
-            
-            if table and len(table) > 0:
-                return table[0].extract()
-            return []
-        except Exception as e:
-            logger.warning(f"Error processing table: {str(e)}")
-            return []
-            
-    @staticmethod
-    def process_list(blocks: List[Dict], current_block_index: int) -> Tuple[List[Dict], int]:
-        """Process list items and return structured list data."""
-        list_items = []
-        i = current_block_index
-        
-        while i < len(blocks):
-            block = blocks[i]
-            if not block.get("lines"):
-                break
-                
-            first_line = block["lines"][0]
-            if not first_line.get("spans"):
-                break
-                
-            first_span = first_line["spans"][0]
-            text = first_span.get("text", "").strip()
-            
-            # Check for common list markers
-            if text.startswith(("•", "-", "*", "○", "▪", "1.", "a.", "A.")):
-                list_items.append(block)
-                i += 1
-            else:
-                break
-                
-        return list_items, i - current_block_index
-        
+
     @staticmethod
-    def process_header_footer(page: fitz.Page, block: Dict) -> bool:
-        """Determine if a block is a header or footer."""
-        bbox = PDFService.get_element_bbox(block)
-        if not bbox:
-            return False
-            
-        # Check if block is at top or bottom of page
-        page_height = page.rect.height
-        margin = 72  # 1 inch margin
-        
-        is_header = bbox.y0 < margin
-        is_footer = bbox.y1 > (page_height - margin)
-        
-        return is_header or is_footer
-        
+    def estimate_word_width(word: str, fontsize: float, bold: bool) -> float:
+        """Measure the rendered width of a word in built-in Helvetica."""
+        fontname = "Helvetica-Bold" if bold else "Helvetica"
+        return fitz.get_text_length(word, fontname=fontname, fontsize=fontsize)
+
     @staticmethod
     def handle_complex_formatting(span: Dict) -> Dict:
         """Handle complex text formatting attributes."""
@@ -110,8 +64,133 @@ class PDFService:
         return formatting
 
     @staticmethod
-    async def convert_to_bionic(content: bytes, filename: str) -> bytes:
-        """Convert a PDF file to bionic reading format."""
+    def insert_bionic_text(shape: fitz.Shape, point: Tuple[float, float], text: str, fontsize: float, color=(0, 0, 0), spacing: float = 0.2):
+        """Write text word by word with the first half of each word in bold.
+
+        Words are separated by ``spacing`` times the font size, starting at
+        ``point`` on the baseline.
+        """
+        current_x, y = point
+        for word in text.split():
+            bold_length = PDFService.calculate_bold_length(word)
+            bold_part = word[:bold_length]
+            regular_part = word[bold_length:]
+            
+            if bold_part:
+                shape.insert_text((current_x, y), bold_part, fontname="Helvetica-Bold", fontsize=fontsize, color=color)
+                current_x += PDFService.estimate_word_width(bold_part, fontsize, True)
+            
+            if regular_part:
+                shape.insert_text((current_x, y), regular_part, fontname="Helvetica", fontsize=fontsize, color=color)
+                current_x += PDFService.estimate_word_width(regular_part, fontsize, False)
+            
+            current_x += fontsize * spacing
+
+    @staticmethod
+    def render_page(new_page: fitz.Page, elements: Iterable[Element], doc: fitz.Document):
+        """Draw a page's classified elements onto its output page.
+
+        Text and table grids go into one Shape that is committed at the end.
+        Committing re-scans the page's whole content stream, so doing it once
+        per word, as ``Page.insert_text`` does, made pages quadratic in their
+        word count.
+        """
+        shape = new_page.new_shape()
+        for element in elements:
+            try:
+                if element.kind in ("text", "list"):
+                    # Spans keep their original position; list markers are
+                    # part of the text, so items keep their numbering
+                    for block in element.blocks:
+                        for span in block.spans:
+                            if not span.text.strip():
+                                continue
+                            try:
+                                PDFService.insert_bionic_text(shape, span.origin, span.text, span.size, span.color)
+                            except Exception as e:
+                                logger.error(f"Failed to insert text: {str(e)}")
+                                
+                elif element.kind == "header_footer":
+                    # Preserve headers and footers without bionic reading
+                    for span in element.blocks[0].spans:
+                        shape.insert_text(
+                            span.origin,
+                            span.text,
+                            fontname="Helvetica",
+                            fontsize=span.size,
+                            color=span.color
+                        )
+                        
+                elif element.kind == "image":
+                    xref = element.image.xref
+                    if xref:
+                        image_info = doc.extract_image(xref)
+                        if image_info:
+                            new_page.insert_image(
+                                element.bbox,
+                                stream=image_info["image"],
+                                mask=image_info.get("mask"),
+                                filename=image_info.get("name", "")
+                            )
+                            
+                elif element.kind == "table":
+                    # Render tables with preserved structure
+                    shape.draw_rect(element.bbox)
+                    for row in element.table.rows:
+                        for cell in row:
+                            shape.draw_rect(cell.bbox)
+                    shape.finish(color=(0, 0, 0))
+                    for row in element.table.rows:
+                        for cell in row:
+                            if cell.text:
+                                # Baseline one line below the top of the cell
+                                PDFService.insert_bionic_text(
+                                    shape, (cell.bbox[0] + 2, cell.bbox[1] + 10), cell.text, 8, spacing=0.5
+                                )
+                    
+            except Exception as e:
+                logger.warning(f"Error processing element {element.kind}: {str(e)}")
+                continue
+        shape.commit()
+
+    @staticmethod
+    async def convert_to_bionic(
+        content: bytes,
+        filename: str,
+        job: Optional[ConversionJob] = None,
+        content_hash: Optional[str] = None
+    ) -> bytes:
+        """Convert a PDF file to bionic reading format.
+
+        The conversion is CPU bound, so it runs on the worker's converter
+        thread, or in the conversion pool, to keep the event loop free for
+        progress watchers and other requests. Callers hold a conversion slot
+        (see ``JobService.conversion_slot``), so no more conversions run
+        than the converter can take. If a job is given, it is updated after
+        every page.
+        """
+        if conversion_pool.enabled:
+            return await conversion_pool.convert(content, filename, job, content_hash)
+        return await asyncio.get_running_loop().run_in_executor(
+            _converter, PDFService.convert_to_bionic_sync, content, filename, job, content_hash
+        )
+
+    @staticmethod
+    def convert_to_bionic_sync(
+        content: bytes,
+        filename: str,
+        job: Optional[ConversionJob] = None,
+        content_hash: Optional[str] = None
+    ) -> bytes:
+        """Blocking implementation of ``convert_to_bionic``.
+
+        Pages without text, and scans made of one full-page image, are copied
+        to the output unchanged instead of being rebuilt. The job, if given,
+        counts them in ``pages_passed_through``. Page layouts are kept in the
+        layout cache, so converting the same file again only renders it;
+        pass ``content_hash``, the SHA-256 of ``content``, if it is already
+        known.
+        """
         logger.debug(f"Starting conversion of file: {filename}")
         logger.debug(f"Content size: {len(content)} bytes")
         
@@ -126,6 +205,7 @@ class PDFService:
             logger.debug(f"Created temp directory: {temp_dir}")
             input_path = Path(temp_dir) / filename
             output_path = Path(temp_dir) / "output.pdf"
+            layout_writer = None
             
             try:
                 logger.debug("Writing input file to temporary directory")
@@ -138,286 +218,61 @@ class PDFService:
                 logger.debug("Creating output PDF document")
                 output_doc = fitz.open()
                 
-                # Copy fonts from original document to new document
-                logger.debug("Copying fonts from original document")
-                font_count = 0
-                for xref in range(1, doc.xref_length()):
-                    if doc.xref_is_font(xref):
-                        output_doc._copy_resources(doc, xref)
-                        font_count += 1
-                logger.debug(f"Copied {font_count} fonts to output document")
+                if job:
+                    job.start(len(doc))
+                
+                # Reuse the layout from an earlier conversion of the same file, or record it for the next one
+                content_hash = content_hash or hashlib.sha256(content).hexdigest()
+                cached_layout = layout_cache.load(content_hash, len(doc))
+                layout_writer = None if cached_layout else layout_cache.writer(content_hash, len(doc))
+                if cached_layout:
+                    logger.debug(f"Using cached layout for {filename}")
                 
-                # Track elements across pages for consistency
-                processed_elements = []
+                # First page of the current run of pages copied as they are
+                pass_start = None
                 
                 for page_num, page in enumerate(doc):
-                    logger.debug(f"Processing page {page_num + 1}/{len(doc)}")
-                    new_page = output_doc.new_page(width=page.rect.width, height=page.rect.height)
-                    
-                    # Get page structure with all text flags
-                    page_dict = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT | fitz.TEXTFLAGS_BLOCKS | fitz.TEXTFLAGS_HTML)
-                    blocks = page_dict["blocks"]
-                    
-                    # Debug logging for text extraction
-                    logger.debug(f"Page {page_num + 1} - Total blocks: {len(blocks)}")
-                    text_blocks = [b for b in blocks if b.get("type") == 0]
-                    logger.debug(f"Page {page_num + 1} - Text blocks: {len(text_blocks)}")
+                    if cached_layout:
+                        elements = cached_layout.next_page()
+                    else:
+                        # Extract the page once; every stage below shares it
+                        page_text = PageText(page)
+                        elements = None if should_pass_through(page_text) else list(classify_page(page_text))
+                        page_text.close()
+                        if layout_writer and not layout_writer.add_page(elements):
+                            layout_writer = None
+                    passed_through = elements is None
                     
-                    # First pass: Analyze and categorize elements
-                    page_elements = []
-                    for block in blocks:
-                        block_type = block.get("type", 0)
-                        bbox = PDFService.get_element_bbox(block)
+                    if passed_through:
+                        if pass_start is None:
+                            pass_start = page_num
+                    else:
+                        # Copy runs of pages in one go, which is much cheaper than page by page
+                        if pass_start is not None:
+                            output_doc.insert_pdf(doc, from_page=pass_start, to_page=page_num - 1)
+                            pass_start = None
                         
-                        if block_type == 0:  # Text block
-                            if PDFService.process_header_footer(page, block):
-                                element_type = "header_footer"
-                            elif any(PDFService.is_overlapping(bbox, elem["bbox"]) for elem in processed_elements):
-                                continue  # Skip overlapping elements
-                            else:
-                                # Check for lists
-                                list_items, count = PDFService.process_list(blocks, len(page_elements))
-                                if list_items:
-                                    element_type = "list"
-                                    block["list_items"] = list_items
-                                else:
-                                    element_type = "text"
-                                    
-                        elif block_type == 1:  # Image block
-                            element_type = "image"
-                        else:
-                            # Try to detect tables
-                            table_data = PDFService.process_table(page, block)
-                            if table_data:
-                                element_type = "table"
-                                block["table_data"] = table_data
-                            else:
-                                element_type = "other"
-                                
-                        page_elements.append({
-                            "type": element_type,
-                            "block": block,
-                            "bbox": bbox
-                        })
+                        new_page = output_doc.new_page(width=page.rect.width, height=page.rect.height)
+                        PDFService.render_page(new_page, elements, doc)
                     
-                    # Second pass: Process and render elements
-                    for element in page_elements:
-                        try:
-                            if element["type"] == "text":
-                                # Process text with bionic reading
-                                block = element["block"]
-                                for line in block["lines"]:
-                                    if not line.get("spans"):
-                                        continue
-                                    
-                                    for span in line["spans"]:
-                                        if not span.get("text"):
-                                            continue
-                                            
-                                        # Get original text properties
-                                        text = span["text"]
-                                        fontsize = span.get("size", 11)
-                                        color = span.get("color", (0, 0, 0))
-                                        origin = span["origin"]
-                                        
-                                        # Split into words for bionic reading
-                                        words = text.split()
-                                        current_x = origin[0]
-                                        
-                                        for word in words:
-                                            if not word:
-                                                continue
-                                                
-                                            # Calculate bold part length
-                                            bold_length = len(word) // 2
-                                            bold_part = word[:bold_length]
-                                            regular_part = word[bold_length:]
-                                            
-                                            try:
-                                                # Insert bold part with built-in Helvetica font
-                                                if bold_part:
-                                                    logger.debug(f"Attempting to render bold text: {bold_part} at position ({current_x}, {origin[1]})")
-                                                    new_page.insert_text(
-                                                        (current_x, origin[1]),
-                                                        bold_part,
-                                                        fontname="Helvetica-Bold",  # Standard Helvetica Bold
-                                                        fontsize=fontsize,
-                                                        color=color
-                                                    )
-                                                    logger.debug("Successfully rendered bold part")
-                                                    current_x += new_page.get_text_length(bold_part, fontname="Helvetica-Bold", fontsize=fontsize)
-                                                
-                                                # Insert regular part with built-in Helvetica font
-                                                if regular_part:
-                                                    logger.debug(f"Attempting to render regular text: {regular_part} at position ({current_x}, {origin[1]})")
-                                                    new_page.insert_text(
-                                                        (current_x, origin[1]),
-                                                        regular_part,
-                                                        fontname="Helvetica",  # Standard Helvetica
-                                                        fontsize=fontsize,
-                                                        color=color
-                                                    )
-                                                    logger.debug("Successfully rendered regular part")
-                                                    current_x += new_page.get_text_length(regular_part, fontname="Helvetica", fontsize=fontsize)
-                                                
-                                                # Add word spacing
-                                                current_x += fontsize * 0.2
-                                                
-                                            except Exception as e:
-                                                logger.error(f"Failed to insert text: {str(e)}")
-                                                # No need for fallback since we're already using built-in fonts
-                                            
-                            elif element["type"] == "image":
-                                # Handle images
-                                block = element["block"]
-                                xref = block.get("xref")
-                                if xref:
-                                    image_info = doc.extract_image(xref)
-                                    if image_info:
-                                        new_page.insert_image(
-                                            element["bbox"],
-                                            stream=image_info["image"],
-                                            mask=image_info.get("mask"),
-                                            filename=image_info.get("name", "")
-                                        )
-                                        processed_elements.append(element)
-                                        
-                            elif element["type"] == "table":
-                                # Render tables with preserved structure
-                                table_data = element["block"].get("table_data", [])
-                                if table_data:
-                                    # Draw table grid
-                                    bbox = element["bbox"]
-                                    new_page.draw_rect(bbox)
-                                    
-                                    # Draw cells
-                                    for row in table_data:
-                                        for cell in row:
-                                            cell_rect = fitz.Rect(cell["bbox"])
-                                            new_page.draw_rect(cell_rect)
-                                            
-                                            # Apply bionic reading to cell text
-                                            if cell.get("text"):
-                                                words = cell["text"].split()
-                                                current_x = cell_rect.x0 + 2
-                                                y0 = cell_rect.y0 + 2
-                                                
-                                                for word in words:
-                                                    if not word:
-                                                        continue
-                                                    
-                                                    bold_length = PDFService.calculate_bold_length(word)
-                                                    bold_part = word[:bold_length]
-                                                    regular_part = word[bold_length:]
-                                                    
-                                                    if bold_part:
-                                                        new_page.insert_text(
-                                                            (current_x, y0),
-                                                            bold_part,
-                                                            fontname="Helvetica-Bold",
-                                                            fontsize=8
-                                                        )
-                                                        current_x += PDFService.estimate_word_width(bold_part, 8, True)
-                                                    
-                                                    if regular_part:
-                                                        new_page.insert_text(
-                                                            (current_x, y0),
-                                                            regular_part,
-                                                            fontname="Helvetica",
-                                                            fontsize=8
-                                                        )
-                                                        current_x += PDFService.estimate_word_width(regular_part, 8, False)
-                                                    
-                                                    current_x += 4
-                                    
-                                    processed_elements.append(element)
-                                    
-                            elif element["type"] == "list":
-                                # Handle lists with proper indentation and markers
-                                list_items = element["block"].get("list_items", [])
-                                y0 = element["bbox"].y0
-                                indent = 20
-                                
-                                for item in list_items:
-                                    if item.get("lines"):
-                                        line = item["lines"][0]
-                                        if line.get("spans"):
-                                            span = line["spans"][0]
-                                            text = span["text"].strip()
-                                            
-                                            # Draw list marker
-                                            new_page.insert_text(
-                                                (element["bbox"].x0, y0),
-                                                "•",
-                                                fontname="Helvetica",
-                                                fontsize=span.get("size", 12)
-                                            )
-                                            
-                                            # Process list item text with bionic reading
-                                            current_x = element["bbox"].x0 + indent
-                                            words = text.split()
-                                            
-                                            for word in words:
-                                                if not word:
-                                                    continue
-                                                
-                                                bold_length = PDFService.calculate_bold_length(word)
-                                                bold_part = word[:bold_length]
-                                                regular_part = word[bold_length:]
-                                                
-                                                if bold_part:
-                                                    new_page.insert_text(
-                                                        (current_x, y0),
-                                                        bold_part,
-                                                        fontname="Helvetica-Bold",
-                                                        fontsize=span.get("size", 12)
-                                                    )
-                                                    current_x += PDFService.estimate_word_width(
-                                                        bold_part,
-                                                        span.get("size", 12),
-                                                        True
-                                                    )
-                                                
-                                                if regular_part:
-                                                    new_page.insert_text(
-                                                        (current_x, y0),
-                                                        regular_part,
-                                                        fontname="Helvetica",
-                                                        fontsize=span.get("size", 12)
-                                                    )
-                                                    current_x += PDFService.estimate_word_width(
-                                                        regular_part,
-                                                        span.get("size", 12),
-                                                        False
-                                                    )
-                                                
-                                                current_x += span.get("size", 12) * 0.3
-                                            
-                                            y0 += span.get("size", 12) * 1.5
-                                            
-                            elif element["type"] == "header_footer":
-                                # Preserve headers and footers without bionic reading
-                                block = element["block"]
-                                for line in block["lines"]:
-                                    for span in line["spans"]:
-                                        new_page.insert_text(
-                                            span["origin"],
-                                            span["text"],
-                                            fontname=span.get("font", "Helvetica"),
-                                            fontsize=span.get("size", 12),
-                                            color=span.get("color", (0, 0, 0))
-                                        )
-                                processed_elements.append(element)
-                                
-                        except Exception as e:
-                            logger.warning(f"Error processing element: {str(e)}")
-                            continue
+                    if job:
+                        job.page_done(page_num, passed_through)
+                
+                if pass_start is not None:
+                    output_doc.insert_pdf(doc, from_page=pass_start, to_page=len(doc) - 1)
+                
+                if layout_writer:
+                    # Dropped either way: committed, or discarded if the cache couldn't take it
+                    layout_writer.commit()
+                    layout_writer = None
                 
                 # Save the processed PDF
                 output_doc.save(output_path, garbage=4, deflate=True)
                 processed_content = output_path.read_bytes()
                 return processed_content
                 
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Error processing PDF: {str(e)}", exc_info=True)
                 raise HTTPException(
@@ -425,9 +280,156 @@ class PDFService:
                     detail=f"Error processing PDF: {str(e)}"
                 )
             finally:
+                if layout_writer:
+                    # The conversion failed or was cancelled part way through
+                    layout_writer.discard()
                 if 'doc' in locals():
                     doc.close()
                 if 'output_doc' in locals():
                     output_doc.close()
+                # Drop MuPDF's cached fonts and images so they don't pile up in the
+                # process; the store is global, which is safe as nothing else uses
+                # it while this conversion holds the converter thread or pool process
+                fitz.TOOLS.store_shrink(100)
+
+# Set in each pool process by _init_pool_process
+_pool_events = None
+_pool_cancelled = None
+
+def _init_pool_process(events, cancelled):
+    global _pool_events, _pool_cancelled
+    _pool_events = events
+    _pool_cancelled = cancelled
+    logging.basicConfig(level=logging.WARNING)
+
+class PooledJob:
+    """Stands in for a ``ConversionJob`` in a pool process, sending its progress to the worker.
+
+    The worker updates the real job and, once it is cancelled, raises the
+    job's flag, which stops the conversion at the next page boundary.
+    """
+
+    def __init__(self, token: int):
+        self.token = token
+        self._track_memory = bool(settings.WORKER_MEMORY_CEILING_MB)
+
+    def start(self, total_pages: int):
+        self._check_cancelled()
+        _pool_events.put((self.token, "start", (total_pages, self._rss())))
+
+    def page_done(self, page_num: int, passed_through: bool = False):
+        _pool_events.put((self.token, "page", (page_num, passed_through, self._rss())))
+        self._check_cancelled()
+
+    def _rss(self) -> Optional[int]:
+        return current_rss() if self._track_memory else None
+
+    def _check_cancelled(self):
+        if _pool_cancelled[self.token]:
+            raise HTTPException(status_code=HTTP_499_CLIENT_CLOSED_REQUEST, detail="Conversion cancelled")
+
+def _convert_in_pool(content: bytes, filename: str, token: Optional[int], content_hash: Optional[str]) -> Tuple[str, Any]:
+    """Convert in a pool process, returning ``("ok", pdf)`` or ``("error", (status_code, detail))``."""
+    job = PooledJob(token) if token is not None else None
+    try:
+        return "ok", PDFService.convert_to_bionic_sync(content, filename, job, content_hash)
+    except HTTPException as e:
+        return "error", (e.status_code, str(e.detail))
+
+def _warm_pool_process():
+    pass
+
+class ConversionPool:
+    """Converts up to ``size`` PDFs at once, each in a process of its own.
+
+    PyMuPDF can't convert on several threads of one process, so a worker
+    that should run more than one conversion at a time, e.g. the files of a
+    batch, hands them to this pool. Progress is sent back over a queue and
+    applied to the job by a relay thread, which plays the converter
+    thread's part: it calls ``start`` and ``page_done`` and, once they
+    raise the job's cancellation, flags the conversion to stop. With a
+    memory ceiling, each job is checked against its own process's size.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._events = None
+        self._cancelled = None
+        self._jobs: Dict[int, ConversionJob] = {}
+        self._tokens = itertools.count()
+        self._starting: Optional[asyncio.Lock] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 1
+
+    async def convert(
+        self,
+        content: bytes,
+        filename: str,
+        job: Optional[ConversionJob],
+        content_hash: Optional[str]
+    ) -> bytes:
+        """Convert in a pool process, with the same results and errors as on the converter thread."""
+        if self._executor is None:
+            if self._starting is None:
+                self._starting = asyncio.Lock()
+            async with self._starting:
+                if self._executor is None:
+                    # Spawning the processes blocks, so not on the event loop
+                    await run_in_threadpool(self._start)
+
+        token = next(self._tokens) % TOKEN_SLOTS
+        self._cancelled[token] = 0
+        if job:
+            self._jobs[token] = job
+        future = self._executor.submit(_convert_in_pool, content, filename, token if job else None, content_hash)
+        try:
+            outcome, value = await asyncio.wrap_future(future)
+        finally:
+            self._jobs.pop(token, None)
+            if not future.done():
+                # Abandoned, e.g. the batch it belongs to was cancelled
+                self._cancelled[token] = 1
+        if outcome == "ok":
+            return value
+        if job and job.cancelled:
+            raise job.cancellation
+        status_code, detail = value
+        raise HTTPException(status_code=status_code, detail=detail)
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn")
+        self._events = context.Queue()
+        self._cancelled = context.RawArray("b", TOKEN_SLOTS)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=context,
+            initializer=_init_pool_process,
+            initargs=(self._events, self._cancelled),
+            max_tasks_per_child=POOL_MAX_TASKS
+        )
+        threading.Thread(target=self._relay, name="pdf-pool-relay", daemon=True).start()
+        # Start every process now rather than one per submitted conversion
+        for future in [self._executor.submit(_warm_pool_process) for _ in range(self.size)]:
+            future.result()
+        logger.info(f"Started {self.size} conversion processes")
+
+    def _relay(self):
+        while True:
+            token, kind, args = self._events.get()
+            job = self._jobs.get(token)
+            if job is None:
+                continue  # Finished or abandoned meanwhile
+            try:
+                if kind == "start":
+                    job.start(*args)
+                else:
+                    job.page_done(*args)
+            except HTTPException:
+                self._cancelled[token] = 1
+
+conversion_pool = ConversionPool(settings.MAX_CONCURRENT_CONVERSIONS)
 
 pdf_service = PDFService()
\ No newline at end of file
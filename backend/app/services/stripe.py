@@ -1,9 +1,32 @@
-import stripe
+from typing import Any, Dict, Optional
+from datetime import datetime, timezone
 from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+import json
+import logging
+import stripe
+from .entitlements import entitlement_service
 from ..core.config import settings
+from ..core.database import get_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# How Stripe subscription statuses map onto user_subscriptions.status;
+# past_due stays active while Stripe retries the payment
+SUBSCRIPTION_STATUSES = {
+    'active': 'active',
+    'trialing': 'active',
+    'past_due': 'active',
+    'canceled': 'canceled',
+    'incomplete_expired': 'expired',
+    'unpaid': 'expired'
+}
 
 class StripeService:
     def __init__(self):
+        if not (settings.STRIPE_SECRET_KEY and settings.STRIPE_WEBHOOK_SECRET):
+            raise Exception("Stripe is not configured. Set STRIPE_SECRET_KEY and STRIPE_WEBHOOK_SECRET.")
         stripe.api_key = settings.STRIPE_SECRET_KEY
         self.prices = {
             'pro_monthly': settings.STRIPE_PRO_MONTHLY_PRICE_ID,
@@ -11,6 +34,7 @@ class StripeService:
             'ultimate_monthly': settings.STRIPE_ULTIMATE_MONTHLY_PRICE_ID,
             'ultimate_yearly': settings.STRIPE_ULTIMATE_YEARLY_PRICE_ID,
         }
+        self._plan_ids: Dict[str, str] = {}
 
     async def create_checkout_session(self, price_id: str, user_id: str, user_email: str, success_url: str, cancel_url: str):
         try:
@@ -25,6 +49,12 @@ class StripeService:
                 cancel_url=cancel_url,
                 metadata={
                     'user_id': user_id
+                },
+                # Copied onto the subscription, so its webhooks name the user
+                subscription_data={
+                    'metadata': {
+                        'user_id': user_id
+                    }
                 }
             )
             return session
@@ -41,39 +71,115 @@ class StripeService:
         except stripe.error.StripeError as e:
             raise HTTPException(status_code=400, detail=str(e))
 
-    async def handle_webhook(self, payload: bytes, sig_header: str):
+    def construct_event(self, payload: bytes, sig_header: str) -> Dict[str, Any]:
+        """Verify a webhook's signature and return its event as plain dicts."""
         try:
-            event = stripe.Webhook.construct_event(
+            stripe.Webhook.construct_event(
                 payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
             )
-            
-            if event['type'] == 'customer.subscription.created':
-                await self._handle_subscription_created(event)
-            elif event['type'] == 'customer.subscription.updated':
-                await self._handle_subscription_updated(event)
-            elif event['type'] == 'customer.subscription.deleted':
-                await self._handle_subscription_deleted(event)
-                
-            return {'status': 'success'}
-            
         except stripe.error.SignatureVerificationError:
             raise HTTPException(status_code=400, detail='Invalid signature')
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Invalid payload')
+        return json.loads(payload)
+
+    async def handle_event(self, event: Dict[str, Any]):
+        """Apply a verified webhook event.
+
+        Handling is idempotent: subscriptions are written as Stripe reports
+        them, and the database ignores events older than the last change
+        applied to the user, so retries and out-of-order deliveries are
+        harmless whichever worker they reach.
+        """
+        if event['type'] == 'customer.subscription.created':
+            await self._handle_subscription_created(event)
+        elif event['type'] == 'customer.subscription.updated':
+            await self._handle_subscription_updated(event)
+        elif event['type'] == 'customer.subscription.deleted':
+            await self._handle_subscription_deleted(event)
+
+    def tier_for_price(self, price_id: str) -> Optional[str]:
+        """Return the tier a price subscribes to, e.g. ``pro`` for ``pro_monthly``."""
+        for plan, plan_price_id in self.prices.items():
+            if plan_price_id == price_id:
+                return plan.split('_')[0]
+        return None
 
     async def _handle_subscription_created(self, event):
-        subscription = event['data']['object']
-        # Update user's subscription status in Supabase
-        # This will be implemented when we add the database schema
+        await self._apply_subscription(event['data']['object'], event['created'])
 
     async def _handle_subscription_updated(self, event):
-        subscription = event['data']['object']
-        # Update user's subscription status in Supabase
-        # This will be implemented when we add the database schema
+        await self._apply_subscription(event['data']['object'], event['created'])
 
     async def _handle_subscription_deleted(self, event):
-        subscription = event['data']['object']
-        # Update user's subscription status in Supabase
-        # This will be implemented when we add the database schema
+        await self._apply_subscription(event['data']['object'], event['created'], deleted=True)
+
+    async def _apply_subscription(self, subscription: Dict[str, Any], changed_at: float, deleted: bool = False):
+        """Record a subscription's state in ``user_subscriptions`` and the entitlement cache."""
+        user_id = (subscription.get('metadata') or {}).get('user_id')
+        if not user_id:
+            user_id = await run_in_threadpool(self._user_for_customer, subscription['customer'])
+        if not user_id:
+            logger.warning(f"No user found for Stripe subscription {subscription['id']}")
+            return
+
+        item = subscription['items']['data'][0]
+        tier = self.tier_for_price(item['price']['id'])
+        if tier is None:
+            logger.warning(f"Stripe subscription {subscription['id']} is for an unknown price {item['price']['id']}")
+            return
+        status = 'canceled' if deleted else SUBSCRIPTION_STATUSES.get(subscription['status'], 'expired')
+
+        # Newer API versions report the billing period per item
+        period_end = subscription.get('current_period_end') or item.get('current_period_end')
+        saved = await run_in_threadpool(self._save_subscription, user_id, tier, status, subscription, period_end, changed_at)
+        if not saved:
+            logger.info(f"Ignoring Stripe subscription {subscription['id']} change older than the one saved for user {user_id}")
+            return
+        entitlement_service.update(user_id, tier if status == 'active' else settings.DEFAULT_TIER, changed_at)
+
+    def _user_for_customer(self, customer_id: str) -> Optional[str]:
+        result = (
+            get_client().table('user_subscriptions')
+            .select('user_id')
+            .eq('stripe_customer_id', customer_id)
+            .limit(1)
+            .execute()
+        )
+        return result.data[0]['user_id'] if result.data else None
+
+    def _plan_id(self, tier: str) -> str:
+        if tier not in self._plan_ids:
+            result = get_client().table('subscription_plans').select('id').eq('tier', tier).single().execute()
+            self._plan_ids[tier] = result.data['id']
+        return self._plan_ids[tier]
+
+    def _save_subscription(
+        self,
+        user_id: str,
+        tier: str,
+        status: str,
+        subscription: Dict[str, Any],
+        period_end: Optional[int],
+        changed_at: float
+    ) -> bool:
+        """Write the subscription unless a newer Stripe event was already saved for the user.
+
+        The comparison happens in ``apply_stripe_subscription``, in the same
+        statement as the write, so workers applying events concurrently
+        can't undo each other. Returns ``True`` if the change was written.
+        """
+        result = get_client().rpc('apply_stripe_subscription', {
+            'p_user_id': user_id,
+            'p_subscription_plan_id': self._plan_id(tier),
+            'p_status': status,
+            'p_stripe_subscription_id': subscription['id'],
+            'p_stripe_customer_id': subscription['customer'],
+            'p_current_period_end': datetime.fromtimestamp(period_end, timezone.utc).isoformat() if period_end else None,
+            'p_stripe_event_created': int(changed_at)
+        }).execute()
+        if result.data:
+            logger.info(f"Saved {tier} subscription ({status}) for user {user_id}")
+        return bool(result.data)
 
 stripe_service = StripeService() 
\ No newline at end of file
@@ -0,0 +1,289 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from ..core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upload ids are generated here, so anything else is refused before touching the disk
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+CHECKSUM_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+META_FILE = "meta.json"
+CHUNKS_DIR = "chunks"
+RECEIVED_FILE = "received"
+ASSEMBLED_FILE = "assembled.pdf"
+
+# Size of the reads chunks are copied into the assembled file in
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class UploadSession:
+    """A resumable upload, kept on disk so any worker can take the next chunk.
+
+    Each chunk is kept in its own file under ``chunks``, only put in place
+    once its length and checksum are verified, so a bad retry never
+    clobbers a chunk that already arrived intact. Received chunks are
+    recorded as lines of the ``received`` log, appended in one write so
+    concurrent workers don't interleave.
+    """
+
+    def __init__(self, directory: Path, meta: Dict[str, Any]):
+        self.directory = directory
+        self.id: str = meta["upload_id"]
+        self.user_id: Optional[str] = meta["user_id"]
+        self.filename: str = meta["filename"]
+        self.size: int = meta["size"]
+        self.chunk_size: int = meta["chunk_size"]
+        self.sha256: Optional[str] = meta.get("sha256")
+        self.created_at: float = meta["created_at"]
+
+    def chunk_path(self, index: int) -> Path:
+        return self.directory / CHUNKS_DIR / str(index)
+
+    @property
+    def chunk_count(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def expires_at(self) -> float:
+        return self.created_at + settings.UPLOAD_SESSION_TTL
+
+    def chunk_length(self, index: int) -> int:
+        """Length of chunk ``index``; only the last one may be shorter than ``chunk_size``."""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def received_chunks(self) -> Set[int]:
+        try:
+            log = (self.directory / RECEIVED_FILE).read_text()
+        except FileNotFoundError:
+            return set()
+        return {int(line.split()[0]) for line in log.splitlines() if line}
+
+    def received_ranges(self) -> List[List[int]]:
+        """Return the byte ranges received so far as merged ``[start, end)`` pairs."""
+        ranges: List[List[int]] = []
+        for index in sorted(self.received_chunks()):
+            start = index * self.chunk_size
+            end = start + self.chunk_length(index)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the upload's progress as a JSON-serialisable dict."""
+        received = self.received_chunks()
+        missing = [index for index in range(self.chunk_count) if index not in received]
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunk_count": self.chunk_count,
+            "received": self.received_ranges(),
+            "missing_chunks": missing,
+            "complete": not missing,
+            "expires_at": int(self.expires_at)
+        }
+
+class UploadService:
+    """Resumable chunked uploads, assembled on local disk.
+
+    A client creates a session for a file, PUTs its chunks in any order and
+    as often as needed, asks which ranges arrived after a dropped
+    connection, and finalizes once every chunk is in. Chunk bodies are
+    streamed to disk, never held in memory whole. Sessions expire after
+    ``UPLOAD_SESSION_TTL`` seconds.
+    """
+
+    def __init__(self):
+        self.root = Path(settings.UPLOAD_DIR or os.path.join(tempfile.gettempdir(), "bionic-uploads"))
+
+    def create(self, user_id: Optional[str], filename: str, size: int, sha256: Optional[str] = None) -> UploadSession:
+        """Start an upload session for a file of ``size`` bytes.
+
+        If the SHA-256 of the whole file is given, the assembled upload is
+        checked against it before it is converted.
+        """
+        if not filename.lower().endswith(".pdf"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Only PDF files are supported"
+            )
+        if size <= 0 or size > settings.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File exceeds the maximum size of {settings.MAX_FILE_SIZE // (1024 * 1024)}MB"
+            )
+        if sha256 is not None and not CHECKSUM_PATTERN.match(sha256.lower()):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File checksum must be a hex SHA-256")
+
+        self.sweep_expired()
+        meta = {
+            "upload_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "filename": Path(filename).name,
+            "size": size,
+            "chunk_size": settings.UPLOAD_CHUNK_SIZE,
+            "sha256": sha256.lower() if sha256 else None,
+            "created_at": time.time()
+        }
+        directory = self.root / meta["upload_id"]
+        (directory / CHUNKS_DIR).mkdir(parents=True)
+        # Written last, so a session only exists once its directories do
+        (directory / META_FILE).write_text(json.dumps(meta))
+        logger.info(f"Created upload {meta['upload_id']} for {filename} ({size} bytes)")
+        return UploadSession(directory, meta)
+
+    def get(self, user_id: Optional[str], upload_id: str) -> UploadSession:
+        """Return a user's live upload session.
+
+        Raises:
+            HTTPException: 404 if there is no such session for this user or it expired
+        """
+        session = None
+        if UPLOAD_ID_PATTERN.match(upload_id):
+            directory = self.root / upload_id
+            try:
+                session = UploadSession(directory, json.loads((directory / META_FILE).read_text()))
+            except (FileNotFoundError, ValueError):
+                pass
+        if session is None or session.user_id != user_id or session.expires_at < time.time():
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+        return session
+
+    async def write_chunk(
+        self,
+        session: UploadSession,
+        index: int,
+        offset: int,
+        checksum: str,
+        body: AsyncIterator[bytes]
+    ):
+        """Store chunk ``index`` at ``offset`` from a request body, checking its SHA-256.
+
+        The body is staged in a file of its own and only replaces the chunk
+        and is recorded as received if its length and checksum match.
+        Otherwise it is dropped, leaving any earlier copy of the chunk intact,
+        and the client sends it again.
+        """
+        if not 0 <= index < session.chunk_count:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Chunk {index} is out of range")
+        if offset != index * session.chunk_size:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Chunk {index} starts at offset {index * session.chunk_size}, not {offset}"
+            )
+        checksum = checksum.lower()
+        if not CHECKSUM_PATTERN.match(checksum):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Chunk checksum must be a hex SHA-256")
+
+        expected = session.chunk_length(index)
+        sha256 = hashlib.sha256()
+        written = 0
+        staging_path = session.chunk_path(index).with_name(f"{index}.{uuid.uuid4().hex}.part")
+        try:
+            f = await run_in_threadpool(open, staging_path, "wb")
+            try:
+                async for data in body:
+                    if written + len(data) > expected:
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Chunk {index} is longer than {expected} bytes"
+                        )
+                    await run_in_threadpool(f.write, data)
+                    sha256.update(data)
+                    written += len(data)
+            finally:
+                await run_in_threadpool(f.close)
+
+            if written != expected:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Chunk {index} is {written} bytes, expected {expected}"
+                )
+            if sha256.hexdigest() != checksum:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Checksum mismatch for chunk {index}")
+            await run_in_threadpool(os.replace, staging_path, session.chunk_path(index))
+        finally:
+            await run_in_threadpool(staging_path.unlink, True)
+
+        await run_in_threadpool(self._record_chunk, session, f"{index} {offset} {written} {checksum}\n")
+
+    @staticmethod
+    def _record_chunk(session: UploadSession, line: str):
+        fd = os.open(session.directory / RECEIVED_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    async def assemble(self, session: UploadSession) -> Tuple[Path, str]:
+        """Join the chunks into one file once every chunk has been received.
+
+        Returns the path of the file and its SHA-256, computed while it is
+        written, so the conversion doesn't hash it again.
+
+        Raises:
+            HTTPException: 409 listing the missing chunks if the upload is
+                incomplete, 400 if it doesn't match the file's SHA-256
+        """
+        snapshot = await run_in_threadpool(session.snapshot)
+        if not snapshot["complete"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Upload is missing chunks {snapshot['missing_chunks']}"
+            )
+        path, digest = await run_in_threadpool(self._assemble, session)
+        if session.sha256 and digest != session.sha256:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload does not match the file's checksum")
+        return path, digest
+
+    @staticmethod
+    def _assemble(session: UploadSession) -> Tuple[Path, str]:
+        path = session.directory / ASSEMBLED_FILE
+        part_path = path.with_name(f"{ASSEMBLED_FILE}.{uuid.uuid4().hex}.part")
+        sha256 = hashlib.sha256()
+        try:
+            with open(part_path, "wb") as output:
+                for index in range(session.chunk_count):
+                    with open(session.chunk_path(index), "rb") as chunk:
+                        for data in iter(lambda: chunk.read(COPY_BUFFER_SIZE), b""):
+                            output.write(data)
+                            sha256.update(data)
+            # Finalizing again, e.g. after a lost response, replaces the file whole
+            os.replace(part_path, path)
+        finally:
+            part_path.unlink(missing_ok=True)
+        return path, sha256.hexdigest()
+
+    def discard(self, session: UploadSession):
+        shutil.rmtree(session.directory, ignore_errors=True)
+        logger.debug(f"Discarded upload {session.id}")
+
+    def sweep_expired(self):
+        """Delete sessions past ``UPLOAD_SESSION_TTL``, including abandoned ones."""
+        if not self.root.exists():
+            return
+        cutoff = time.time() - settings.UPLOAD_SESSION_TTL
+        for directory in self.root.iterdir():
+            try:
+                if directory.stat().st_mtime < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    logger.info(f"Deleted expired upload {directory.name}")
+            except FileNotFoundError:
+                pass  # Swept by another worker
+
+upload_service = UploadService()
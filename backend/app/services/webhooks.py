@@ -0,0 +1,210 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
+from . import stripe_service
+from ..core.database import get_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Event ids remembered for deduplication; Stripe redelivers within days at most
+SEEN_EVENTS = 10000
+
+# Attempts at applying an event before giving up, with a growing pause in between
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 2.0
+
+# Recorded events still unapplied after this many seconds were lost by the
+# worker that received them, or given up on, and are applied again
+RECOVERY_AGE = 120.0
+RECOVERY_INTERVAL = 300.0
+RECOVERY_BATCH = 100
+
+EVENTS_TABLE = "stripe_webhook_events"
+
+class WebhookService:
+    """Acknowledges Stripe webhooks straight away and applies them in the background.
+
+    Stripe retries webhooks that aren't acknowledged quickly, and applying
+    one takes several database round trips, so the endpoint only verifies
+    the signature and records the event in ``stripe_webhook_events`` before
+    acknowledging it. Events are then applied one at a time, in the order
+    received, and deduplicated by id since Stripe delivers at least once.
+    Events a worker loses by exiting, or gives up on, stay recorded as
+    unprocessed and are applied again by ``recover``. A retry can still
+    reach another worker, which is why the handlers themselves are
+    idempotent too.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        # Event being applied, which has already left the queue
+        self._current: Optional[Dict[str, Any]] = None
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.failed = 0
+        self.recovered = 0
+
+    async def receive(self, event: Dict[str, Any]) -> bool:
+        """Record a verified event and queue it, returning ``False`` if it was already received.
+
+        Raises:
+            HTTPException: 503 if the event could not be recorded, so Stripe
+                sends it again later
+        """
+        if event["id"] in self._seen:
+            self.duplicates += 1
+            logger.info(f"Ignoring duplicate webhook event {event['id']}")
+            return False
+        try:
+            recorded = await run_in_threadpool(self._record, event)
+        except Exception as e:
+            logger.error(f"Could not record webhook event {event['id']}: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Could not record the event, please retry"
+            )
+        if not recorded:
+            # Received by another worker, which applies it
+            self.duplicates += 1
+            logger.info(f"Ignoring webhook event {event['id']} already recorded")
+            return False
+        return self._enqueue(event)
+
+    async def recover(self):
+        """Apply recorded events nobody applied, every ``RECOVERY_INTERVAL`` seconds.
+
+        Only events older than ``RECOVERY_AGE`` are picked up, by which time
+        the worker that received them has applied them, given up or exited.
+        """
+        while True:
+            await asyncio.sleep(RECOVERY_AGE)
+            try:
+                events = await run_in_threadpool(self._load_pending)
+            except Exception as e:
+                logger.warning(f"Could not load unapplied webhook events: {str(e)}")
+                events = []
+            for event in events:
+                if self._enqueue(event):
+                    self.recovered += 1
+                    logger.info(f"Recovered webhook event {event['id']} ({event['type']})")
+            await asyncio.sleep(RECOVERY_INTERVAL - RECOVERY_AGE)
+
+    async def drain(self, timeout: float):
+        """Wait for queued events to be applied, e.g. before the worker exits.
+
+        Events still not applied stay recorded and are applied by another
+        worker's ``recover``.
+        """
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pending = [self._current] if self._current else []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            logger.warning(
+                f"Exiting with {len(pending)} webhook events left for recovery: "
+                f"{', '.join(event['id'] for event in pending)}"
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "queued": self._queue.qsize() if self._queue else 0
+        }
+
+    def _enqueue(self, event: Dict[str, Any]) -> bool:
+        """Queue an event unless this worker already has, returning whether it was queued."""
+        event_id = event["id"]
+        if event_id in self._seen:
+            return False
+        self._seen[event_id] = None
+        while len(self._seen) > SEEN_EVENTS:
+            self._seen.popitem(last=False)
+
+        self.received += 1
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        self._queue.put_nowait(event)
+        return True
+
+    async def _run(self):
+        while True:
+            event = await self._queue.get()
+            self._current = event
+            try:
+                await self._apply(event)
+            finally:
+                self._current = None
+                self._queue.task_done()
+
+    async def _apply(self, event: Dict[str, Any]):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                await stripe_service.load_async()
+                await stripe_service.handle_event(event)
+                self.processed += 1
+                break
+            except Exception as e:
+                logger.warning(f"Applying webhook event {event['id']} ({event['type']}) failed, attempt {attempt}: {str(e)}")
+                if attempt < MAX_ATTEMPTS:
+                    await asyncio.sleep(RETRY_DELAY * attempt)
+        else:
+            # Left unprocessed, so recovery tries again; forget the id so it can
+            self.failed += 1
+            self._seen.pop(event["id"], None)
+            logger.error(f"Gave up applying webhook event {event['id']} ({event['type']}) for now")
+            return
+
+        try:
+            await run_in_threadpool(self._mark_processed, event["id"])
+        except Exception as e:
+            # Applying it again is harmless
+            logger.warning(f"Could not mark webhook event {event['id']} as applied: {str(e)}")
+
+    @staticmethod
+    def _record(event: Dict[str, Any]) -> bool:
+        """Insert the event, returning ``False`` if it was already recorded."""
+        result = get_client().table(EVENTS_TABLE).upsert({
+            "id": event["id"],
+            "type": event["type"],
+            "payload": event
+        }, on_conflict="id", ignore_duplicates=True).execute()
+        return bool(result.data)
+
+    @staticmethod
+    def _load_pending() -> List[Dict[str, Any]]:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=RECOVERY_AGE)
+        result = (
+            get_client().table(EVENTS_TABLE)
+            .select("payload")
+            .is_("processed_at", "null")
+            .lt("received_at", cutoff.isoformat())
+            .order("received_at")
+            .limit(RECOVERY_BATCH)
+            .execute()
+        )
+        return [row["payload"] for row in result.data]
+
+    @staticmethod
+    def _mark_processed(event_id: str):
+        get_client().table(EVENTS_TABLE).update({
+            "processed_at": datetime.now(timezone.utc).isoformat()
+        }).eq("id", event_id).execute()
+
+webhook_service = WebhookService()
@@ -1,4 +1,5 @@
 -- Drop existing tables if they exist (in reverse order of dependencies)
+DROP TABLE IF EXISTS stripe_webhook_events;
 DROP TABLE IF EXISTS referrals;
 DROP TABLE IF EXISTS user_subscriptions;
 DROP TABLE IF EXISTS subscription_plans;
@@ -20,8 +21,10 @@ CREATE TABLE user_subscriptions (
     stripe_subscription_id TEXT,
     stripe_customer_id TEXT,
     current_period_end TIMESTAMP WITH TIME ZONE,
+    stripe_event_created BIGINT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW())
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+    UNIQUE(user_id)
 );
 
 -- Create referrals table
@@ -35,10 +38,24 @@ CREATE TABLE referrals (
     UNIQUE(referrer_id, referred_id)
 );
 
+-- Create stripe_webhook_events table
+CREATE TABLE stripe_webhook_events (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+    processed_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX stripe_webhook_events_pending_idx
+    ON stripe_webhook_events (received_at)
+    WHERE processed_at IS NULL;
+
 -- Create RLS policies
 ALTER TABLE subscription_plans ENABLE ROW LEVEL SECURITY;
 ALTER TABLE user_subscriptions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE referrals ENABLE ROW LEVEL SECURITY;
+ALTER TABLE stripe_webhook_events ENABLE ROW LEVEL SECURITY;
 
 -- Drop existing policies if they exist
 DROP POLICY IF EXISTS "Allow read access to all users for subscription_plans" ON subscription_plans;
@@ -46,6 +63,7 @@ DROP POLICY IF EXISTS "Allow users to view their own subscriptions" ON user_subs
 DROP POLICY IF EXISTS "Allow service role to manage all subscriptions" ON user_subscriptions;
 DROP POLICY IF EXISTS "Allow users to view their own referrals" ON referrals;
 DROP POLICY IF EXISTS "Allow users to create referrals" ON referrals;
+DROP POLICY IF EXISTS "Allow service role to manage webhook events" ON stripe_webhook_events;
 
 -- Subscription plans policies
 CREATE POLICY "Allow read access to all users for subscription_plans"
@@ -64,6 +82,12 @@ CREATE POLICY "Allow service role to manage all subscriptions"
     TO service_role
     USING (true);
 
+-- Webhook events policies
+CREATE POLICY "Allow service role to manage webhook events"
+    ON stripe_webhook_events FOR ALL
+    TO service_role
+    USING (true);
+
 -- Referrals policies
 CREATE POLICY "Allow users to view their own referrals"
     ON referrals FOR SELECT
@@ -75,6 +99,9 @@ CREATE POLICY "Allow users to create referrals"
     TO authenticated
     WITH CHECK (auth.uid() = referrer_id);
 
+-- Webhooks write subscriptions through apply_stripe_subscription, created by
+-- supabase/migrations/20261019000000_apply_stripe_events_in_order.sql; run it after this file
+
 -- Insert default subscription plans
 INSERT INTO subscription_plans (tier) VALUES
     ('free'),
@@ -1,6 +1,140 @@
 import uvicorn
+import importlib.util
 import logging
 import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import List, Optional
+from app.core.config import settings
+
+# Until a worker has run this long, a worker dying is failing to start, not recycling
+MIN_WORKER_LIFETIME = 5.0
+
+# Delay before replacing a worker that crashed soon after starting, doubling
+# with each crash in a row up to the maximum
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+
+# Extra time given to workers on top of DRAIN_TIMEOUT and WEBHOOK_DRAIN_TIMEOUT before they are killed
+DRAIN_GRACE = 10.0
+
+def build_config(production: bool) -> uvicorn.Config:
+    """Build the uvicorn config for worker processes from ``Settings``."""
+    # Prefer the C event loop and HTTP parser from uvicorn[standard] where installed
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return uvicorn.Config(
+        "app.main:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=settings.KEEP_ALIVE_TIMEOUT,
+        timeout_graceful_shutdown=settings.DRAIN_TIMEOUT,
+        log_level="info" if production else "debug",
+        access_log=not production
+    )
+
+def serve_worker(config: uvicorn.Config, sockets: List[socket.socket]):
+    """Run one server process on the listening socket shared by all workers."""
+    config.configure_logging()
+    uvicorn.Server(config).run(sockets=sockets)
+
+def supervise(config: uvicorn.Config, workers: int):
+    """Run ``workers`` server processes, replacing any that exit.
+
+    Workers exit on their own when they recycle (see ``WorkerStats``). On
+    SIGTERM or SIGINT every worker is asked to shut down gracefully: it stops
+    accepting connections and finishes in-flight conversions, for up to
+    ``DRAIN_TIMEOUT`` seconds, then applies queued webhooks before exiting.
+
+    If workers crash before any has run for ``MIN_WORKER_LIFETIME``, the
+    app can't start and the supervisor gives up. Once one has, a worker
+    that crashes soon after starting, e.g. on a document that kills MuPDF,
+    is replaced after a growing delay instead of stopping the service.
+    """
+    sock = config.bind_socket()
+    processes: List[Optional[multiprocessing.Process]] = []
+    started = {}
+    # Per worker slot: crashes in a row, and when to replace a crashed worker
+    crashes = [0] * workers
+    restart_at: List[Optional[float]] = [None] * workers
+    serving = False
+    stopping = False
+
+    def start_worker() -> multiprocessing.Process:
+        process = multiprocessing.Process(target=serve_worker, args=(config, [sock]))
+        process.start()
+        started[process.pid] = time.monotonic()
+        return process
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            logging.info(f"Received signal {signum}, draining {len(processes)} workers")
+        stopping = True
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    logging.info(f"Starting {workers} workers on http://{config.host}:{config.port} ({config.loop}, {config.http})")
+    processes.extend(start_worker() for _ in range(workers))
+
+    while not stopping:
+        time.sleep(0.5)
+        now = time.monotonic()
+        for index, process in enumerate(processes):
+            if stopping:
+                break
+            if process is None:
+                if now >= restart_at[index]:
+                    restart_at[index] = None
+                    processes[index] = start_worker()
+                continue
+            if process.is_alive():
+                if now - started[process.pid] >= MIN_WORKER_LIFETIME:
+                    serving = True
+                    crashes[index] = 0
+                continue
+
+            lifetime = now - started.pop(process.pid)
+            # uvicorn re-raises the SIGTERM a recycling worker sends itself
+            clean = process.exitcode in (0, -signal.SIGTERM)
+            if clean or lifetime >= MIN_WORKER_LIFETIME:
+                crashes[index] = 0
+                logging.info(f"Worker {process.pid} exited with code {process.exitcode}, starting a new one")
+                processes[index] = start_worker()
+            elif not serving:
+                logging.error(f"Worker {process.pid} exited with code {process.exitcode} during startup, giving up")
+                stopping = True
+            else:
+                crashes[index] += 1
+                delay = min(RESTART_BACKOFF * 2 ** (crashes[index] - 1), MAX_RESTART_BACKOFF)
+                logging.error(
+                    f"Worker {process.pid} exited with code {process.exitcode} after {lifetime:.1f}s, "
+                    f"starting a new one in {delay:.0f}s"
+                )
+                processes[index] = None
+                restart_at[index] = now + delay
+
+    # Drain: uvicorn handles SIGTERM by finishing in-flight requests before exiting
+    processes = [process for process in processes if process is not None]
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+
+    deadline = time.monotonic() + settings.DRAIN_TIMEOUT + settings.WEBHOOK_DRAIN_TIMEOUT + DRAIN_GRACE
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logging.warning(f"Worker {process.pid} did not drain in time, killing it")
+            process.kill()
+            process.join()
+
+    sock.close()
+    logging.info("All workers stopped")
 
 # Set multiprocessing start method
 if __name__ == "__main__":
@@ -9,12 +143,22 @@ if __name__ == "__main__":
     except RuntimeError:
         pass  # Method already set
 
-    logging.basicConfig(level=logging.DEBUG)
+    production = settings.ENVIRONMENT == "production"
+    logging.basicConfig(level=logging.INFO if production else logging.DEBUG)
 
-    uvicorn.run(
-        "app.main:app",
-        host="127.0.0.1",
-        port=3003,
-        reload=True,
-        log_level="debug"
-    ) 
\ No newline at end of file
+    if production:
+        workers = settings.WORKERS or os.cpu_count() or 1
+        supervise(build_config(production=True), workers)
+    elif settings.WORKER_MAX_JOBS or settings.WORKER_MAX_RSS_MB or settings.WORKER_MEMORY_CEILING_MB:
+        # Recycling, including after a job is shed at the memory ceiling, needs
+        # a supervisor to replace the worker, which the reloader isn't. None of
+        # it is on by default in development, so the reloader normally runs.
+        supervise(build_config(production=False), 1)
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            reload=True,
+            log_level="debug"
+        )
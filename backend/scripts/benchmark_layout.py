@@ -0,0 +1,80 @@
+"""Measure the time and memory page analysis takes on a PDF.
+
+Usage:
+    python scripts/benchmark_layout.py PDF [--pages N] [--raw]
+
+For every page the text is extracted and classified exactly as a conversion
+does it, without rendering. The report gives the time per page, the peak
+memory allocated while a page is analysed, and the number and size of the
+allocations its layout keeps alive until it is rendered. ``--raw`` measures
+PyMuPDF's own ``dict`` extraction with the flags conversions used to use, for
+comparison.
+"""
+import argparse
+import logging
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Make the app package importable when run as `python scripts/benchmark_layout.py`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz  # PyMuPDF
+from app.services.layout import PageText, classify_page
+
+RAW_FLAGS = fitz.TEXTFLAGS_TEXT | fitz.TEXTFLAGS_BLOCKS | fitz.TEXTFLAGS_HTML
+
+def analyze(page: fitz.Page, raw: bool):
+    """Return what a conversion holds on to for a page while it is rendered."""
+    if raw:
+        return page.get_text("dict", flags=RAW_FLAGS)
+    page_text = PageText(page)
+    return page_text, list(classify_page(page_text))
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark page analysis on a PDF.")
+    parser.add_argument("pdf", type=Path)
+    parser.add_argument("--pages", type=int, default=0, help="only analyse the first N pages")
+    parser.add_argument("--raw", action="store_true", help="measure PyMuPDF's dict extraction instead")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    doc = fitz.open(args.pdf)
+    page_count = min(args.pages, len(doc)) if args.pages else len(doc)
+
+    times, peaks, retained, retained_size = [], [], [], []
+    tracemalloc.start()
+    for page_num in range(page_count):
+        page = doc[page_num]
+        tracemalloc.clear_traces()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+
+        layout = analyze(page, args.raw)
+
+        times.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        # Everything still traced was allocated for this page and is kept
+        # alive by its layout (the cleared traces belong to earlier pages)
+        stats = tracemalloc.take_snapshot().statistics("filename")
+        retained.append(sum(stat.count for stat in stats))
+        retained_size.append(sum(stat.size for stat in stats))
+        del layout
+    tracemalloc.stop()
+
+    mode = "PyMuPDF dict" if args.raw else "PageText + classify_page"
+    print(f"{args.pdf.name}: {page_count} pages, {mode}")
+    print(f"  time per page       mean {sum(times) / page_count * 1000:8.2f} ms   p95 {percentile(times, 0.95) * 1000:8.2f} ms")
+    print(f"  peak memory / page  mean {sum(peaks) / page_count / 1024:8.1f} KB   max {max(peaks) / 1024:8.1f} KB")
+    print(f"  allocations / page  mean {sum(retained) / page_count:8.0f}      max {max(retained):8d}")
+    print(f"  retained / page     mean {sum(retained_size) / page_count / 1024:8.1f} KB   max {max(retained_size) / 1024:8.1f} KB")
+    print(f"  total               {sum(times):.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Convert a directory of PDFs to bionic reading format without the API.
+
+Usage:
+    python scripts/bulk_convert.py INPUT_DIR OUTPUT_DIR [--workers N]
+
+Files are converted by a pool of worker processes calling PDFService directly,
+so neither Stripe nor Supabase needs to be configured. Every result is appended
+to a JSON-lines manifest in the output directory; re-running the command skips
+any file already recorded as converted with the same path and content hash, so
+an interrupted run resumes where it stopped. A file whose content was already
+converted under another name gets a copy of that output instead of being
+converted again. Files whose outputs would share a name, like ``a.pdf`` and
+``a.PDF``, are numbered: ``a_bionic.pdf`` and ``a_bionic_2.pdf``. The layout
+cache the API uses is off, as a backfill never converts the same file twice.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+# Make the app package importable when run as `python scripts/bulk_convert.py`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.pdf import PDFService
+from app.services.layout_cache import layout_cache
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# Set in each worker process by init_worker: the (source, sha256, output) of
+# files already converted, and an existing output for each converted hash
+_done: Set[Tuple[str, str, str]] = set()
+_outputs_by_hash: Dict[str, str] = {}
+
+def file_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def load_manifest(manifest_path: Path, output_dir: Path) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Return the manifest records of converted files whose output still exists, by (source, sha256)."""
+    done = {}
+    if not manifest_path.exists():
+        return done
+
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Partially written line from an interrupted run
+            if record.get("status") == "converted" and (output_dir / record["output"]).exists():
+                done[(record["source"], record["sha256"])] = record
+    return done
+
+def init_worker(done: Set[Tuple[str, str, str]], outputs_by_hash: Dict[str, str]):
+    global _done, _outputs_by_hash
+    _done = done
+    _outputs_by_hash = outputs_by_hash
+    # Layouts are cached so the API can convert the same file again quickly,
+    # which a backfill never does; don't fill the temp dir with them
+    layout_cache.max_bytes = 0
+    logging.basicConfig(level=logging.WARNING)
+
+def output_names(sources: List[Path], input_dir: Path) -> Dict[Path, Path]:
+    """Return the output path of each source, relative to the output directory.
+
+    Names are compared ignoring case, as ``a.pdf`` and ``a.PDF`` would both
+    become ``a_bionic.pdf``, and so would ``A.pdf`` on file systems that
+    ignore case; later sources get a number instead of overwriting it.
+    """
+    outputs = {}
+    taken = set()
+    for path in sources:
+        relative = path.relative_to(input_dir)
+        output = relative.with_name(f"{relative.stem}_bionic.pdf")
+        number = 2
+        while str(output).lower() in taken:
+            output = relative.with_name(f"{relative.stem}_bionic_{number}.pdf")
+            number += 1
+        taken.add(str(output).lower())
+        outputs[path] = output
+    return outputs
+
+def convert_file(task: Tuple[str, str, str, str]) -> Dict[str, Any]:
+    """Convert one file in a worker process and return its manifest record."""
+    source, input_dir, output_dir, output = task
+    source_path = Path(source)
+    relative = source_path.relative_to(input_dir)
+    record: Dict[str, Any] = {"source": str(relative)}
+    started = time.monotonic()
+
+    try:
+        content = source_path.read_bytes()
+        record["sha256"] = file_hash(content)
+        if (record["source"], record["sha256"], output) in _done:
+            record["status"] = "skipped"
+            return record
+
+        output_path = Path(output_dir) / output
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write atomically so an interrupted run never leaves a truncated output behind
+        temp_path = output_path.with_name(output_path.name + ".part")
+        existing = _outputs_by_hash.get(record["sha256"])
+        if existing:
+            # Same content as a file converted under another name
+            shutil.copyfile(Path(output_dir) / existing, temp_path)
+            record["copied_from"] = existing
+        else:
+            temp_path.write_bytes(PDFService.convert_to_bionic_sync(content, source_path.name))
+        os.replace(temp_path, output_path)
+
+        record.update({"status": "converted", "output": output, "bytes": output_path.stat().st_size})
+    except Exception as e:
+        record.update({"status": "failed", "error": str(getattr(e, "detail", e))})
+
+    record["seconds"] = round(time.monotonic() - started, 3)
+    return record
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a directory of PDFs to bionic reading format.")
+    parser.add_argument("input_dir", type=Path)
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--max-tasks-per-child", type=int, default=50,
+                        help="recycle a worker after this many files to bound its memory")
+    parser.add_argument("--no-recursive", action="store_true", help="only convert PDFs directly in INPUT_DIR")
+    args = parser.parse_args()
+
+    input_dir = args.input_dir.resolve()
+    output_dir = args.output_dir.resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_NAME
+
+    # Match the extension in any case, as the API does; glob only ignores case on Windows
+    pattern = "*" if args.no_recursive else "**/*"
+    sources = sorted(
+        path for path in input_dir.glob(pattern)
+        if path.suffix.lower() == ".pdf" and path.is_file() and not path.is_relative_to(output_dir)
+    )
+    done = load_manifest(manifest_path, output_dir)
+    print(f"Found {len(sources)} PDFs in {input_dir}, {len(done)} already converted")
+    if not sources:
+        return
+
+    outputs = output_names(sources, input_dir)
+    for path, output in outputs.items():
+        if output.stem != f"{path.stem}_bionic":
+            print(f"{path.relative_to(input_dir)} would overwrite another file's output, writing {output} instead")
+    tasks = [(str(path), str(input_dir), str(output_dir), str(outputs[path])) for path in sources]
+    counts = {"converted": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, multiprocessing.Pool(
+        args.workers,
+        initializer=init_worker,
+        initargs=(
+            {(source, sha256, record["output"]) for (source, sha256), record in done.items()},
+            {sha256: record["output"] for (_, sha256), record in done.items()}
+        ),
+        maxtasksperchild=args.max_tasks_per_child
+    ) as pool:
+        for finished, record in enumerate(pool.imap_unordered(convert_file, tasks), start=1):
+            counts[record["status"]] += 1
+            if record["status"] != "skipped":
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+
+            # Skips cost next to nothing, so only actual work counts towards the rate
+            elapsed = time.monotonic() - started
+            worked = counts["converted"] + counts["failed"]
+            rate = worked / elapsed if worked else 0.0
+            remaining = len(tasks) - finished
+            eta = remaining / rate if rate else None
+
+            line = f"[{finished}/{len(tasks)}] {record['status']:<9} {record['source']}"
+            if record["status"] == "failed":
+                line += f" ({record['error']})"
+            print(f"{line}  {rate:.2f} files/s  ETA {format_eta(eta)}", flush=True)
+
+    elapsed = time.monotonic() - started
+    print(
+        f"\nDone in {format_eta(elapsed)}: {counts['converted']} converted, "
+        f"{counts['skipped']} skipped, {counts['failed']} failed"
+    )
+    if counts["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Load test /api/convert end to end and find where the server saturates.
+
+Usage:
+    python scripts/load_test.py CORPUS [CORPUS ...] [--concurrency 1,2,4,8]
+        [--duration 30] [--workers N] [--url URL] [--json PATH]
+
+CORPUS is any mix of PDF files and directories of PDFs. Unless ``--url``
+points at a running server, the real ``app.main:app`` is started through
+``run.py`` on a free local port with stand-ins for everything external:
+
+- storage on the local filesystem (``STORAGE_BACKEND=local``) in a temp dir
+- Stripe configured with dummy keys, which ``/convert`` never uses
+- no Supabase database, so every user gets ``DEFAULT_TIER`` (``ultimate``)
+- JWTs generated here, which ``AuthService`` accepts as Supabase tokens
+
+For each concurrency step, that many clients send corpus files back to back
+for ``--duration`` seconds, each as its own user. The report gives the
+throughput, latency percentiles, error rate and worker RSS of every step.
+By default a random trailer is appended to each upload so identical
+requests aren't coalesced or served from the layout cache, which measures
+conversion capacity; ``--repeat-identical`` sends the files as they are.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import jwt
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Environment the server is started with, on top of the current one
+STUB_ENVIRONMENT = {
+    "ENVIRONMENT": "production",
+    "HOST": "127.0.0.1",
+    "STORAGE_BACKEND": "local",
+    "SUPABASE_URL": "",
+    "SUPABASE_KEY": "",
+    "STRIPE_SECRET_KEY": "sk_test_load_test",
+    "STRIPE_WEBHOOK_SECRET": "whsec_load_test",
+    "DEFAULT_TIER": "ultimate"
+}
+
+STARTUP_TIMEOUT = 120.0
+RSS_SAMPLE_INTERVAL = 0.5
+REQUEST_TIMEOUT = 900.0
+
+def make_token(user_id: str) -> str:
+    """Return a JWT shaped like a Supabase access token for ``user_id``."""
+    claims = {
+        "sub": user_id,
+        "role": "authenticated",
+        "email": f"{user_id}@load-test.invalid",
+        "exp": int(time.time()) + 24 * 60 * 60
+    }
+    # AuthService reads the claims without checking the signature, so any key will do
+    return jwt.encode(claims, secrets.token_hex(32), algorithm="HS256")
+
+def load_corpus(paths: List[Path]) -> List[Tuple[str, bytes]]:
+    files = []
+    for path in paths:
+        if path.is_dir():
+            candidates = sorted(candidate for candidate in path.rglob("*") if candidate.suffix.lower() == ".pdf")
+        else:
+            candidates = [path]
+        files.extend((candidate.name, candidate.read_bytes()) for candidate in candidates)
+    if not files:
+        sys.exit("No PDF files found in the corpus")
+    return files
+
+def multipart_body(filename: str, content: bytes, boundary: str) -> bytes:
+    return b"".join([
+        f"--{boundary}\r\n".encode(),
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+        b"Content-Type: application/pdf\r\n\r\n",
+        content,
+        f"\r\n--{boundary}--\r\n".encode()
+    ])
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Server:
+    """The app started through ``run.py`` with local stand-ins, in its own process group."""
+
+    def __init__(self, workers: int, storage_dir: str):
+        self.port = free_port()
+        env = dict(os.environ, **STUB_ENVIRONMENT)
+        env.update({
+            "PORT": str(self.port),
+            "WORKERS": str(workers),
+            "LOCAL_STORAGE_DIR": os.path.join(storage_dir, "files"),
+            "UPLOAD_DIR": os.path.join(storage_dir, "uploads"),
+            "LAYOUT_CACHE_DIR": os.path.join(storage_dir, "layout-cache"),
+            "JOB_STATE_DIR": os.path.join(storage_dir, "job-board")
+        })
+        self.process = subprocess.Popen(
+            [sys.executable, "run.py"],
+            cwd=BACKEND_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+
+class Client:
+    """Minimal HTTP client on ``http.client``, one connection per request."""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+def wait_until_ready(client: Client, server: Optional[Server]):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server and server.process.poll() is not None:
+            sys.exit(f"Server exited with code {server.process.returncode} during startup")
+        try:
+            if client.request("GET", "/api/readyz")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    sys.exit("Server did not become ready in time")
+
+def sample_rss(client: Client, token: str, stop: threading.Event, rss_by_pid: Dict[int, float]):
+    """Record the peak RSS of every worker that answers ``/worker/stats`` until ``stop`` is set."""
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        try:
+            status, _, body = client.request("GET", "/api/worker/stats", headers=headers)
+            if status == 200:
+                stats = json.loads(body)
+                if stats.get("rss_mb"):
+                    rss_by_pid[stats["pid"]] = max(rss_by_pid.get(stats["pid"], 0.0), stats["rss_mb"])
+        except OSError:
+            pass
+        stop.wait(RSS_SAMPLE_INTERVAL)
+
+def run_client(client: Client, corpus: List[Tuple[str, bytes]], index: int, deadline: float, unique: bool, results: List[Dict[str, Any]]):
+    """Send corpus files back to back until ``deadline``, as user ``index``."""
+    rng = random.Random(index)
+    token = make_token(f"load-test-{index}")
+    while time.monotonic() < deadline:
+        filename, content = rng.choice(corpus)
+        if unique:
+            # Bytes after %%EOF are ignored by PDF readers
+            content += f"\n% load test {secrets.token_hex(8)}\n".encode()
+        boundary = secrets.token_hex(16)
+        body = multipart_body(filename, content, boundary)
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": f"multipart/form-data; boundary={boundary}"
+        }
+        started = time.perf_counter()
+        try:
+            status, response_headers, _ = client.request("POST", "/api/convert", body, headers)
+        except OSError as e:
+            status, response_headers = type(e).__name__, {}
+        results.append({
+            "status": status,
+            "latency": time.perf_counter() - started,
+            "pages": int(response_headers.get("x-pages-converted", 0)) + int(response_headers.get("x-pages-passed-through", 0))
+        })
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run_step(client: Client, corpus: List[Tuple[str, bytes]], concurrency: int, duration: float, unique: bool) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    rss_by_pid: Dict[int, float] = {}
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_rss, args=(client, make_token("load-test-monitor"), stop, rss_by_pid))
+    sampler.start()
+
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [
+        threading.Thread(target=run_client, args=(client, corpus, index, deadline, unique, results))
+        for index in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Requests in flight at the deadline still count, so measure until the last one ends
+    elapsed = time.monotonic() - started
+    stop.set()
+    sampler.join()
+
+    ok = [result for result in results if result["status"] == 200]
+    latencies = [result["latency"] for result in ok]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "error_statuses": dict(Counter(str(result["status"]) for result in results if result["status"] != 200)),
+        "throughput": len(ok) / elapsed,
+        "pages_per_second": sum(result["pages"] for result in ok) / elapsed,
+        "p50": percentile(latencies, 0.50) if latencies else None,
+        "p95": percentile(latencies, 0.95) if latencies else None,
+        "p99": percentile(latencies, 0.99) if latencies else None,
+        "workers": len(rss_by_pid),
+        "peak_worker_rss_mb": max(rss_by_pid.values()) if rss_by_pid else None,
+        "total_rss_mb": sum(rss_by_pid.values()) if rss_by_pid else None
+    }
+
+def format_seconds(value: Optional[float]) -> str:
+    return f"{value:7.2f}s" if value is not None else "      -"
+
+def format_mb(value: Optional[float]) -> str:
+    return f"{value:8.0f}MB" if value is not None else "         -"
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/convert against the real app with local stand-ins.")
+    parser.add_argument("corpus", type=Path, nargs="+", help="PDF files or directories of PDFs")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="comma separated concurrency steps")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per step")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="server worker processes")
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    parser.add_argument("--repeat-identical", action="store_true", help="send files unchanged, so duplicates coalesce")
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    steps = [int(step) for step in args.concurrency.split(",")]
+
+    server = None
+    storage_dir = tempfile.TemporaryDirectory(prefix="load-test-storage-")
+    if not args.url:
+        server = Server(args.workers, storage_dir.name)
+    client = Client(args.url or server.url)
+
+    try:
+        wait_until_ready(client, server)
+        target = args.url or f"{server.url} ({args.workers} workers)"
+        print(f"{len(corpus)} corpus files, {args.duration:.0f}s per step, against {target}")
+        print(f"{'clients':>7} {'requests':>8} {'errors':>7} {'req/s':>7} {'pages/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'peak RSS':>10} {'total RSS':>10}")
+
+        results = []
+        for concurrency in steps:
+            step = run_step(client, corpus, concurrency, args.duration, not args.repeat_identical)
+            results.append(step)
+            print(
+                f"{step['concurrency']:>7} {step['requests']:>8} {step['error_rate']:>6.1%} "
+                f"{step['throughput']:>7.2f} {step['pages_per_second']:>8.1f} "
+                f"{format_seconds(step['p50'])} {format_seconds(step['p95'])} {format_seconds(step['p99'])} "
+                f"{format_mb(step['peak_worker_rss_mb'])} {format_mb(step['total_rss_mb'])}"
+            )
+            if step["error_statuses"]:
+                print(f"        errors by status: {step['error_statuses']}")
+
+        if args.json:
+            args.json.write_text(json.dumps({"corpus_files": len(corpus), "duration": args.duration, "steps": results}, indent=2))
+    finally:
+        if server:
+            server.stop()
+        storage_dir.cleanup()
+
+if __name__ == "__main__":
+    main()
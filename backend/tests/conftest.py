@@ -0,0 +1,22 @@
+"""Test settings, applied before the app is imported.
+
+Everything runs offline: files are stored locally, and every directory the
+app writes to is a fresh temp dir, so tests never touch a real deployment's
+uploads, layout cache or job board.
+"""
+import os
+import tempfile
+
+_root = tempfile.mkdtemp(prefix="bionic-tests-")
+
+os.environ.update({
+    "ENVIRONMENT": "test",
+    "STORAGE_BACKEND": "local",
+    "SUPABASE_URL": "",
+    "SUPABASE_KEY": "",
+    "LOCAL_STORAGE_DIR": os.path.join(_root, "files"),
+    "UPLOAD_DIR": os.path.join(_root, "uploads"),
+    "LAYOUT_CACHE_DIR": os.path.join(_root, "layout-cache"),
+    "JOB_STATE_DIR": os.path.join(_root, "job-board"),
+    "FILE_URL_SECRET": "test-secret"
+})
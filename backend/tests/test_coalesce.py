@@ -0,0 +1,166 @@
+import asyncio
+import uuid
+import httpx
+import pytest
+from fastapi import HTTPException
+from app.main import app
+from app.api import endpoints
+from app.services.coalesce import ConversionCoalescer, conversion_coalescer
+from app.services.jobs import job_service, HTTP_499_CLIENT_CLOSED_REQUEST
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+def unique_key():
+    # Conversions are claimed on the job board too, so keep tests apart
+    return ConversionCoalescer.key(uuid.uuid4().hex, delivery="inline")
+
+async def wait_until(condition, timeout=5.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+def test_identical_requests_share_one_conversion():
+    async def scenario():
+        coalescer = ConversionCoalescer()
+        key = unique_key()
+        release = asyncio.Event()
+        calls = []
+
+        async def work(job):
+            calls.append(job.id)
+            job.start(3)
+            for page in range(3):
+                job.page_done(page)
+            await release.wait()
+            return "converted"
+
+        first = await job_service.create("alice", "a.pdf")
+        second = await job_service.create("bob", "a.pdf")
+        leading = asyncio.create_task(coalescer.run(key, first, FakeRequest(), work))
+        await wait_until(lambda: coalescer.waiters == 1)
+        waiting = asyncio.create_task(coalescer.run(key, second, FakeRequest(), work))
+        await wait_until(lambda: coalescer.waiters == 2)
+        # The waiting job reports the shared conversion's progress
+        assert second.pages_done == 3
+        release.set()
+
+        (result, leader), (shared, shared_leader) = await asyncio.gather(leading, waiting)
+        assert calls == [first.id]
+        assert result == shared == "converted"
+        assert leader is first and shared_leader is first
+        assert first.status == second.status == "completed"
+        assert second.total_pages == 3
+        assert coalescer.snapshot()["coalesced"] == 1
+
+    asyncio.run(scenario())
+
+def test_leader_disconnect_leaves_the_conversion_to_the_other_request():
+    async def scenario():
+        coalescer = ConversionCoalescer()
+        key = unique_key()
+        release = asyncio.Event()
+
+        async def work(job):
+            await release.wait()
+            job.check_cancelled()
+            return "converted"
+
+        first = await job_service.create("alice", "a.pdf")
+        second = await job_service.create("alice", "a.pdf")
+        leader_request = FakeRequest()
+        leading = asyncio.create_task(coalescer.run(key, first, leader_request, work))
+        await wait_until(lambda: coalescer.waiters == 1)
+        waiting = asyncio.create_task(coalescer.run(key, second, FakeRequest(), work))
+        await wait_until(lambda: coalescer.waiters == 2)
+
+        leader_request.disconnected = True
+        with pytest.raises(HTTPException) as error:
+            await leading
+        assert error.value.status_code == HTTP_499_CLIENT_CLOSED_REQUEST
+        # Someone is still waiting, so the conversion carries on
+        assert not first.cancelled
+
+        release.set()
+        result, leader = await waiting
+        assert result == "converted"
+        assert leader is first
+        assert second.status == "completed"
+
+    asyncio.run(scenario())
+
+def test_conversion_is_cancelled_once_everyone_disconnects():
+    async def scenario():
+        coalescer = ConversionCoalescer()
+        key = unique_key()
+        release = asyncio.Event()
+
+        async def work(job):
+            await release.wait()
+            job.check_cancelled()
+            return "converted"
+
+        first = await job_service.create("alice", "a.pdf")
+        second = await job_service.create("bob", "a.pdf")
+        requests = [FakeRequest(), FakeRequest()]
+        tasks = [asyncio.create_task(coalescer.run(key, first, requests[0], work))]
+        await wait_until(lambda: coalescer.waiters == 1)
+        tasks.append(asyncio.create_task(coalescer.run(key, second, requests[1], work)))
+        await wait_until(lambda: coalescer.waiters == 2)
+
+        for request in requests:
+            request.disconnected = True
+        for task in tasks:
+            with pytest.raises(HTTPException):
+                await task
+        assert first.cancelled
+        assert first.cancellation.status_code == HTTP_499_CLIENT_CLOSED_REQUEST
+        assert second.status == "failed"
+        release.set()
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("same_user", [True, False])
+def test_convert_names_the_shared_job_only_to_the_same_user(monkeypatch, same_user):
+    content = b"%PDF-1.7\n" + uuid.uuid4().hex.encode()
+    release = asyncio.Event()
+
+    async def convert_and_store(content, content_hash, filename, job, keep_result):
+        await release.wait()
+        return b"%PDF-converted", None
+
+    async def scenario():
+        monkeypatch.setattr(endpoints, "convert_and_store", convert_and_store)
+        monkeypatch.setattr(endpoints.auth_service, "verify_token", lambda token: {"sub": token})
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            def post(user, job_id):
+                return client.post(
+                    f"/api/convert?job_id={job_id}",
+                    files={"file": ("a.pdf", content, "application/pdf")},
+                    headers={"Authorization": f"Bearer {user}"}
+                )
+
+            waiters = conversion_coalescer.waiters
+            first_id, second_id = uuid.uuid4().hex, uuid.uuid4().hex
+            first = asyncio.create_task(post("alice", first_id))
+            await wait_until(lambda: conversion_coalescer.waiters == waiters + 1)
+            second = asyncio.create_task(post("alice" if same_user else "bob", second_id))
+            await wait_until(lambda: conversion_coalescer.waiters == waiters + 2)
+            release.set()
+            return await first, await second, first_id
+
+    first, second, first_id = asyncio.run(scenario())
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content == b"%PDF-converted"
+    assert "x-coalesced-with" not in first.headers
+    if same_user:
+        assert second.headers["x-coalesced-with"] == first_id
+    else:
+        assert "x-coalesced-with" not in second.headers
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app.main import app
+from app.api.endpoints import parse_byte_range, etag_matches
+from app.core.storage import storage
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 100)),
+    ("bytes=100-", (100, 10240)),
+    ("bytes=-100", (10140, 10240)),
+    ("bytes=10000-20000", (10000, 10240)),
+    ("bytes=-20000", (0, 10240)),
+    (" bytes = 5-5 ", (5, 6)),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 10240) == expected
+
+@pytest.mark.parametrize("header", [
+    "bytes=10240-",
+    "bytes=20000-30000",
+    "bytes=-0",
+])
+def test_parse_byte_range_unsatisfiable(header):
+    with pytest.raises(HTTPException) as error:
+        parse_byte_range(header, 10240)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */10240"
+
+@pytest.mark.parametrize("header", [
+    "items=0-99",
+    "bytes=abc",
+    "bytes=-",
+    "bytes=99-0",
+    "bytes=0-9,20-29",
+    "bytes=0x10-",
+])
+def test_parse_byte_range_ignores_malformed(header):
+    assert parse_byte_range(header, 10240) is None
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"xyz", "abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
+    assert not etag_matches("abc", '"abc"')
+
+@pytest.fixture(scope="module")
+def download():
+    """A client and the signed URL of a stored file."""
+    async def store():
+        path = await storage.upload_file(CONTENT, "range.pdf")
+        return await storage.create_signed_url(path, 300, "range.pdf")
+
+    url = asyncio.run(store())
+    with TestClient(app) as client:
+        yield client, url
+
+def test_download_whole_file(download):
+    client, url = download
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-length"] == str(len(CONTENT))
+
+def test_download_range(download):
+    client, url = download
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+def test_download_unsatisfiable_range(download):
+    client, url = download
+    response = client.get(url, headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+def test_download_malformed_range_sends_whole_file(download):
+    client, url = download
+    response = client.get(url, headers={"Range": "bytes=200-100"})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+def test_download_if_none_match(download):
+    client, url = download
+    etag = client.get(url).headers["etag"]
+    response = client.get(url, headers={"If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+    assert response.content == b""
+
+def test_download_if_range(download):
+    client, url = download
+    etag = client.get(url).headers["etag"]
+
+    current = client.get(url, headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert current.status_code == 206
+    assert current.content == CONTENT[:10]
+
+    # A stale copy gets the whole file instead of a range of the new one
+    stale = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
+
+def test_download_rejects_bad_signature(download):
+    client, url = download
+    assert client.get(url.replace("signature=", "signature=0")).status_code == 403
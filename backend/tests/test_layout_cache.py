@@ -0,0 +1,154 @@
+import errno
+import os
+import pytest
+from app.services.layout import Element, ImageBlock, Span, Table, TableCell, TextBlock
+from app.services.layout_cache import LayoutCache, LayoutWriter, PART_SUFFIX
+
+# Values float32 holds exactly, as coordinates are stored at that precision
+PAGES = [
+    [
+        Element("text", (10.0, 20.0, 300.0, 40.5), blocks=[
+            TextBlock((10.0, 20.0, 300.0, 40.5), [
+                Span("Hello ", (10.0, 30.0), 12.0, (0.0, 0.0, 0.5), (10.0, 20.0, 50.0, 32.0)),
+                Span("wörld ✓", (50.0, 30.0), 12.0, (1.0, 0.25, 0.0), (50.0, 20.0, 90.0, 32.0))
+            ])
+        ]),
+        Element("list", (10.0, 50.0, 200.0, 80.0), blocks=[
+            TextBlock((10.0, 50.0, 200.0, 60.0), [Span("1. One", (10.0, 58.0), 10.0, (0.0, 0.0, 0.0), (10.0, 50.0, 60.0, 60.0))]),
+            TextBlock((10.0, 60.0, 200.0, 70.0), [Span("2. Two", (10.0, 68.0), 10.0, (0.0, 0.0, 0.0), (10.0, 60.0, 60.0, 70.0))])
+        ]),
+        Element("header_footer", (0.0, 0.0, 600.0, 20.0), blocks=[
+            TextBlock((0.0, 0.0, 600.0, 20.0), [Span("Page 1", (280.0, 15.0), 8.0, (0.5, 0.5, 0.5), (280.0, 5.0, 320.0, 15.0))])
+        ]),
+        Element("image", (100.0, 100.0, 200.0, 200.0), image=ImageBlock((100.0, 100.0, 200.0, 200.0), 42)),
+        Element("table", (10.0, 300.0, 210.0, 340.0), table=Table((10.0, 300.0, 210.0, 340.0), [
+            [TableCell((10.0, 300.0, 110.0, 320.0), "a"), TableCell((110.0, 300.0, 210.0, 320.0), "")],
+            [TableCell((10.0, 320.0, 110.0, 340.0), "c"), TableCell((110.0, 320.0, 210.0, 340.0), "d")]
+        ]))
+    ],
+    None,
+    []
+]
+
+def describe(page):
+    """Reduce a page layout to plain values, for comparison."""
+    if page is None:
+        return None
+    described = []
+    for element in page:
+        item = [element.kind, element.bbox]
+        if element.blocks is not None:
+            item.append([
+                (block.bbox, [(span.text, span.origin, span.size, span.color, span.bbox) for span in block.spans])
+                for block in element.blocks
+            ])
+        if element.image is not None:
+            item.append(element.image.xref)
+        if element.table is not None:
+            item.append([[(cell.bbox, cell.text) for cell in row] for row in element.table.rows])
+        described.append(item)
+    return described
+
+def write(cache, key, pages):
+    writer = cache.writer(key, len(pages))
+    for page in pages:
+        assert writer.add_page(page)
+    assert writer.commit()
+
+@pytest.fixture
+def cache(tmp_path):
+    return LayoutCache(str(tmp_path), 1024 * 1024)
+
+def test_round_trip(cache):
+    write(cache, "doc", PAGES)
+    reader = cache.load("doc", len(PAGES))
+    assert reader is not None
+    assert [describe(reader.next_page()) for _ in PAGES] == [describe(page) for page in PAGES]
+
+def test_missing_and_mismatched_entries_are_ignored(cache):
+    assert cache.load("doc", 3) is None
+    write(cache, "doc", PAGES)
+    # A different page count means a different document
+    assert cache.load("doc", 4) is None
+    assert not cache.path("doc").exists()
+
+def test_unreadable_entry_is_removed(cache):
+    cache.directory.mkdir(exist_ok=True)
+    cache.path("doc").write_bytes(b"not zlib")
+    assert cache.load("doc", 3) is None
+    assert not cache.path("doc").exists()
+
+def test_disabled_cache(tmp_path):
+    cache = LayoutCache(str(tmp_path), 0)
+    assert cache.writer("doc", 1) is None
+    assert cache.load("doc", 1) is None
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    probe = LayoutCache(str(tmp_path / "probe"), 1024 * 1024)
+    write(probe, "entry", PAGES)
+    size = probe.path("entry").stat().st_size
+
+    # Room for two entries
+    cache = LayoutCache(str(tmp_path / "cache"), 2 * size + size // 2)
+    write(cache, "old", PAGES)
+    write(cache, "used", PAGES)
+    os.utime(cache.path("old"), (1000, 1000))
+    os.utime(cache.path("used"), (2000, 2000))
+    # Loading marks an entry as recently used
+    assert cache.load("old", len(PAGES)) is not None
+
+    write(cache, "new", PAGES)
+    assert cache.path("old").exists()
+    assert cache.path("new").exists()
+    assert not cache.path("used").exists()
+
+def test_evict_deletes_abandoned_temp_files(cache):
+    write(cache, "doc", PAGES)
+    abandoned = cache.directory / f"abandoned{PART_SUFFIX}"
+    abandoned.write_bytes(b"partial")
+    os.utime(abandoned, (0, 0))
+    in_progress = cache.directory / f"in-progress{PART_SUFFIX}"
+    in_progress.write_bytes(b"partial")
+
+    cache.evict()
+    assert not abandoned.exists()
+    assert in_progress.exists()
+    assert cache.path("doc").exists()
+
+def test_evict_skips_entries_removed_meanwhile(cache, monkeypatch):
+    write(cache, "doc", PAGES)
+    scandir = os.scandir
+
+    def scandir_then_remove(path):
+        entries = list(scandir(path))
+        for entry in entries:
+            os.unlink(entry.path)
+        return iter(entries)
+
+    monkeypatch.setattr(os, "scandir", scandir_then_remove)
+    cache.evict()
+
+def test_failed_write_discards_the_entry(cache, monkeypatch):
+    writer = cache.writer("doc", len(PAGES))
+    assert writer.add_page(PAGES[0])
+
+    def disk_full(self, data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(LayoutWriter, "_write", disk_full)
+    assert not writer.add_page(PAGES[1])
+    assert not cache.path("doc").exists()
+    assert not list(cache.directory.glob(f"*{PART_SUFFIX}"))
+
+def test_failed_commit_discards_the_entry(cache, monkeypatch):
+    writer = cache.writer("doc", len(PAGES))
+    for page in PAGES:
+        assert writer.add_page(page)
+
+    def rename_fails(source, destination):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "replace", rename_fails)
+    assert not writer.commit()
+    assert not cache.path("doc").exists()
+    assert not list(cache.directory.glob(f"*{PART_SUFFIX}"))
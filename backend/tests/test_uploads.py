@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import pytest
+from fastapi import HTTPException
+from app.core.config import settings
+from app.services.uploads import UploadService
+
+CHUNK_SIZE = 1024
+CONTENT = b"%PDF-1.7\n" + bytes(range(256)) * 10  # Three chunks, the last one short
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def chunk(index: int) -> bytes:
+    return CONTENT[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+async def body(data: bytes, piece: int = 100):
+    for start in range(0, len(data), piece):
+        yield data[start:start + piece]
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", CHUNK_SIZE)
+    return UploadService()
+
+def put(service, session, index, data=None, checksum=None, offset=None):
+    data = chunk(index) if data is None else data
+    asyncio.run(service.write_chunk(
+        session,
+        index,
+        index * CHUNK_SIZE if offset is None else offset,
+        checksum or sha256(data),
+        body(data)
+    ))
+
+def put_all(service, session):
+    for index in range(session.chunk_count):
+        put(service, session, index)
+
+def test_chunks_in_any_order_assemble_to_the_file(service):
+    session = service.create("user", "doc.pdf", len(CONTENT), sha256(CONTENT))
+    assert session.chunk_count == 3
+    for index in (2, 0, 1):
+        put(service, session, index)
+
+    snapshot = session.snapshot()
+    assert snapshot["complete"]
+    assert snapshot["received"] == [[0, len(CONTENT)]]
+    path, digest = asyncio.run(service.assemble(session))
+    assert path.read_bytes() == CONTENT
+    assert digest == sha256(CONTENT)
+
+def test_bad_checksum_keeps_the_received_chunk(service):
+    session = service.create("user", "doc.pdf", len(CONTENT))
+    put(service, session, 0)
+
+    corrupt = b"\0" * CHUNK_SIZE
+    with pytest.raises(HTTPException) as error:
+        put(service, session, 0, corrupt, checksum=sha256(chunk(0)))
+    assert error.value.status_code == 400
+    assert "Checksum mismatch" in error.value.detail
+
+    assert session.chunk_path(0).read_bytes() == chunk(0)
+    assert session.received_chunks() == {0}
+    # Nothing is left staged
+    assert [path.name for path in session.chunk_path(0).parent.iterdir()] == ["0"]
+
+def test_short_chunk_is_refused(service):
+    session = service.create("user", "doc.pdf", len(CONTENT))
+    with pytest.raises(HTTPException) as error:
+        put(service, session, 0, chunk(0)[:-1])
+    assert error.value.status_code == 400
+    assert "expected" in error.value.detail
+    assert session.received_chunks() == set()
+    assert not session.chunk_path(0).exists()
+
+def test_long_chunk_is_refused(service):
+    session = service.create("user", "doc.pdf", len(CONTENT))
+    with pytest.raises(HTTPException) as error:
+        put(service, session, 2, chunk(2) + b"extra")
+    assert error.value.status_code == 400
+    assert "longer" in error.value.detail
+
+@pytest.mark.parametrize("index, offset", [(3, 3 * CHUNK_SIZE), (-1, 0), (1, 0)])
+def test_chunk_out_of_place_is_refused(service, index, offset):
+    session = service.create("user", "doc.pdf", len(CONTENT))
+    with pytest.raises(HTTPException) as error:
+        put(service, session, index, b"", offset=offset)
+    assert error.value.status_code == 400
+
+def test_incomplete_upload_does_not_assemble(service):
+    session = service.create("user", "doc.pdf", len(CONTENT))
+    put(service, session, 1)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.assemble(session))
+    assert error.value.status_code == 409
+    assert "[0, 2]" in error.value.detail
+
+def test_finalizing_again_gives_the_same_file(service):
+    session = service.create("user", "doc.pdf", len(CONTENT), sha256(CONTENT))
+    put_all(service, session)
+    first, _ = asyncio.run(service.assemble(session))
+    # A retried chunk after finalizing, then a retried finalize
+    put(service, session, 1)
+    second, digest = asyncio.run(service.assemble(session))
+    assert second == first
+    assert second.read_bytes() == CONTENT
+    assert digest == sha256(CONTENT)
+    assert not list(session.directory.glob("*.part"))
+
+def test_file_checksum_mismatch_is_refused(service):
+    session = service.create("user", "doc.pdf", len(CONTENT), sha256(b"another file"))
+    put_all(service, session)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.assemble(session))
+    assert error.value.status_code == 400
+
+def test_sessions_belong_to_their_user(service):
+    session = service.create("user", "doc.pdf", len(CONTENT))
+    assert service.get("user", session.id).id == session.id
+    for user_id, upload_id in (("other", session.id), ("user", "0" * 32), ("user", "../etc")):
+        with pytest.raises(HTTPException) as error:
+            service.get(user_id, upload_id)
+        assert error.value.status_code == 404
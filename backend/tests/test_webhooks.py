@@ -0,0 +1,167 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.services import webhooks
+from app.services.webhooks import WebhookService
+
+class FakeStripe:
+    """Applies events by recording them, failing the first ``failures[id]`` attempts."""
+
+    def __init__(self, failures=None, delays=None):
+        self.applied = []
+        self.attempts = {}
+        self.failures = failures or {}
+        self.delays = delays or {}
+
+    async def load_async(self):
+        return self
+
+    async def handle_event(self, event):
+        self.attempts[event["id"]] = self.attempts.get(event["id"], 0) + 1
+        await asyncio.sleep(self.delays.get(event["id"], 0))
+        if self.attempts[event["id"]] <= self.failures.get(event["id"], 0):
+            raise RuntimeError("Database unavailable")
+        self.applied.append(event["id"])
+
+class FakeEventsTable:
+    """Stands in for ``stripe_webhook_events``."""
+
+    def __init__(self):
+        self.rows = {}
+        self.available = True
+
+    def record(self, event):
+        if not self.available:
+            raise ConnectionError("Database unavailable")
+        if event["id"] in self.rows:
+            return False
+        self.rows[event["id"]] = {"payload": event, "processed": False}
+        return True
+
+    def load_pending(self):
+        return [row["payload"] for row in self.rows.values() if not row["processed"]]
+
+    def mark_processed(self, event_id):
+        self.rows[event_id]["processed"] = True
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeEventsTable()
+    monkeypatch.setattr(WebhookService, "_record", staticmethod(table.record))
+    monkeypatch.setattr(WebhookService, "_load_pending", staticmethod(table.load_pending))
+    monkeypatch.setattr(WebhookService, "_mark_processed", staticmethod(table.mark_processed))
+    monkeypatch.setattr(webhooks, "RETRY_DELAY", 0)
+    return table
+
+def use_stripe(monkeypatch, stripe):
+    monkeypatch.setattr(webhooks, "stripe_service", stripe)
+    return stripe
+
+def event(event_id):
+    return {"id": event_id, "type": "customer.subscription.updated", "data": {}}
+
+def test_events_are_applied_in_the_order_received(monkeypatch, table):
+    # The first event is slow to apply, later ones must still wait for it
+    stripe = use_stripe(monkeypatch, FakeStripe(delays={"evt_1": 0.05}))
+
+    async def scenario():
+        service = WebhookService()
+        for event_id in ("evt_1", "evt_2", "evt_3"):
+            assert await service.receive(event(event_id))
+        await service.drain(5)
+        return service
+
+    service = asyncio.run(scenario())
+    assert stripe.applied == ["evt_1", "evt_2", "evt_3"]
+    assert all(row["processed"] for row in table.rows.values())
+    assert service.snapshot()["processed"] == 3
+
+def test_duplicates_are_acknowledged_but_not_applied(monkeypatch, table):
+    stripe = use_stripe(monkeypatch, FakeStripe())
+
+    async def scenario():
+        service = WebhookService()
+        assert await service.receive(event("evt_1"))
+        # Delivered again to this worker
+        assert not await service.receive(event("evt_1"))
+        # Recorded by another worker
+        table.record(event("evt_2"))
+        assert not await service.receive(event("evt_2"))
+        await service.drain(5)
+        return service
+
+    service = asyncio.run(scenario())
+    assert stripe.applied == ["evt_1"]
+    assert service.snapshot()["duplicates"] == 2
+
+def test_event_that_cannot_be_recorded_is_refused(monkeypatch, table):
+    stripe = use_stripe(monkeypatch, FakeStripe())
+    table.available = False
+
+    async def scenario():
+        service = WebhookService()
+        with pytest.raises(HTTPException) as error:
+            await service.receive(event("evt_1"))
+        return error.value
+
+    error = asyncio.run(scenario())
+    # Stripe sends it again later
+    assert error.status_code == 503
+    assert stripe.applied == []
+
+def test_given_up_events_are_recovered(monkeypatch, table):
+    stripe = use_stripe(monkeypatch, FakeStripe(failures={"evt_1": webhooks.MAX_ATTEMPTS}))
+    monkeypatch.setattr(webhooks, "RECOVERY_AGE", 0.01)
+    monkeypatch.setattr(webhooks, "RECOVERY_INTERVAL", 0.02)
+
+    async def scenario():
+        service = WebhookService()
+        assert await service.receive(event("evt_1"))
+        assert await service.receive(event("evt_2"))
+        await service.drain(5)
+        # Every attempt failed, so the event stays unprocessed, behind the next one
+        assert stripe.applied == ["evt_2"]
+        assert not table.rows["evt_1"]["processed"]
+        assert service.snapshot()["failed"] == 1
+
+        recovery = asyncio.create_task(service.recover())
+        try:
+            for _ in range(500):
+                if table.rows["evt_1"]["processed"]:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            recovery.cancel()
+        return service
+
+    service = asyncio.run(scenario())
+    assert stripe.applied == ["evt_2", "evt_1"]
+    assert stripe.attempts["evt_1"] == webhooks.MAX_ATTEMPTS + 1
+    assert table.rows["evt_1"]["processed"]
+    assert service.snapshot()["recovered"] == 1
+
+def test_events_lost_by_another_worker_are_recovered(monkeypatch, table):
+    stripe = use_stripe(monkeypatch, FakeStripe())
+    monkeypatch.setattr(webhooks, "RECOVERY_AGE", 0.01)
+    monkeypatch.setattr(webhooks, "RECOVERY_INTERVAL", 0.02)
+    # Recorded and acknowledged by a worker that exited before applying them
+    table.record(event("evt_1"))
+    table.record(event("evt_2"))
+
+    async def scenario():
+        service = WebhookService()
+        recovery = asyncio.create_task(service.recover())
+        try:
+            for _ in range(500):
+                if len(stripe.applied) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            # Seen again by a later recovery pass before being marked, still applied once
+            await asyncio.sleep(0.05)
+        finally:
+            recovery.cancel()
+        await service.drain(5)
+
+    asyncio.run(scenario())
+    assert stripe.applied == ["evt_1", "evt_2"]
+    assert all(row["processed"] for row in table.rows.values())
@@ -0,0 +1,94 @@
+-- Stripe webhooks are applied by whichever worker receives them, possibly
+-- late or more than once, so the database decides which change is newest.
+
+-- 1. One subscription row per user, as the webhook upserts expect
+DELETE FROM user_subscriptions a
+USING user_subscriptions b
+WHERE a.user_id = b.user_id
+  AND (a.updated_at, a.id) < (b.updated_at, b.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS user_subscriptions_user_id_key
+  ON user_subscriptions (user_id);
+
+-- 2. Time of the Stripe event that last changed the row
+ALTER TABLE user_subscriptions
+  ADD COLUMN IF NOT EXISTS stripe_event_created BIGINT;
+
+-- 3. Webhook events, recorded before they are acknowledged
+CREATE TABLE IF NOT EXISTS stripe_webhook_events (
+  id TEXT PRIMARY KEY,
+  type TEXT NOT NULL,
+  payload JSONB NOT NULL,
+  received_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+  processed_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS stripe_webhook_events_pending_idx
+  ON stripe_webhook_events (received_at)
+  WHERE processed_at IS NULL;
+
+ALTER TABLE stripe_webhook_events ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow service role to manage webhook events" ON stripe_webhook_events;
+CREATE POLICY "Allow service role to manage webhook events"
+  ON stripe_webhook_events FOR ALL
+  TO service_role
+  USING (true);
+
+-- 4. Write a subscription change unless a newer event was already applied
+CREATE OR REPLACE FUNCTION apply_stripe_subscription(
+  p_user_id UUID,
+  p_subscription_plan_id UUID,
+  p_status TEXT,
+  p_stripe_subscription_id TEXT,
+  p_stripe_customer_id TEXT,
+  p_current_period_end TIMESTAMPTZ,
+  p_stripe_event_created BIGINT
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER -- Run with elevated privileges
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO user_subscriptions (
+    user_id,
+    subscription_plan_id,
+    status,
+    stripe_subscription_id,
+    stripe_customer_id,
+    current_period_end,
+    stripe_event_created
+  ) VALUES (
+    p_user_id,
+    p_subscription_plan_id,
+    p_status,
+    p_stripe_subscription_id,
+    p_stripe_customer_id,
+    p_current_period_end,
+    p_stripe_event_created
+  )
+  ON CONFLICT (user_id) DO UPDATE
+  SET
+    subscription_plan_id = EXCLUDED.subscription_plan_id,
+    status = EXCLUDED.status,
+    stripe_subscription_id = EXCLUDED.stripe_subscription_id,
+    stripe_customer_id = EXCLUDED.stripe_customer_id,
+    current_period_end = EXCLUDED.current_period_end,
+    stripe_event_created = EXCLUDED.stripe_event_created,
+    updated_at = TIMEZONE('utc', NOW())
+  WHERE (
+    user_subscriptions.stripe_event_created IS NULL
+    OR user_subscriptions.stripe_event_created <= EXCLUDED.stripe_event_created
+  )
+  -- Ending a subscription the user has since replaced leaves the new one alone
+  AND NOT (
+    user_subscriptions.status = 'active'
+    AND EXCLUDED.status <> 'active'
+    AND user_subscriptions.stripe_subscription_id IS DISTINCT FROM EXCLUDED.stripe_subscription_id
+  );
+
+  -- No row is written when the update's condition fails
+  RETURN FOUND;
+END;
+$$;